@@ -0,0 +1,863 @@
+"""
+오프라인 벤치마크 (실제 계정 없이 실행)
+
+    python bot_bench.py sessions --accounts 200 --updates 3600
+    python bot_bench.py sessions --out result.json
+    python bot_bench.py batching --requests 500 --rtt 80
+    python bot_bench.py fanout --subrooms 500 --out after.json --compare before.json
+    python bot_bench.py copy --accounts 50 --sources 20
+    python bot_bench.py alert --dialogs 5000
+    python bot_bench.py dialogs --dialogs 5000
+    python bot_bench.py replay --file updates.jsonl --speed 10
+    python bot_bench.py relay --size-mb 2048 --rtt 5 --parallel 8
+    python bot_bench.py upload --size-mb 50 --accounts 3 --rtt 30
+"""
+import os
+import sys
+import json
+import time
+import random
+import atexit
+import shutil
+import asyncio
+import argparse
+import tempfile
+import tracemalloc
+import contextlib
+import io
+
+# 실제 설정 폴더를 건드리지 않도록 bot_gui import 전에 임시 폴더 지정
+BENCH_DIR = tempfile.mkdtemp(prefix="tgbot_bench_")
+os.environ["LOCALAPPDATA"] = BENCH_DIR
+atexit.register(shutil.rmtree, BENCH_DIR, True)
+
+import bot_gui
+from telethon.sessions import SQLiteSession
+from telethon.crypto import AuthKey
+from telethon import events
+from telethon.tl.types import (
+    User, Channel, InputPeerChannel, MessageMediaPhoto, MessageMediaDocument, Document, Photo,
+    Updates, UpdateMessageID, UpdateShortSentMessage
+)
+from telethon.tl.types.updates import State
+from telethon.utils import get_appropriated_part_size
+
+# --------------------- 공통 ---------------------
+def io_counters():
+    """/proc/self/io 기준 쓰기량 (리눅스 외에서는 빈 값)"""
+    try:
+        with open("/proc/self/io") as f:
+            return {k: int(v) for k, v in (line.split(": ") for line in f)}
+    except OSError:
+        return {}
+
+def io_delta(before, after):
+    return {k: after[k] - before.get(k, 0) for k in ("wchar", "syscw", "write_bytes") if k in after}
+
+def measure(fn, *args):
+    before = io_counters()
+    started = time.perf_counter()
+    result = fn(*args)
+    return {"seconds": round(time.perf_counter() - started, 4), "io": io_delta(before, io_counters()), "result": result}
+
+def fake_users(start, count):
+    return [User(id=start + i, access_hash=random.getrandbits(63), first_name=f"user{start + i}",
+                 username=f"user{start + i}") for i in range(count)]
+
+# --------------------- 세션 저장소 ---------------------
+def bench_sessions(args):
+    """기존 계정별 SQLite .session 과 메모리 세션 + 공용 스냅샷 비교 (시작 시간, 시간당 I/O)"""
+    workdir = os.path.join(BENCH_DIR, "sessions")
+    os.makedirs(workdir, exist_ok=True)
+    names = [os.path.join(workdir, f"session_{i}") for i in range(args.accounts)]
+    for i, name in enumerate(names):
+        s = SQLiteSession(name)
+        s.set_dc(2, "149.154.167.51", 443)
+        s.auth_key = AuthKey(os.urandom(256))
+        s.process_entities(fake_users(i * 100000, args.entities))
+        s.save()
+        s.close()
+
+    def open_sqlite():
+        sessions = [SQLiteSession(name) for name in names]
+        for s in sessions:
+            s.close()
+        return len(sessions)
+
+    def open_memory(save=False):
+        bot_gui.memory_sessions.clear()
+        count = len([bot_gui.open_session(name) for name in names])
+        if save:
+            bot_gui.save_session_snapshots()
+        return count
+
+    def apply_updates(sessions, per_update):
+        # 업데이트 10% 는 새 엔티티를 포함한다고 가정
+        for u in range(args.updates):
+            state = State(pts=u, qts=0, date=bot_gui.datetime.now(bot_gui.timezone.utc), seq=u, unread_count=0)
+            for i, s in enumerate(sessions):
+                if u % 10 == 0:
+                    s.process_entities(fake_users(10 ** 9 + i * args.updates + u, 1))
+                s.set_update_state(0, state)
+                per_update(u, s)
+
+    def run_sqlite():
+        sessions = [SQLiteSession(name) for name in names]
+        # 현재 방식: 업데이트마다 세션 DB 커밋
+        apply_updates(sessions, lambda u, s: s.save())
+        for s in sessions:
+            s.close()
+
+    def run_memory():
+        sessions = list(bot_gui.memory_sessions.values())
+        # 시뮬레이션 1시간 동안 업데이트가 고르게 온다고 보고 스냅샷 주기마다 한 번 저장
+        every = max(args.updates * bot_gui.session_snapshot_interval // 3600, 1)
+        batches = [0]
+        def per_update(u, s):
+            if s is sessions[-1] and (u + 1) % every == 0:
+                bot_gui.save_session_snapshots()
+                batches[0] += 1
+        apply_updates(sessions, per_update)
+        bot_gui.save_session_snapshots()
+        return batches[0] + 1
+
+    bot_gui.session_backend = "memory"
+    return {
+        "accounts": args.accounts,
+        "entities_per_account": args.entities,
+        "updates_per_hour": args.updates,
+        "sqlite": {
+            "startup": measure(open_sqlite),
+            "hour": measure(run_sqlite),
+        },
+        "memory": {
+            "startup_import": measure(open_memory, True),
+            "startup": measure(open_memory),
+            "hour": measure(run_memory),
+        },
+    }
+
+# --------------------- 가짜 클라이언트 ---------------------
+class Sim:
+    """가짜 클라이언트들이 공유하는 네트워크 조건과 RPC 집계"""
+    def __init__(self, args):
+        self.rtt = args.rtt / 1000
+        self.flood_rate = args.flood_rate
+        self.flood_seconds = args.flood_seconds
+        self.rng = random.Random(args.seed)
+        self.rpc = {}
+        self.floods = 0
+        self.handler_errors = 0
+
+    async def guard(self, coro):
+        """telethon 처럼 핸들러 예외는 세기만 하고 다음 이벤트 처리"""
+        try:
+            await coro
+        except Exception:
+            self.handler_errors += 1
+
+    async def call(self, method):
+        self.rpc[method] = self.rpc.get(method, 0) + 1
+        if self.rtt:
+            await asyncio.sleep(self.rtt)
+        if self.flood_rate and self.rng.random() < self.flood_rate:
+            self.floods += 1
+            raise bot_gui.FloodWaitError(request=None, capture=self.flood_seconds)
+
+class FakeMessage:
+    def __init__(self, id, chat_id, text="", media=None, grouped_id=None, sender_id=None):
+        self.id = id
+        self.chat_id = chat_id
+        self.raw_text = self.text = text
+        self.media = media
+        self.entities = None
+        self.grouped_id = grouped_id
+        self.sender_id = sender_id
+        self.date = bot_gui.datetime.now(bot_gui.timezone.utc)
+
+def fake_photo():
+    return MessageMediaPhoto(photo=Photo(id=random.getrandbits(62), access_hash=0, file_reference=b"",
+                                         date=None, sizes=[], dc_id=1))
+
+def fake_document():
+    return MessageMediaDocument(document=Document(id=random.getrandbits(62), access_hash=0, file_reference=b"",
+                                                  date=None, mime_type="application/octet-stream", size=0,
+                                                  dc_id=1, attributes=[]))
+
+class FakeEvent:
+    """NewMessage / MessageEdited / MessageDeleted 이벤트에서 핸들러가 쓰는 속성만"""
+    def __init__(self, message=None, sender=None, deleted_ids=None, chat_id=None):
+        self.message = message
+        self.sender = sender
+        self.deleted_ids = deleted_ids or []
+        self.chat_id = chat_id if chat_id is not None else message.chat_id
+
+    def __getattr__(self, name):
+        return getattr(self.message, name)
+
+    async def get_sender(self):
+        return self.sender
+
+class FakeDialog:
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+        self.entity = Channel(id=-id - 10 ** 12, title=name, photo=None, date=None, megagroup=True, access_hash=0)
+
+class FakeClient:
+    """
+    TelegramClient 대신 쓰는 가짜: 메서드마다 sim.rtt 만큼 걸리고 RPC 수를 셈.
+    get_input_entity 는 실제처럼 세션 캐시에서 바로 반환 (RPC 없음).
+    """
+    def __init__(self, sim, phone, user_id, dialogs=0):
+        self.sim = sim
+        self.me = User(id=user_id, phone=phone, first_name=phone, access_hash=0)
+        self.chats = {}        # chat_id → [FakeMessage] (보낸 순서)
+        self.next_id = 1
+        self.dialogs = [FakeDialog(-10 ** 12 - i, f"room {i}") for i in range(dialogs)]
+        self.handlers = []     # (이벤트 빌더, 핸들러)
+
+    def is_connected(self):
+        return True
+
+    def on(self, builder):
+        def decorator(fn):
+            self.handlers.append((builder, fn))
+            return fn
+        return decorator
+
+    async def dispatch(self, kind, event):
+        for builder, fn in self.handlers:
+            if type(builder) is kind and (builder.func is None or builder.func(event)):
+                await self.sim.guard(fn(event))
+
+    def store(self, chat_id, text="", media=None, grouped_id=None, sender_id=None, id=None):
+        if id is None:
+            id = self.next_id
+        msg = FakeMessage(id, chat_id, text, media, grouped_id, sender_id or self.me.id)
+        self.next_id = max(self.next_id, id) + 1
+        self.chats.setdefault(chat_id, []).append(msg)
+        return msg
+
+    async def get_me(self):
+        await self.sim.call("get_me")
+        return self.me
+
+    async def get_input_entity(self, peer):
+        if isinstance(peer, int) and peer < 0:
+            return InputPeerChannel(channel_id=-peer - 10 ** 12, access_hash=0)
+        return peer
+
+    async def get_entity(self, peer):
+        await self.sim.call("get_entity")
+        return next((d.entity for d in self.dialogs if d.id == peer), None)
+
+    @staticmethod
+    def chat_of(ent):
+        return -ent.channel_id - 10 ** 12 if isinstance(ent, InputPeerChannel) else ent
+
+    async def send_message(self, ent, text, **kwargs):
+        await self.sim.call("send_message")
+        return self.store(self.chat_of(ent), text)
+
+    async def send_file(self, ent, file=None, files=None, caption=None, **kwargs):
+        await self.sim.call("send_file")
+        chat = self.chat_of(ent)
+        if files is not None:
+            return [self.store(chat, caption or "", media=f) for f in files]
+        return self.store(chat, caption or "", media=file)
+
+    async def edit_message(self, ent, msg_id, text=None, **kwargs):
+        await self.sim.call("edit_message")
+
+    async def delete_messages(self, ent, msg_ids):
+        await self.sim.call("delete_messages")
+
+    async def iter_messages(self, chat, from_user=None, limit=None):
+        await self.sim.call("get_history")
+        msgs = self.chats.get(self.chat_of(chat), [])
+        for m in reversed(msgs[-limit:] if limit else msgs):
+            yield m
+
+    async def get_messages(self, chat, ids=None):
+        await self.sim.call("get_messages")
+        by_id = {m.id: m for m in self.chats.get(self.chat_of(chat), [])}
+        return [by_id.get(i) for i in ids]
+
+    async def send_request(self, request):
+        """outbox 가 보내는 Send*Request: 메시지를 저장하고 텔레그램처럼 random_id → id 로 응답"""
+        chat = self.chat_of(request.peer)
+        if isinstance(request, bot_gui.SendMessageRequest):
+            await self.sim.call("send_message")
+            return UpdateShortSentMessage(id=self.store(chat, request.message).id, pts=0, pts_count=0, date=None)
+        await self.sim.call("send_file")
+        if isinstance(request, bot_gui.SendMultiMediaRequest):
+            items = [(m.message, m.media, m.random_id) for m in request.multi_media]
+        else:
+            items = [(request.message, request.media, request.random_id)]
+        updates = [UpdateMessageID(self.store(chat, text, media=media).id, rid) for text, media, rid in items]
+        return Updates(updates=updates, users=[], chats=[], date=None, seq=0)
+
+    async def iter_dialogs(self):
+        for i, d in enumerate(self.dialogs):
+            if i % 100 == 0:
+                await self.sim.call("get_dialogs")
+            yield d
+
+    async def __call__(self, request):
+        if isinstance(request, list):
+            await self.sim.call("container")
+            return [True] * len(request)
+        if isinstance(request, (bot_gui.SendMessageRequest, bot_gui.SendMediaRequest, bot_gui.SendMultiMediaRequest)):
+            return await self.send_request(request)
+        await self.sim.call(type(request).__name__)
+        return True
+
+def install_accounts(sim, accounts, dialogs=0):
+    """계정 목록을 accounts.json 에 저장하고 계정마다 가짜 클라이언트 등록"""
+    bot_gui.clients.clear()
+    for i, acc in enumerate(accounts):
+        bot_gui.clients[acc["phone"]] = FakeClient(sim, acc["phone"], 10 ** 8 + i, dialogs)
+    bot_gui.save_accounts(accounts)
+    return accounts
+
+def make_accounts(sim, count, subrooms, dialogs=0, **extra):
+    accounts = [{"phone": f"8210{i:07d}", "main_chat_id": -10 ** 12 - 10 ** 6 - i,
+                 "subroom_ids": [-10 ** 12 - 2 * 10 ** 6 - i * 10 ** 4 - r for r in range(subrooms)], **extra}
+                for i in range(count)]
+    return install_accounts(sim, accounts, dialogs)
+
+async def drain_tasks():
+    """핸들러가 따로 띄운 작업(방배끼기 전달 등)이 모두 끝날 때까지 대기"""
+    me = asyncio.current_task()
+    while True:
+        pending = [t for t in asyncio.all_tasks() if t is not me and not t.done()]
+        if not pending:
+            return
+        await asyncio.gather(*pending, return_exceptions=True)
+
+def run_phase(sim, coro_fn, memory=True):
+    """한 단계 실행: 소요 시간, RPC 수, 핸들러 로그 줄 수, 최대 메모리"""
+    rpc_before = dict(sim.rpc)
+    out = io.StringIO()
+    if memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(out):
+        asyncio.run(coro_fn())
+    seconds = time.perf_counter() - started
+    result = {"seconds": round(seconds, 4)}
+    if memory:
+        result["peak_kb"] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+        tracemalloc.stop()
+    result["rpc"] = {k: v - rpc_before.get(k, 0) for k, v in sim.rpc.items() if v != rpc_before.get(k, 0)}
+    result["rpc_total"] = sum(result["rpc"].values())
+    result["log_lines"] = out.getvalue().count("\n")
+    return result
+
+def latency_report():
+    report = {}
+    for name in ("first_room_sent_seconds", "last_room_sent_seconds"):
+        count, p50, p99, peak = bot_gui.metrics.histogram_summary(name)
+        if count:
+            report[name] = {"count": count, "p50": round(p50, 4), "p99": round(p99, 4), "max": round(peak, 4)}
+    return report
+
+def reset_runtime(args):
+    bot_gui.metrics = bot_gui.Metrics()
+    bot_gui.delete_map.clear()
+    bot_gui.media_groups.clear()
+    bot_gui.send_delay = args.send_delay
+    bot_gui.media_group_timeout = args.album_wait / 1000
+
+# --------------------- 메인방 → 서브방 ---------------------
+def bench_fanout(args):
+    """메인방 1개 → 서브방 N개: 텍스트, 앨범, 수정, 삭제를 실제 핸들러로 처리"""
+    reset_runtime(args)
+    sim = Sim(args)
+    acc = make_accounts(sim, 1, args.subrooms)[0]
+    client = bot_gui.clients[acc["phone"]]
+    main = acc["main_chat_id"]
+    posted = []
+
+    async def texts():
+        for i in range(args.messages):
+            msg = client.store(main, f"post {i} https://example.com")
+            posted.append(msg)
+            await sim.guard(bot_gui.handle_new_message(FakeEvent(msg), client, acc["subroom_ids"], acc))
+
+    async def album():
+        group = [client.store(main, "album" if i == 0 else "", media=fake_photo(), grouped_id=77)
+                 for i in range(args.album)]
+        await asyncio.gather(*(sim.guard(bot_gui.handle_new_message(FakeEvent(m), client, acc["subroom_ids"], acc))
+                               for m in group))
+
+    async def edit():
+        msg = posted[-1]
+        msg.raw_text = msg.text = "edited https://example.com"
+        await sim.guard(bot_gui.handle_message_edit(FakeEvent(msg), client, acc["subroom_ids"], acc))
+
+    async def delete():
+        await sim.guard(bot_gui.handle_deleted_event(FakeEvent(deleted_ids=[m.id for m in posted], chat_id=main),
+                                                     acc["phone"]))
+
+    phases = {}
+    for name, fn in (("text", texts), ("album", album), ("edit", edit), ("delete", delete)):
+        phases[name] = run_phase(sim, fn, args.memory)
+    sends = args.messages * args.subrooms
+    phases["text"]["sends_per_second"] = round(sends / max(phases["text"]["seconds"], 1e-9), 1)
+    return {"subrooms": args.subrooms, "messages": args.messages, "album": args.album,
+            "rtt_ms": args.rtt, "send_delay": args.send_delay, "floods": sim.floods, "handler_errors": sim.handler_errors,
+            "phases": phases, "latency": latency_report()}
+
+# --------------------- 방배끼기 ---------------------
+def bench_copy(args):
+    """계정 N개 × 소스방 M개: 소스방 메시지를 모든 계정의 방배끼기 핸들러로 전달"""
+    reset_runtime(args)
+    sim = Sim(args)
+    accounts = make_accounts(sim, args.accounts, args.copy_subrooms)
+    sources = [-10 ** 12 - 5 * 10 ** 6 - i for i in range(args.sources)]
+    bot_gui.copy_source_chats[:] = sources
+    bot_gui.copy_enabled = True
+    bot_gui.copy_sender_mapping.clear()
+    bot_gui.copy_msg_mapping.clear()
+    bot_gui.copy_handler_registered.clear()
+    senders = [User(id=5 * 10 ** 8 + i, first_name=f"sender{i}", access_hash=0) for i in range(args.sources * 3)]
+    rng = random.Random(args.seed)
+
+    for acc in accounts:
+        bot_gui.add_copy_handler(bot_gui.clients[acc["phone"]], acc["phone"])
+
+    async def burst():
+        # 방배끼기 전달은 대상 계정 루프로 넘겨지므로 모두 현재 루프로 지정
+        loop = asyncio.get_running_loop()
+        for acc in accounts:
+            bot_gui.client_loops[acc["phone"]] = loop
+        for i in range(args.messages):
+            src = sources[i % len(sources)]
+            sender = rng.choice(senders)
+            msg = FakeMessage(10 ** 6 + i, src, f"copy {i}", sender_id=sender.id)
+            # 같은 소스방 메시지는 모든 계정이 받음
+            await asyncio.gather(*(bot_gui.clients[a["phone"]].dispatch(events.NewMessage, FakeEvent(msg, sender))
+                                   for a in accounts))
+        await drain_tasks()
+
+    result = run_phase(sim, burst, args.memory)
+    result["messages_per_second"] = round(args.messages / max(result["seconds"], 1e-9), 1)
+    bot_gui.copy_enabled = False
+    return {"accounts": args.accounts, "sources": args.sources, "messages": args.messages,
+            "subrooms_per_account": args.copy_subrooms, "rtt_ms": args.rtt, "floods": sim.floods, "handler_errors": sim.handler_errors,
+            "burst": result, "latency": latency_report()}
+
+# --------------------- 알림 ---------------------
+def bench_alert(args):
+    """감시방 메시지 → 알림 전송 (계정당 대화방 수천 개)"""
+    reset_runtime(args)
+    sim = Sim(args)
+    rooms = [-10 ** 12 - i for i in range(0, args.dialogs, max(args.dialogs // 50, 1))]
+    accounts = make_accounts(sim, args.accounts, 0, args.dialogs, alert_monitor=True, alert_rooms=rooms)
+    bot_gui.alert_notify_chat = -10 ** 12 - 9 * 10 ** 6
+    bot_gui.alert_room_names.clear()
+    bot_gui.dialog_tables.clear()
+    sender = User(id=7 * 10 ** 8, first_name="someone", access_hash=0)
+    handlers = {a["phone"]: bot_gui.make_alert_handler(a["phone"]) for a in accounts}
+
+    async def burst():
+        for i in range(args.messages):
+            msg = FakeMessage(i + 1, rooms[i % len(rooms)], f"alert {i}", sender_id=sender.id)
+            await asyncio.gather(*(sim.guard(h(FakeEvent(msg, sender))) for h in handlers.values()))
+
+    result = run_phase(sim, burst, args.memory)
+    result["events_per_second"] = round(args.messages * len(accounts) / max(result["seconds"], 1e-9), 1)
+    return {"accounts": args.accounts, "dialogs": args.dialogs, "messages": args.messages,
+            "rtt_ms": args.rtt, "floods": sim.floods, "handler_errors": sim.handler_errors, "burst": result, "latency": latency_report()}
+
+# --------------------- 대화방 목록 ---------------------
+def bench_dialogs(args):
+    """대화방 수천 개 목록 받기 + 색인 + 검색"""
+    sim = Sim(args)
+    client = FakeClient(sim, "82100000000", 1, args.dialogs)
+    rows = []
+
+    async def fetch():
+        rows.extend(await bot_gui.fetch_dialog_table(client))
+
+    fetched = run_phase(sim, fetch, args.memory)
+    table = bot_gui.index_dialog_rows(rows)
+    queries = ["room 1", "room 42", "9", "없음"]
+    started = time.perf_counter()
+    for _ in range(20):
+        for q in queries:
+            bot_gui.search_dialog_table(table, q)
+    search_ms = (time.perf_counter() - started) * 1000 / (20 * len(queries))
+    return {"dialogs": args.dialogs, "fetch": fetched, "search_ms": round(search_ms, 3)}
+
+# --------------------- 기록 재현 ---------------------
+def read_recording(path):
+    """(마지막 헤더, 그 뒤 이벤트 목록)"""
+    header, rows = None, []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            if row["k"] == "h":
+                header, rows = row, []
+            else:
+                rows.append(row)
+    if header is None:
+        raise SystemExit(f"{path}: 헤더가 없는 기록 파일")
+    return header, rows
+
+def replay_media(shape):
+    if not shape:
+        return None
+    return fake_photo() if shape["type"] == "photo" else fake_document()
+
+def bench_replay(args):
+    """
+    bot_gui 가 기록한 업데이트(record_updates)를 가짜 클라이언트 위에서 실제 핸들러로 재현.
+    --speed 1 은 기록된 시간 간격 그대로, 10 은 10배 빠르게, 0 은 기다리지 않음.
+    """
+    if not args.file:
+        raise SystemExit("replay: --file 필요")
+    header, rows = read_recording(args.file)
+    reset_runtime(args)
+    sim = Sim(args)
+    accounts = [dict(a, subroom_ids=a.get("subroom_ids") or []) for a in header["accounts"]]
+    install_accounts(sim, accounts)
+    by_phone = {a["phone"]: a for a in accounts}
+    bot_gui.copy_source_chats[:] = header.get("copy_source_chats", [])
+    bot_gui.copy_enabled = bool(bot_gui.copy_source_chats)
+    bot_gui.copy_sender_mapping.clear()
+    bot_gui.copy_msg_mapping.clear()
+    bot_gui.copy_handler_registered.clear()
+    bot_gui.expert_accounts[:] = header.get("expert_accounts", [])
+    bot_gui.alert_notify_chat = header.get("alert_notify_chat")
+    for acc in accounts:
+        bot_gui.add_copy_handler(bot_gui.clients[acc["phone"]], acc["phone"])
+    alert_handlers = {a["phone"]: bot_gui.make_alert_handler(a["phone"]) for a in accounts if a.get("alert_monitor")}
+    kinds = {}
+    lag = {"max": 0.0}
+
+    def route(row):
+        """기록 한 줄 → 실제로 이 이벤트를 받았을 핸들러 코루틴 목록"""
+        acc = by_phone.get(row["p"])
+        if acc is None:
+            return []
+        client = bot_gui.clients[row["p"]]
+        chat = row["c"]
+        in_main = chat is not None and chat == acc.get("main_chat_id")
+        in_copy = chat in bot_gui.copy_source_chats
+        if row["k"] == "d":
+            event = FakeEvent(deleted_ids=row["ids"], chat_id=chat)
+            jobs = [bot_gui.handle_deleted_event(event, row["p"])] if in_main else []
+            if in_copy:
+                jobs.append(client.dispatch(events.MessageDeleted, event))
+            return jobs
+        text = row.get("x") or "x" * row.get("n", 0)
+        sender_id = client.me.id if row.get("o") else row.get("s")
+        sender = User(id=sender_id or 0, first_name=f"user{sender_id}", access_hash=0)
+        media = replay_media(row.get("m"))
+        if row["k"] == "n":
+            if in_main:
+                msg = client.store(chat, text, media, row.get("g"), sender_id, id=row["i"])
+            else:
+                msg = FakeMessage(row["i"], chat, text, media, row.get("g"), sender_id)
+            event = FakeEvent(msg, sender)
+            jobs = [bot_gui.handle_new_message(event, client, acc["subroom_ids"], acc)] if in_main else []
+            if in_copy:
+                jobs.append(client.dispatch(events.NewMessage, event))
+            rooms = acc.get("alert_rooms") or []
+            if row["p"] in alert_handlers and (not rooms or chat in rooms):
+                jobs.append(alert_handlers[row["p"]](event))
+            return jobs
+        stored = next((m for m in client.chats.get(chat, []) if m.id == row["i"]), None)
+        msg = stored or FakeMessage(row["i"], chat, text, media, row.get("g"), sender_id)
+        msg.raw_text = msg.text = text
+        event = FakeEvent(msg, sender)
+        jobs = [bot_gui.handle_message_edit(event, client, acc["subroom_ids"], acc)] if in_main else []
+        if in_copy:
+            jobs.append(client.dispatch(events.MessageEdited, event))
+        return jobs
+
+    async def replay():
+        loop = asyncio.get_running_loop()
+        for acc in accounts:
+            bot_gui.client_loops[acc["phone"]] = loop
+        started = loop.time()
+        for row in rows:
+            kinds[row["k"]] = kinds.get(row["k"], 0) + 1
+            if args.speed:
+                due = started + row["t"] / 1000 / args.speed
+                if due > loop.time():
+                    await asyncio.sleep(due - loop.time())
+                lag["max"] = max(lag["max"], loop.time() - due)
+            # telethon 처럼 이벤트마다 핸들러를 동시에 실행
+            for job in route(row):
+                loop.create_task(sim.guard(job))
+            await asyncio.sleep(0)
+        await drain_tasks()
+
+    result = run_phase(sim, replay, args.memory)
+    bot_gui.copy_enabled = False
+    span = rows[-1]["t"] / 1000 if rows else 0
+    return {"file": args.file, "events": len(rows), "kinds": kinds, "recorded_seconds": span,
+            "speed": args.speed, "rtt_ms": args.rtt, "floods": sim.floods, "handler_errors": sim.handler_errors,
+            "max_schedule_lag": round(lag["max"], 4), "replay": result, "latency": latency_report()}
+
+# --------------------- 결과 비교 ---------------------
+def flatten(value, prefix=""):
+    if isinstance(value, dict):
+        out = {}
+        for k, v in value.items():
+            out.update(flatten(v, f"{prefix}.{k}" if prefix else k))
+        return out
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix: value}
+    return {}
+
+def compare(old, new):
+    """두 결과 JSON 의 숫자 항목 비교 (이전, 이후, 비율)"""
+    before, after = flatten(old.get("result", {})), flatten(new.get("result", {}))
+    rows = {}
+    for key in sorted(set(before) & set(after)):
+        if before[key] != after[key]:
+            ratio = after[key] / before[key] if before[key] else None
+            rows[key] = [before[key], after[key], round(ratio, 3) if ratio is not None else None]
+    return rows
+
+# --------------------- 요청 묶음 전송 ---------------------
+class RttClient:
+    """client(request) / client([...]) 한 번마다 왕복 시간만큼 걸리는 가짜 클라이언트"""
+    def __init__(self, rtt, fail_every=0):
+        self.rtt = rtt
+        self.fail_every = fail_every
+        self.round_trips = 0
+        self.handled = 0
+
+    def answer(self, request):
+        self.handled += 1
+        if self.fail_every and self.handled % self.fail_every == 0:
+            return bot_gui.FloodWaitError(request=request, capture=1)
+        return True
+
+    async def __call__(self, request):
+        self.round_trips += 1
+        await asyncio.sleep(self.rtt)
+        if isinstance(request, list):
+            answers = [self.answer(r) for r in request]
+            errors = [a if isinstance(a, Exception) else None for a in answers]
+            if any(errors):
+                raise bot_gui.MultiError(errors, [None if e else a for a, e in zip(answers, errors)], request)
+            return answers
+        answer = self.answer(request)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+def bench_batching(args):
+    """서로 다른 방 삭제 요청: 기존 순차 전송 / 동시 개별 전송 / 묶음 전송 (왕복 수, 소요 시간)"""
+    rtt = args.rtt / 1000
+    requests = [bot_gui.DeleteMessagesRequest([i], revoke=True) for i in range(args.requests)]
+
+    async def sequential(client):
+        for r in requests:
+            try:
+                await client(r)
+            except Exception:
+                pass
+
+    async def concurrent(client):
+        await asyncio.gather(*(client(r) for r in requests), return_exceptions=True)
+
+    async def batched(client):
+        results = await asyncio.gather(*(bot_gui.batched_call(client, r) for r in requests), return_exceptions=True)
+        return sum(isinstance(r, Exception) for r in results)
+
+    def run(mode):
+        client = RttClient(rtt, args.fail_every)
+        started = time.perf_counter()
+        failed = asyncio.run(mode(client))
+        result = {"seconds": round(time.perf_counter() - started, 4), "round_trips": client.round_trips}
+        if failed is not None:
+            result["errors_routed"] = failed
+        return result
+
+    return {
+        "requests": args.requests,
+        "rtt_ms": args.rtt,
+        "batch_max_size": bot_gui.batch_max_size,
+        "sequential": run(sequential),
+        "concurrent": run(concurrent),
+        "batched": run(batched),
+    }
+
+# --------------------- 큰 미디어 중계 ---------------------
+class PartClient:
+    """조각 하나를 받거나 올릴 때마다 왕복 시간만큼 걸리는 가짜 클라이언트 (받은 바이트는 버림)"""
+    def __init__(self, rtt, size):
+        self.rtt = rtt
+        self.size = size
+        self.parts = 0
+        self.bytes = 0
+        self.active = 0
+        self.max_active = 0
+
+    async def iter_download(self, media, request_size=bot_gui.UPLOAD_PART_SIZE):
+        sent = 0
+        while sent < self.size:
+            await asyncio.sleep(self.rtt)
+            chunk = bytes(min(request_size, self.size - sent))
+            sent += len(chunk)
+            yield chunk
+
+    async def __call__(self, request):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        await asyncio.sleep(self.rtt)
+        self.active -= 1
+        self.parts += 1
+        self.bytes += len(request.bytes)
+        return True
+
+def bench_relay(args):
+    """큰 문서 계정 간 전달: 전부 받은 뒤 순차 업로드 / 받으면서 조각 동시 업로드 (시간, 최대 메모리)
+    조각 업로드마다 --rtt, 원본 조각 받기마다 --download-rtt"""
+    size = int(args.size_mb * 2 ** 20)
+    rtt = args.rtt / 1000
+    part = bot_gui.UPLOAD_PART_SIZE
+    media = MessageMediaDocument(document=Document(
+        id=1, access_hash=0, file_reference=b"", date=None, mime_type="video/mp4",
+        size=size, dc_id=1, attributes=[]))
+
+    async def buffered(src, tgt):
+        data = bytearray()
+        async for chunk in src.iter_download(media):
+            data += chunk
+        view = memoryview(data)
+        for index in range(0, len(data), part):
+            await tgt(bot_gui.SaveBigFilePartRequest(0, index // part, -(-size // part), bytes(view[index:index + part])))
+
+    async def relay(src, tgt):
+        await bot_gui.relay_media(src, tgt, media, "file.mp4")
+
+    def run(mode):
+        src, tgt = PartClient(args.download_rtt / 1000, size), PartClient(rtt, size)
+        tracemalloc.start()
+        started = time.perf_counter()
+        asyncio.run(mode(src, tgt))
+        seconds = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return {"seconds": round(seconds, 4), "peak_mb": round(peak / 2 ** 20, 2),
+                "parts": tgt.parts, "bytes_ok": tgt.bytes == size, "max_parallel": tgt.max_active}
+
+    reset_runtime(args)
+    bot_gui.relay_parallel_parts = args.parallel
+    return {
+        "size_mb": args.size_mb,
+        "rtt_ms": args.rtt,
+        "download_rtt_ms": args.download_rtt,
+        "parallel": args.parallel,
+        "buffered": run(buffered),
+        "relay": run(relay),
+    }
+
+def bench_upload(args):
+    """로컬 파일을 계정 --accounts 개(최대 10)에 한 번씩 업로드: 조각을 하나씩(telethon upload_file 방식) / 동시 업로드"""
+    size = int(args.size_mb * 2 ** 20)
+    path = os.path.join(BENCH_DIR, "upload.bin")
+    with open(path, "wb") as f:
+        f.write(os.urandom(min(size, 2 ** 20)) * (size // 2 ** 20) + os.urandom(size % 2 ** 20))
+    accounts = min(args.accounts, 10)
+
+    async def sequential(client):
+        part = get_appropriated_part_size(size) * 1024
+        return await bot_gui.upload_parts(client, bot_gui.read_parts(path, part), size, "upload.bin", part, parallel=1)
+
+    async def parallel(client):
+        return await bot_gui.upload_local_file(client, path, "upload.bin")
+
+    def run(mode):
+        clients = [PartClient(args.rtt / 1000, 0) for _ in range(accounts)]
+        started = time.perf_counter()
+
+        async def all_accounts():
+            return await asyncio.gather(*(mode(c) for c in clients))
+        handles = asyncio.run(all_accounts())
+        return {"seconds": round(time.perf_counter() - started, 4),
+                "parts_per_account": clients[0].parts, "max_parallel": clients[0].max_active,
+                "bytes_ok": all(c.bytes == size for c in clients),
+                "handle": type(handles[0]).__name__}
+
+    reset_runtime(args)
+    bot_gui.upload_parallel_parts = args.parallel
+    return {
+        "size_mb": args.size_mb,
+        "rtt_ms": args.rtt,
+        "accounts": accounts,
+        "part_kb": bot_gui.upload_part_size(size) // 1024,
+        "sequential": run(sequential),
+        "parallel": run(parallel),
+    }
+
+# --------------------- 실행 ---------------------
+SCENARIOS = {
+    "sessions": bench_sessions,
+    "batching": bench_batching,
+    "fanout": bench_fanout,
+    "copy": bench_copy,
+    "alert": bench_alert,
+    "dialogs": bench_dialogs,
+    "replay": bench_replay,
+    "relay": bench_relay,
+    "upload": bench_upload,
+}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="텔레그램 봇 오프라인 벤치마크")
+    parser.add_argument("scenario", choices=sorted(SCENARIOS))
+    parser.add_argument("--accounts", type=int, default=100)
+    parser.add_argument("--entities", type=int, default=500, help="계정별 기존 엔티티 수")
+    parser.add_argument("--updates", type=int, default=600, help="계정별 시간당 업데이트 수")
+    parser.add_argument("--requests", type=int, default=200, help="묶음 전송 벤치 요청 수")
+    parser.add_argument("--rtt", type=float, help="가짜 왕복 시간 (ms, 기본: batching 80, 그 밖의 시나리오 20)")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="RPC 당 FloodWait 확률")
+    parser.add_argument("--flood-seconds", type=int, default=0)
+    parser.add_argument("--send-delay", type=float, default=0.0, help="bot_gui.send_delay (실제 기본값 0.5)")
+    parser.add_argument("--album-wait", type=float, default=50, help="앨범 모으는 시간 (ms)")
+    parser.add_argument("--subrooms", type=int, default=500)
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--album", type=int, default=5, help="앨범 사진 수")
+    parser.add_argument("--sources", type=int, default=20, help="방배끼기 소스방 수")
+    parser.add_argument("--copy-subrooms", type=int, default=5, help="방배끼기 대상 계정별 서브방 수")
+    parser.add_argument("--dialogs", type=int, default=3000, help="계정별 대화방 수")
+    parser.add_argument("--file", help="replay: bot_gui 의 record_updates 기록 파일")
+    parser.add_argument("--speed", type=float, default=1, help="replay 배속 (0 = 대기 없이)")
+    parser.add_argument("--size-mb", type=float, default=64, help="relay/upload: 파일 크기 (MB)")
+    parser.add_argument("--parallel", type=int, default=4, help="relay/upload: 동시에 올리는 조각 수")
+    parser.add_argument("--download-rtt", type=float, default=2, help="relay: 원본 조각 하나 받는 시간 (ms)")
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="tracemalloc 끄기 (시간 측정만)")
+    parser.add_argument("--fail-every", type=int, default=25, help="N 번째 요청마다 FloodWait 오류")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="결과 JSON 저장 경로")
+    parser.add_argument("--compare", help="비교할 이전 결과 JSON")
+    args = parser.parse_args(argv)
+    if args.rtt is None:
+        # batching 은 처음부터 80ms 로 측정해 왔으므로 이전 결과와 비교할 수 있게 유지
+        args.rtt = 80 if args.scenario == "batching" else 20
+    random.seed(args.seed)
+    result = {"scenario": args.scenario, "time": time.time(), "args": vars(args),
+              "result": SCENARIOS[args.scenario](args)}
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            result["compare"] = compare(json.load(f), result)
+    text = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,15 +1,32 @@
 import os
 import sys
 import json
+import copy
+import atexit
+import tempfile
+import sqlite3
+import base64
+from datetime import datetime, timezone
 import asyncio
 import time
 import random
+import re
 import uuid
+import hashlib
+import queue
+import concurrent.futures
+import weakref
+import itertools
+import threading
+import traceback
+import math
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import tkinter as tk
 import tkinter.ttk as ttk
 import tkinter.messagebox as messagebox
-from threading import Thread
-from collections import defaultdict
+from threading import Thread, Event, Timer, RLock
+from collections import defaultdict, deque, OrderedDict
+from contextlib import asynccontextmanager, AsyncExitStack
 
 from telethon import TelegramClient, events
 from telethon.tl.types import (
@@ -18,36 +35,184 @@ from telethon.tl.types import (
     MessageMediaWebPage,
     ChatBannedRights,
     Channel,
-    Chat
+    ChannelForbidden,
+    Chat,
+    ChatForbidden,
+    ChatInviteAlready,
+    InputChannel,
+    InputFile,
+    InputFileBig,
+    InputPeerChannel,
+    InputPeerChat,
+    InputSingleMedia,
+    InputUserSelf,
+    UpdateMessageID,
+    UpdateShortSentMessage
 )
 try:
-    from telethon.tl.types import ChannelBannedRights
+    from telethon.tl.types import ChatInvitePeek
 except ImportError:
-    ChannelBannedRights = ChatBannedRights
+    ChatInvitePeek = ChatInviteAlready
 from telethon.tl.functions.messages import (
     ImportChatInviteRequest,
-    EditChatDefaultBannedRightsRequest
+    CheckChatInviteRequest,
+    DeleteChatUserRequest,
+    EditChatDefaultBannedRightsRequest,
+    GetChatsRequest,
+    DeleteMessagesRequest,
+    SendMessageRequest,
+    SendMediaRequest,
+    SendMultiMediaRequest
 )
 from telethon.tl.functions.channels import (
+    JoinChannelRequest,
     LeaveChannelRequest,
     GetParticipantRequest,
-    EditBannedRequest
+    GetChannelsRequest,
+    GetFullChannelRequest,
+    DeleteMessagesRequest as DeleteChannelMessagesRequest
 )
+from telethon.tl.functions.upload import SaveFilePartRequest, SaveBigFilePartRequest
+from telethon.errors import (
+    MultiError,
+    ChatNotModifiedError,
+    ChannelPrivateError,
+    ChannelInvalidError,
+    ChatIdInvalidError,
+    PeerIdInvalidError,
+    ChatWriteForbiddenError,
+    ChatRestrictedError,
+    ChatGuestSendForbiddenError,
+    ChatAdminRequiredError,
+    SlowModeWaitError,
+    RandomIdDuplicateError,
+    MessageNotModifiedError,
+    FloodWaitError,
+    FileReferenceExpiredError,
+    MediaEmptyError,
+    UserAlreadyParticipantError,
+    UserNotParticipantError
+)
+from telethon.utils import get_peer_id, get_extension, get_input_media, is_image
+from telethon.sessions import MemorySession
+from telethon.crypto import AuthKey
+from telethon.tl.types.updates import State
 
 # ─── 설정 파일 경로 및 초기화 ──────────────────────────────────
 
+_config_dir = None
+
 def get_config_dir():
     # Windows: %LOCALAPPDATA%\MyTelegramBot
     # macOS/Linux: ~/.config/MyTelegramBot
-    base = os.getenv("LOCALAPPDATA") or os.path.expanduser("~/.config")
-    cfg = os.path.join(base, "MyTelegramBot")
-    os.makedirs(cfg, exist_ok=True)
-    return cfg
+    global _config_dir
+    if _config_dir is None:
+        base = os.getenv("LOCALAPPDATA") or os.path.expanduser("~/.config")
+        cfg = os.path.join(base, "MyTelegramBot")
+        os.makedirs(cfg, exist_ok=True)
+        _config_dir = cfg
+    return _config_dir
 
 def config_path(fname: str) -> str:
     """설정 파일 전체 경로 반환"""
     return os.path.join(get_config_dir(), fname)
 
+# ─── 설정 저장소 (메모리 캐시 + 모아서 원자적 저장) ─────────────────
+
+config_write_delay = 0.5   # 저장 요청을 모아서 파일에 쓰기까지 대기(초)
+
+class ConfigStore:
+    """
+    설정 파일은 한 번만 읽어 메모리에서 제공하고, 쓰기는 모아서 임시파일 → rename 으로 저장.
+    캐시된 값은 넣을 때와 꺼낼 때 모두 사본이므로 어느 스레드도 직접 고치지 못함 (바꾸려면 set).
+    """
+    def __init__(self, delay=config_write_delay):
+        self.delay = delay
+        self.data = {}
+        self.dirty = set()
+        self.indents = {}      # 이름 → json 들여쓰기 (큰 목록은 None 으로 한 줄에)
+        self.listeners = defaultdict(list)
+        self.lock = RLock()          # data/dirty/timer
+        self.write_lock = RLock()    # 파일 쓰기 순서 (타이머와 atexit flush 가 겹칠 때)
+        self.timer = None
+
+    def get(self, name, default=None):
+        if name in self.data:
+            return copy.deepcopy(self.data[name])
+        with self.lock:
+            if name not in self.data:
+                try:
+                    with open(config_path(name), "r", encoding="utf-8") as f:
+                        self.data[name] = json.load(f)
+                except FileNotFoundError:
+                    self.data[name] = copy.deepcopy(default)
+                except Exception as e:
+                    print(f"{name} 파일 로드 오류: {e}")
+                    self.data[name] = copy.deepcopy(default)
+            return copy.deepcopy(self.data[name])
+
+    def set(self, name, value, indent=2):
+        stored = copy.deepcopy(value)
+        with self.lock:
+            self.data[name] = stored
+            self.dirty.add(name)
+            self.indents[name] = indent
+            if self.timer is None:
+                self.timer = Timer(self.delay, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+        self.publish(name, value)
+
+    def update(self, name, **changes):
+        with self.lock:
+            value = self.get(name, {}) or {}
+            value.update(changes)
+            self.set(name, value)
+
+    def subscribe(self, name, callback):
+        """설정이 바뀌면 callback(value) 호출 (바꾼 쪽 스레드에서 실행)"""
+        self.listeners[name].append(callback)
+
+    def publish(self, name, value):
+        for cb in list(self.listeners[name]):
+            try:
+                cb(value)
+            except Exception as e:
+                print(f"{name} 변경 알림 오류: {e}")
+
+    def flush(self):
+        with self.write_lock:
+            with self.lock:
+                if self.timer is not None:
+                    self.timer.cancel()
+                    self.timer = None
+                # 저장된 값은 고쳐지지 않고 set 으로 통째로 바뀌기만 하므로 참조만 잡고, fsync 는 잠금 밖에서
+                pending = {n: (self.data[n], self.indents.get(n, 2)) for n in self.dirty}
+                self.dirty.clear()
+            for name, (value, indent) in pending.items():
+                self.write_atomic(name, value, indent)
+
+    def write_atomic(self, name, value, indent=2):
+        path = config_path(name)
+        folder = os.path.dirname(path)
+        os.makedirs(folder, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=folder, prefix=".tmp_", suffix=".json")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(value, f, indent=indent, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+        except Exception as e:
+            print(f"{name} 저장 오류: {e}")
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+config_store = ConfigStore()
+atexit.register(config_store.flush)
+
 def ensure_config_files():
     """최초 실행 시 설정 파일이 없으면 기본값으로 생성"""
     defaults = {
@@ -56,82 +221,253 @@ def ensure_config_files():
         "exclude_list.json":  {"join_exclude": []},
     }
     for name, data in defaults.items():
-        p = config_path(name)
-        if not os.path.isfile(p):
-            with open(p, "w", encoding="utf-8") as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
+        if not os.path.isfile(config_path(name)):
+            config_store.write_atomic(name, data)
 
 
 # ─── 설정 파일 I/O 함수 ───────────────────────────────────────
 
 def save_alert_settings(settings):
-    try:
-        with open(config_path("alert_settings.json"), "w", encoding="utf-8") as f:
-            json.dump(settings, f, indent=2, ensure_ascii=False)
-    except Exception as e:
-        print("alert_settings.json 저장 오류:", e)
+    config_store.set("alert_settings.json", settings)
 
 def load_alert_settings():
-    try:
-        with open(config_path("alert_settings.json"), "r", encoding="utf-8") as f:
-            return json.load(f)
-    except:
-        return {}
-
-def load_admin_data():
-    global admin_accounts_list, admin_rooms_list, admin_function_settings, admin_enabled
-    settings = load_alert_settings()
-    admin_accounts_list = settings.get("admin_accounts_list", [])
-    admin_rooms_list    = settings.get("admin_rooms_list", [])
-    admin_function_settings = settings.get("admin_function_settings", {})
-    # 기본값 보장
-    default_funcs = {
-        "send_message": True,
-        "send_media_photo": True,
-        # … 나머지도 적절히 …
-    }
-    for k, v in default_funcs.items():
-        admin_function_settings.setdefault(k, v)
-    admin_enabled = settings.get("admin_enabled", False)
-
-def save_admin_data():
-    s = load_alert_settings()
-    s["admin_accounts_list"]   = admin_accounts_list
-    s["admin_rooms_list"]      = admin_rooms_list
-    s["admin_function_settings"]= admin_function_settings
-    s["admin_enabled"]         = admin_enabled
-    save_alert_settings(s)
+    """수정해서 save_alert_settings 로 돌려줄 수 있는 설정 사본"""
+    return config_store.get("alert_settings.json", {}) or {}
 
 def load_exclude_list():
-    try:
-        with open(config_path("exclude_list.json"), "r", encoding="utf-8") as f:
-            return json.load(f).get("join_exclude", [])
-    except:
-        return []
+    return list(config_store.get("exclude_list.json", {"join_exclude": []}).get("join_exclude", []))
 
 def save_exclude_list(lst):
-    try:
-        with open(config_path("exclude_list.json"), "w", encoding="utf-8") as f:
-            json.dump({"join_exclude": lst}, f, indent=2, ensure_ascii=False)
-    except Exception as e:
-        print("exclude_list.json 저장 오류:", e)
+    config_store.set("exclude_list.json", {"join_exclude": list(lst)})
+
+def accounts_snapshot():
+    """계정 목록 사본 (고쳐도 설정에는 반영되지 않음, 저장하려면 save_accounts)"""
+    return config_store.get("accounts.json", {"accounts": []}).get("accounts", [])
 
 def load_accounts():
-    path = config_path("accounts.json")
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f).get("accounts", [])
-    except Exception as e:
-        print(f"accounts.json 파일 로드 오류: {e}")
-        return []
+    """수정해서 save_accounts 로 돌려줄 수 있는 계정 목록 사본"""
+    return accounts_snapshot()
+
+_accounts_by_phone = None
+
+def get_account_by_phone(phone):
+    """계정 하나의 사본 (phone → 계정 색인은 accounts.json 이 바뀔 때 다시 만듦)"""
+    global _accounts_by_phone
+    if _accounts_by_phone is None:
+        _accounts_by_phone = {a["phone"]: a for a in accounts_snapshot()}
+    acc = _accounts_by_phone.get(phone)
+    return copy.deepcopy(acc) if acc is not None else None
 
 def save_accounts(accs):
-    path = config_path("accounts.json")
-    try:
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump({"accounts": accs}, f, indent=2, ensure_ascii=False)
-    except Exception as e:
-        print(f"accounts.json 저장 오류: {e}")
+    config_store.set("accounts.json", {"accounts": accs})
+
+def on_accounts_changed(value):
+    global _accounts_by_phone
+    _accounts_by_phone = None
+    refresh_account_profiles(value.get("accounts", []))
+
+def on_alert_settings_changed(value):
+    global alert_notify_chat
+    alert_notify_chat = value.get("alert_notify_chat", alert_notify_chat)
+
+config_store.subscribe("accounts.json", on_accounts_changed)
+config_store.subscribe("alert_settings.json", on_alert_settings_changed)
+
+# --------------------- 상태 메모리 관리 ---------------------
+state_registry = {}   # 이름 → StateMap 또는 fn() → (항목 수, 추정 바이트)
+STATE_ENTRY_OVERHEAD = 120   # dict 항목 + 사용 시각 기록 1개당 대략의 바이트
+# 이름 → 기본 예산 (alert_settings.json 의 state_budgets 로 덮어씀, ttl = 마지막 사용 후 초)
+DEFAULT_STATE_BUDGETS = {
+    "delete_map":          {"max_bytes": 64 * 2 ** 20, "ttl": 3 * 86400},
+    "copy_msg_mapping":    {"max_bytes": 32 * 2 ** 20, "ttl": 3 * 86400},
+    "copy_sender_mapping": {"max_entries": 100000, "ttl": 7 * 86400},
+    "alert_room_names":    {"max_entries": 50000, "ttl": 86400},
+    "trace_links":         {"max_entries": 200000, "ttl": 3 * 86400},
+    "media_handles":       {"max_entries": 20000, "ttl": 86400},
+    "reconcile_rooms":     {"max_entries": 20000, "ttl": 7 * 86400},
+}
+
+def estimate_size(obj, depth=3):
+    """sys.getsizeof 를 리스트/튜플/dict 안쪽까지 depth 단계만 더한 추정값"""
+    size = sys.getsizeof(obj)
+    if depth:
+        if isinstance(obj, (list, tuple, set, frozenset)):
+            size += sum(estimate_size(x, depth - 1) for x in obj)
+        elif isinstance(obj, dict):
+            size += sum(estimate_size(k, depth - 1) + estimate_size(v, depth - 1) for k, v in obj.items())
+    return size
+
+class StateMap(OrderedDict):
+    """
+    계속 쌓이는 매핑용 dict. 꺼내거나 넣을 때마다 맨 뒤로 옮겨서(LRU),
+    예산(항목 수/추정 바이트)을 넘거나 ttl 동안 쓰이지 않은 항목은 앞에서부터 제거.
+    바이트 예산은 표본 평균 항목 크기로 항목 수 한도로 바꿔서 적용 (1000번 쓸 때마다 다시 추정).
+    """
+    def __init__(self, name):
+        super().__init__()
+        budget = DEFAULT_STATE_BUDGETS.get(name, {})
+        self.name = name
+        self.max_entries = budget.get("max_entries")
+        self.max_bytes = budget.get("max_bytes")
+        self.ttl = budget.get("ttl")
+        self.used = {}
+        self.evicted = 0
+        self.entry_bytes = None
+        self.writes = 0
+        state_registry[name] = self
+
+    def touch(self, key):
+        self.move_to_end(key)
+        self.used[key] = time.monotonic()
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        self.touch(key)
+        return value
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.touch(key)
+        self.writes += 1
+        self.enforce()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.used.pop(key, None)
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def setdefault(self, key, default=None):
+        if key in self:
+            return self[key]
+        self[key] = default
+        return default
+
+    def pop(self, key, *default):
+        self.used.pop(key, None)
+        return super().pop(key, *default)
+
+    def clear(self):
+        super().clear()
+        self.used.clear()
+
+    def sample_entry_bytes(self, sample=100):
+        items = list(itertools.islice(OrderedDict.items(self), sample))
+        if not items:
+            return None
+        return sum(estimate_size(k) + estimate_size(v) for k, v in items) / len(items) + STATE_ENTRY_OVERHEAD
+
+    def entry_limit(self):
+        limits = [self.max_entries] if self.max_entries else []
+        if self.max_bytes:
+            if self.entry_bytes is None or self.writes >= 1000:
+                self.entry_bytes = self.sample_entry_bytes()
+                self.writes = 0
+            if self.entry_bytes:
+                limits.append(int(self.max_bytes // self.entry_bytes))
+        return min(limits) if limits else None
+
+    def evict_oldest(self, reason):
+        key = next(iter(self))
+        OrderedDict.__delitem__(self, key)
+        self.used.pop(key, None)
+        self.evicted += 1
+        metrics.inc("state_evictions_total", state=self.name, reason=reason)
+
+    def enforce(self):
+        if self.ttl:
+            now = time.monotonic()
+            while self and now - self.used[next(iter(self))] > self.ttl:
+                self.evict_oldest("ttl")
+        limit = self.entry_limit()
+        while limit is not None and len(self) > limit:
+            self.evict_oldest("budget")
+
+    def usage(self):
+        entry = self.sample_entry_bytes() or 0
+        return len(self), int(sys.getsizeof(self) + entry * len(self))
+
+def register_state(name, fn):
+    state_registry[name] = fn
+
+def container_usage(obj, sample=100):
+    """dict 는 앞쪽 sample 개 항목 평균 크기 × 항목 수로 추정"""
+    def usage():
+        items = list(itertools.islice(obj.items(), sample))
+        if not items:
+            return 0, sys.getsizeof(obj)
+        per_entry = sum(estimate_size(k) + estimate_size(v) for k, v in items) / len(items)
+        return len(obj), int(sys.getsizeof(obj) + per_entry * len(obj))
+    return usage
+
+def state_report():
+    """[{name, entries, bytes, budget, evicted}] (추정치)"""
+    rows = []
+    for name, state in list(state_registry.items()):
+        try:
+            entries, size = state.usage() if isinstance(state, StateMap) else state()
+        except Exception:
+            continue
+        row = {"name": name, "entries": entries, "bytes": size, "evicted": 0, "budget": ""}
+        if isinstance(state, StateMap):
+            row["evicted"] = state.evicted
+            parts = []
+            if state.max_entries:
+                parts.append(f"{state.max_entries}개")
+            if state.max_bytes:
+                parts.append(f"{state.max_bytes / 2 ** 20:g}MB")
+            if state.ttl:
+                parts.append(f"{state.ttl / 3600:g}시간")
+            row["budget"] = " / ".join(parts)
+        rows.append(row)
+    return rows
+
+state_budget_task = None
+
+def apply_state_budgets():
+    """기본 예산 + alert_settings.json 의 state_budgets 적용 (클라이언트 루프 안에서 호출, 정리 작업은 한 번만 시작)"""
+    global state_budget_task
+    if state_budget_task is None:
+        state_budget_task = asyncio.get_running_loop().create_task(state_budget_loop())
+    budgets = copy.deepcopy(DEFAULT_STATE_BUDGETS)
+    for name, budget in load_alert_settings().get("state_budgets", {}).items():
+        budgets.setdefault(name, {}).update(budget)
+    for name, budget in budgets.items():
+        state = state_registry.get(name)
+        if isinstance(state, StateMap):
+            state.max_entries = budget.get("max_entries")
+            state.max_bytes = budget.get("max_bytes")
+            state.ttl = budget.get("ttl")
+            state.entry_bytes = None
+            state.enforce()
+
+def telethon_cache_usage():
+    entries = size = 0
+    for client in list(clients.values()):
+        cache = getattr(getattr(client, "_mb_entity_cache", None), "hash_map", None)
+        if cache is not None:
+            entries += len(cache)
+            size += sys.getsizeof(cache) + len(cache) * 150
+        session_entities = getattr(client.session, "_entities", None)
+        if session_entities is not None:
+            entries += len(session_entities)
+            size += sys.getsizeof(session_entities) + len(session_entities) * 250
+    return entries, size
+
+async def state_budget_loop():
+    """
+    유휴 TTL 은 쓰기가 없어도 지나가므로 주기적으로 정리.
+    StateMap 은 잠금이 없으므로 값을 바꾸는 클라이언트 루프 안에서만 정리.
+    """
+    while True:
+        await asyncio.sleep(600)
+        for state in list(state_registry.values()):
+            if isinstance(state, StateMap):
+                try:
+                    state.enforce()
+                except Exception as e:
+                    print(f"[상태 정리] {state.name} 오류: {e}")
 
 # --------------------- 전역 ---------------------
 media_groups = defaultdict(list)
@@ -141,10 +477,9 @@ recent_sent_text = defaultdict(str)
 is_forwarding_enabled = True    # 전체 전송 기능 ON/OFF
 clients = {}                    # phone → TelegramClient
 client_loops = {}               # phone → 해당 계정의 asyncio event loop
-command_queues = {}             # phone → asyncio.Queue() (링크 입장/나가기)
 
 # 메시지 수정/삭제 동기화 매핑
-delete_map = {}
+delete_map = StateMap("delete_map")
 
 # GUI 전역 변수들
 root = None
@@ -157,8 +492,8 @@ use_exclude = None
 copy_source_chats = []
 copy_exclude_senders = []
 copy_enabled = False
-copy_sender_mapping = {}
-copy_msg_mapping = {}
+copy_sender_mapping = StateMap("copy_sender_mapping")
+copy_msg_mapping = StateMap("copy_msg_mapping")
 
 copy_handler_registered = set()
 expert_handler_registered = set()
@@ -186,6 +521,11 @@ alert_notify_chat = None   # 알림 메시지를 보낼 채팅방 ID
 # 전역: 봇 계정의 Telegram user id 저장
 bot_account_ids = set()
 
+register_state("media_groups", container_usage(media_groups))
+register_state("recent_sent_text", container_usage(recent_sent_text))
+register_state("bot_account_ids", lambda: (len(bot_account_ids), estimate_size(bot_account_ids, 1)))
+register_state("telethon_entities", telethon_cache_usage)
+
 # --------------------- 관리자 관련 ---------------------
 admin_accounts_list = []
 admin_rooms_list = []
@@ -220,77 +560,1993 @@ def load_admin_data():
             admin_function_settings[k] = default_val
     admin_enabled = settings.get("admin_enabled", False)
 
-def save_admin_data():
+def save_admin_data():
+    config_store.update(
+        "alert_settings.json",
+        admin_accounts_list=admin_accounts_list,
+        admin_rooms_list=admin_rooms_list,
+        admin_function_settings=admin_function_settings,
+        admin_enabled=admin_enabled,
+    )
+    # 관리자 계정이 바뀌면 연결 유지/지연 연결도 바뀜
+    refresh_account_profiles()
+
+# --------------------- 정규화 함수 (chat_id 비교 용) ---------------------
+def normalize_chat_id(chat_id):
+    s = str(chat_id)
+    if s.startswith("-100"):
+        return chat_id
+    if s.startswith("-"):
+        return int("-100" + s[1:])
+    return chat_id
+
+# --------------------- 시작 오케스트레이션 ---------------------
+startup_connect_limit = 10      # 동시에 연결/인증을 진행할 계정 수
+startup_ready_timeout = 120     # 전체 계정 준비 대기 최대 시간(초)
+startup_clients = {}            # phone → login_accounts 에서 연결해 둔 TelegramClient
+startup_timings = {}            # phone → {단계: 소요 시간(초)}
+startup_expected = set()        # 이번 시작에서 준비를 기다리는 계정들
+startup_started_at = 0.0
+account_ready_events = {}       # phone → Event (핸들러 등록까지 완료)
+all_accounts_ready = Event()    # 모든 계정 시작 처리 완료
+
+def record_startup_phase(phone, phase, started):
+    startup_timings.setdefault(phone, {})[phase] = time.perf_counter() - started
+
+def mark_account_ready(phone):
+    account_ready_events.setdefault(phone, Event()).set()
+    if all_accounts_ready.is_set():
+        return
+    if all(account_ready_events.get(p) and account_ready_events[p].is_set() for p in startup_expected):
+        all_accounts_ready.set()
+        print_startup_report()
+
+def print_startup_report():
+    total = time.perf_counter() - startup_started_at if startup_started_at else 0.0
+    phases = ("connect", "authorize", "get_me", "ready")
+    print(f"[시작 완료] 계정 {len(startup_expected)}개 / 전체 {total:.2f}초")
+    for ph in phases:
+        vals = [t[ph] for t in startup_timings.values() if ph in t]
+        if vals:
+            print(f"  - {ph}: 합계 {sum(vals):.2f}초 / 최대 {max(vals):.2f}초 / 평균 {sum(vals) / len(vals):.2f}초")
+    for phone, t in sorted(startup_timings.items()):
+        detail = " ".join(f"{ph}={t[ph]:.2f}" for ph in phases if ph in t)
+        print(f"  [{phone}] {detail}")
+
+# --------------------- 세션 저장소 ---------------------
+session_backend = "sqlite"          # "sqlite": 계정별 .session 파일 / "memory": 메모리 세션 + 공용 스냅샷
+session_snapshot_interval = 60      # 메모리 세션 스냅샷 주기(초)
+memory_sessions = {}                # session_name → SnapshotSession
+_snapshot_task_started = False
+
+class SnapshotSession(MemorySession):
+    """업데이트마다 디스크에 쓰지 않고 주기적으로 공용 저장소(sessions.db)에 스냅샷을 남기는 세션"""
+    def __init__(self, name):
+        super().__init__()
+        self.name = name
+        self.dirty = False
+        self.entity_rows = {}       # id → 현재 엔티티 행 (_entities 에는 id 당 한 행만)
+        self.new_entities = {}      # id → 마지막 스냅샷 이후 추가/바뀐 엔티티 행
+
+    def set_dc(self, dc_id, server_address, port):
+        super().set_dc(dc_id, server_address, port)
+        self.dirty = True
+
+    @property
+    def auth_key(self):
+        return self._auth_key
+
+    @auth_key.setter
+    def auth_key(self, value):
+        self._auth_key = value
+        self.dirty = True
+
+    def set_update_state(self, entity_id, state):
+        super().set_update_state(entity_id, state)
+        self.dirty = True
+
+    def process_entities(self, tlo):
+        rows = self._entities_to_rows(tlo)
+        if not rows:
+            return
+        # 저장소는 (session, id) 당 한 행이므로 메모리도 id 로 덮어씀 (username/이름이 바뀐 행이 쌓이지 않도록)
+        for row in rows:
+            old = self.entity_rows.get(row[0])
+            if old != row:
+                if old is not None:
+                    self._entities.discard(old)
+                self._entities.add(row)
+                self.entity_rows[row[0]] = row
+                self.new_entities[row[0]] = row
+                self.dirty = True
+
+    def delete(self):
+        forget_session_snapshot(self.name)
+
+    def to_snapshot(self):
+        return {
+            "dc": [self._dc_id, self._server_address, self._port],
+            "auth_key": base64.b64encode(self._auth_key.key).decode() if self._auth_key else None,
+            "states": {str(eid): [st.pts, st.qts, st.date.timestamp(), st.seq]
+                       for eid, st in self._update_states.items()},
+        }
+
+    def load_snapshot(self, data, entities=()):
+        dc_id, address, port = data["dc"]
+        if dc_id:
+            super().set_dc(dc_id, address, port)
+        if data.get("auth_key"):
+            self._auth_key = AuthKey(data=base64.b64decode(data["auth_key"]))
+        self.entity_rows = {e[0]: tuple(e) for e in entities}
+        self._entities = set(self.entity_rows.values())
+        for eid, (pts, qts, date, seq) in data.get("states", {}).items():
+            self._update_states[int(eid)] = State(pts, qts, datetime.fromtimestamp(date, tz=timezone.utc), seq, 0)
+
+def load_session_backend():
+    global session_backend
+    session_backend = load_alert_settings().get("session_backend", session_backend)
+    return session_backend
+
+def open_session_db():
+    db = sqlite3.connect(config_path("sessions.db"))
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("CREATE TABLE IF NOT EXISTS snapshots (name TEXT PRIMARY KEY, data TEXT, saved REAL)")
+    db.execute("CREATE TABLE IF NOT EXISTS entities (session TEXT, id INTEGER, hash INTEGER, username TEXT, "
+               "phone INTEGER, name TEXT, PRIMARY KEY (session, id))")
+    return db
+
+def load_session_snapshot(name):
+    """(스냅샷, 엔티티 행) 반환, 없으면 None"""
+    db = open_session_db()
+    try:
+        row = db.execute("SELECT data FROM snapshots WHERE name = ?", (name,)).fetchone()
+        if not row:
+            return None
+        entities = db.execute("SELECT id, hash, username, phone, name FROM entities WHERE session = ?",
+                              (name,)).fetchall()
+    finally:
+        db.close()
+    return json.loads(row[0]), entities
+
+def import_sqlite_session(name):
+    """기존 Telethon .session 파일을 스냅샷 형식으로 변환"""
+    path = name if name.endswith(".session") else name + ".session"
+    if not os.path.isfile(path):
+        return None
+    db = sqlite3.connect(path)
+    try:
+        dc_id, address, port, key = db.execute(
+            "SELECT dc_id, server_address, port, auth_key FROM sessions").fetchone()
+        entities = db.execute("SELECT id, hash, username, phone, name FROM entities").fetchall()
+        try:
+            states = db.execute("SELECT id, pts, qts, date, seq FROM update_state").fetchall()
+        except sqlite3.OperationalError:
+            states = []
+    finally:
+        db.close()
+    print(f"[세션] {path} 가져오기 완료 (엔티티 {len(entities)}개)")
+    data = {
+        "dc": [dc_id, address, port],
+        "auth_key": base64.b64encode(key).decode() if key else None,
+        "states": {str(sid): [pts, qts, date, seq] for sid, pts, qts, date, seq in states},
+    }
+    return data, entities
+
+def open_session(session_name):
+    """설정된 백엔드에 맞는 세션 반환 (sqlite 면 이름 그대로 TelegramClient 에 전달)"""
+    if session_backend != "memory":
+        return session_name
+    sess = memory_sessions.get(session_name)
+    if sess is None:
+        sess = SnapshotSession(session_name)
+        loaded = load_session_snapshot(session_name)
+        imported = loaded is None
+        if imported:
+            loaded = import_sqlite_session(session_name)
+        if loaded:
+            sess.load_snapshot(*loaded)
+            if imported:
+                # 가져온 세션은 다음 스냅샷에 전부 저장
+                sess.new_entities = dict(sess.entity_rows)
+                sess.dirty = True
+        memory_sessions[session_name] = sess
+    return sess
+
+def collect_session_snapshots(names=None):
+    """변경된 세션의 (스냅샷 행, 새 엔티티 행) 수집 (세션을 쓰는 이벤트 루프 스레드에서 호출)"""
+    rows, entity_rows = [], []
+    for name, sess in list(memory_sessions.items()):
+        if names is not None and name not in names:
+            continue
+        if sess.dirty:
+            sess.dirty = False
+            rows.append((name, json.dumps(sess.to_snapshot()), time.time()))
+            entity_rows.extend((name,) + e for e in sess.new_entities.values())
+            sess.new_entities = {}
+    return rows, entity_rows
+
+def write_session_snapshots(batch):
+    """스냅샷 묶음을 한 트랜잭션으로 저장 (묶음당 fsync 1회, 엔티티는 바뀐 행만)"""
+    rows, entity_rows = batch
+    if not rows:
+        return 0
+    db = open_session_db()
+    try:
+        with db:
+            db.executemany("INSERT OR REPLACE INTO snapshots (name, data, saved) VALUES (?, ?, ?)", rows)
+            db.executemany("INSERT OR REPLACE INTO entities (session, id, hash, username, phone, name) "
+                           "VALUES (?, ?, ?, ?, ?, ?)", entity_rows)
+    finally:
+        db.close()
+    return len(rows)
+
+def save_session_snapshots(names=None):
+    return write_session_snapshots(collect_session_snapshots(names))
+
+def forget_session_snapshot(name):
+    memory_sessions.pop(name, None)
+    if not os.path.isfile(config_path("sessions.db")):
+        return
+    db = open_session_db()
+    try:
+        with db:
+            db.execute("DELETE FROM snapshots WHERE name = ?", (name,))
+            db.execute("DELETE FROM entities WHERE session = ?", (name,))
+    finally:
+        db.close()
+
+async def session_snapshot_loop():
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(session_snapshot_interval)
+        try:
+            batch = collect_session_snapshots()
+            if batch[0]:
+                await loop.run_in_executor(None, write_session_snapshots, batch)
+        except Exception as e:
+            print(f"[세션] 스냅샷 저장 오류: {e}")
+
+def start_session_snapshots():
+    global _snapshot_task_started
+    if session_backend == "memory" and not _snapshot_task_started:
+        _snapshot_task_started = True
+        asyncio.get_running_loop().create_task(session_snapshot_loop())
+
+atexit.register(save_session_snapshots)
+
+# --------------------- 계정 역할 프로필 (지연 연결) ---------------------
+lazy_connect_enabled = True     # 역할 없는 계정은 필요할 때만 연결
+idle_disconnect_timeout = 300   # 유휴 계정 연결 해제까지 대기 시간(초)
+account_profiles = {}           # phone → account_role_profile 결과
+client_last_used = {}           # phone → 마지막 사용 시각 (time.monotonic)
+client_busy = defaultdict(int)  # phone → 진행 중인 작업 수
+lazy_tasks = {}                 # phone → 실행 중인 lazy_account_task (업데이트 수신 없는 클라이언트)
+promoting_accounts = set()      # 업데이트를 받는 클라이언트로 다시 연결 중인 계정
+
+def account_role_profile(account):
+    """설정으로부터 계정 역할 계산 (main/expert/alert/admin, 없으면 전송·입장 전용)"""
+    phone = account["phone"]
+    roles = set()
+    if "main_chat_id" in account:
+        roles.add("main")
+    if phone in expert_accounts:
+        roles.add("expert")
+    if account.get("alert_monitor", False):
+        roles.add("alert")
+    if phone in admin_accounts_list:
+        roles.add("admin")
+    return {
+        "roles": roles,
+        # 업데이트 수신이 필요한 역할
+        "needs_updates": bool(roles & {"main", "expert", "alert"}),
+        # 항상 연결을 유지해야 하는 역할
+        "always_connected": bool(roles) or not lazy_connect_enabled,
+    }
+
+def make_client(account, profile=None):
+    phone = account["phone"]
+    if profile is None:
+        profile = account_profiles.get(phone) or account_role_profile(account)
+    session_name = account.get("session_name", f"session_{phone}")
+    return TelegramClient(open_session(session_name), account["api_id"], account["api_hash"],
+                          receive_updates=profile["needs_updates"])
+
+def is_lazy_account(phone):
+    profile = account_profiles.get(phone)
+    return bool(profile) and not profile["always_connected"]
+
+def refresh_account_profiles(accounts=None):
+    """
+    실행 중인 계정의 역할 프로필 갱신.
+    업데이트를 받지 않는 계정에 업데이트 수신이 필요한 역할(알림/전문가)이 생기면 클라이언트를 새로 만들어 다시 연결.
+    관리자 역할이 생기거나 없어지면 idle_disconnect_loop 가 다음 주기부터 연결을 유지하거나 유휴 시 해제.
+    """
+    for acc in accounts if accounts is not None else accounts_snapshot():
+        phone = acc["phone"]
+        if phone not in account_profiles:
+            continue
+        account_profiles[phone] = account_role_profile(acc)
+        if phone in lazy_tasks and account_profiles[phone]["needs_updates"] and phone not in promoting_accounts:
+            loop = client_loops.get(phone)
+            if loop is not None:
+                promoting_accounts.add(phone)
+                asyncio.run_coroutine_threadsafe(promote_lazy_account(phone), loop)
+
+async def promote_lazy_account(phone):
+    """receive_updates=False 로 만든 클라이언트는 업데이트를 못 받으므로 새 클라이언트로 account_task 다시 시작"""
+    try:
+        task = lazy_tasks.pop(phone, None)
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        old = clients.get(phone)
+        if old is not None:
+            try:
+                await old.disconnect()
+            except Exception:
+                pass
+        account = get_account_by_phone(phone)
+        if account is None:
+            return
+        startup_clients[phone] = make_client(account, account_profiles.get(phone))
+    except Exception as e:
+        print(f"[{phone}] 업데이트 수신 클라이언트로 전환 오류: {e}")
+        return
+    finally:
+        promoting_accounts.discard(phone)
+    print(f"[{phone}] 역할 추가 → 업데이트를 받도록 다시 연결")
+    asyncio.get_running_loop().create_task(account_task(account))
+
+async def acquire_client(phone):
+    """지연 연결 계정이면 요청 시점에 연결해서 반환"""
+    client = clients.get(phone)
+    if client is None:
+        return None
+    client_last_used[phone] = time.monotonic()
+    if not client.is_connected():
+        for attempt in range(3):
+            try:
+                await client.connect()
+                break
+            except Exception as e:
+                if attempt == 2:
+                    raise
+                print(f"[{phone}] 연결 오류: {e}. 재연결 시도 중...")
+                await asyncio.sleep(5)
+        print(f"[{phone}] 요청 처리를 위해 연결")
+    return client
+
+@asynccontextmanager
+async def using_client(phone):
+    client = await acquire_client(phone)
+    client_busy[phone] += 1
+    try:
+        yield client
+    finally:
+        client_busy[phone] -= 1
+        client_last_used[phone] = time.monotonic()
+
+async def idle_disconnect_loop(phone, client):
+    """지연 연결 계정이면 유휴 시 연결 해제, 관리자 역할 등이 생겨 항상 연결해야 하는 계정이 되면 다시 연결해 둠"""
+    while True:
+        await asyncio.sleep(max(idle_disconnect_timeout / 4, 1))
+        if not is_lazy_account(phone):
+            if not client.is_connected():
+                try:
+                    await acquire_client(phone)
+                except Exception as e:
+                    print(f"[{phone}] 연결 유지 오류: {e}")
+            continue
+        if not client.is_connected() or client_busy[phone]:
+            continue
+        if time.monotonic() - client_last_used.get(phone, 0) >= idle_disconnect_timeout:
+            try:
+                await client.disconnect()
+                print(f"[{phone}] 유휴 상태 → 연결 해제")
+            except Exception as e:
+                print(f"[{phone}] 유휴 연결 해제 오류: {e}")
+
+# --------------------- 지표 (metrics) ---------------------
+metrics_port = 9464         # 로컬 /metrics 포트 (alert_settings.json 의 metrics_port, 0 이면 끔)
+metrics_server = None
+HIST_PRECISION = 1.05       # 히스토그램 버킷 간 비율 (상대 오차 약 2.5%)
+HIST_EXPORT_BOUNDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+class LatencyHistogram:
+    """HDR 방식: 값 크기에 비례한 로그 버킷이라 작은 값/큰 값 모두 같은 상대 정밀도"""
+    def __init__(self):
+        self.buckets = defaultdict(int)   # 버킷 번호 → 개수
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        seconds = max(seconds, 1e-6)
+        self.buckets[math.ceil(math.log(seconds, HIST_PRECISION))] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for b in sorted(self.buckets):
+            seen += self.buckets[b]
+            if seen >= rank:
+                return min(HIST_PRECISION ** b, self.max)
+        return self.max
+
+    def cumulative(self, bounds):
+        result = []
+        for le in bounds:
+            limit = math.log(le, HIST_PRECISION)
+            result.append(sum(n for b, n in self.buckets.items() if b <= limit))
+        return result
+
+class Metrics:
+    """카운터/히스토그램/게이지 모음. 루프 스레드에서 기록, HTTP·Tk 스레드에서 읽음"""
+    def __init__(self):
+        self.lock = RLock()
+        self.counters = defaultdict(float)   # (이름, 라벨) → 값
+        self.histograms = {}                 # (이름, 라벨) → LatencyHistogram
+        self.gauges = {}                     # 이름 → fn() → {라벨: 값}
+        self.help = {}
+        self.loop = None                     # 게이지가 읽는 상태를 바꾸는 클라이언트 루프 (start_metrics_server)
+        self.last_gauges = {}                # 루프가 바빠서 제때 못 모았을 때 돌려줄 직전 값
+
+    @staticmethod
+    def labels_of(labels):
+        return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+    def inc(self, name, value=1, **labels):
+        with self.lock:
+            self.counters[(name, self.labels_of(labels))] += value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, self.labels_of(labels))
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = LatencyHistogram()
+            hist.record(seconds)
+
+    def gauge(self, name, fn, help_text=""):
+        self.gauges[name] = fn
+        self.help[name] = help_text
+
+    def counter_total(self, name, **match):
+        want = set(self.labels_of(match))
+        with self.lock:
+            return sum(v for (n, labels), v in self.counters.items() if n == name and want <= set(labels))
+
+    def histogram_summary(self, name):
+        """GUI 용: 라벨 무시하고 합친 (개수, p50, p99, 최대)"""
+        merged = LatencyHistogram()
+        with self.lock:
+            for (n, _), hist in self.histograms.items():
+                if n != name:
+                    continue
+                for b, c in hist.buckets.items():
+                    merged.buckets[b] += c
+                merged.count += hist.count
+                merged.total += hist.total
+                merged.max = max(merged.max, hist.max)
+        return merged.count, merged.quantile(0.5), merged.quantile(0.99), merged.max
+
+    def collect_gauges(self):
+        values = {}
+        for name, fn in list(self.gauges.items()):
+            try:
+                values[name] = dict(fn())
+            except Exception as e:
+                values[name] = {}
+                self.inc("gauge_errors_total", gauge=name)
+                print(f"[지표] 게이지 {name} 오류: {e}")
+        return values
+
+    def read_gauges(self, timeout=2):
+        """
+        게이지 함수는 루프가 바꾸는 dict 를 훑으므로 다른 스레드(HTTP·Tk)에서는 루프 안에서 모아 받음.
+        timeout 안에 루프가 처리하지 못하면 직전 값.
+        """
+        loop = self.loop
+        try:
+            current = asyncio.get_running_loop()
+        except RuntimeError:
+            current = None
+        if loop is None or not loop.is_running() or current is loop:
+            return self.collect_gauges()
+        async def collect():
+            return self.collect_gauges()
+        fut = asyncio.run_coroutine_threadsafe(collect(), loop)
+        try:
+            self.last_gauges = fut.result(timeout)
+        except concurrent.futures.TimeoutError:
+            fut.cancel()
+        return self.last_gauges
+
+    @staticmethod
+    def escape_label(value):
+        return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    def render(self):
+        """Prometheus text format"""
+        def fmt(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{k}="{self.escape_label(v)}"' for k, v in pairs) + "}"
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items(), key=lambda kv: kv[0])
+            for name in sorted({n for (n, _), _ in counters}):
+                lines.append(f"# TYPE tgbot_{name} counter")
+                lines += [f"tgbot_{n}{fmt(l)} {v:g}" for (n, l), v in counters if n == name]
+            for name in sorted({n for (n, _), _ in histograms}):
+                lines.append(f"# TYPE tgbot_{name} histogram")
+                for (n, l), hist in histograms:
+                    if n != name:
+                        continue
+                    for le, c in zip(HIST_EXPORT_BOUNDS, hist.cumulative(HIST_EXPORT_BOUNDS)):
+                        lines.append(f"tgbot_{name}_bucket{fmt(l, [('le', f'{le:g}')])} {c}")
+                    lines.append(f"tgbot_{name}_bucket{fmt(l, [('le', '+Inf')])} {hist.count}")
+                    lines.append(f"tgbot_{name}_sum{fmt(l)} {hist.total:.6f}")
+                    lines.append(f"tgbot_{name}_count{fmt(l)} {hist.count}")
+        for name, values in sorted(self.read_gauges().items()):
+            if self.help.get(name):
+                help_text = self.help[name].replace("\\", "\\\\").replace("\n", "\\n")
+                lines.append(f"# HELP tgbot_{name} {help_text}")
+            lines.append(f"# TYPE tgbot_{name} gauge")
+            lines += [f"tgbot_{name}{fmt(self.labels_of(dict(l)))} {v:g}" for l, v in values.items()]
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+def count_cache(cache, hit):
+    metrics.inc("cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+# --------------------- 추적 (trace id / span) ---------------------
+trace_enabled = False                 # span 파일 기록 (alert_settings.json 의 trace_enabled)
+trace_file_max_bytes = 20 * 2 ** 20   # 넘으면 trace.json → trace.1.json → ... 로 밀어냄
+trace_file_keep = 3                   # 보관할 이전 파일 수
+trace_flush_interval = 2              # 버퍼를 파일에 쓰는 주기(초)
+tracer = None
+trace_links = StateMap("trace_links") # delete_map 과 같은 키 → 원래 trace id (수정/삭제를 같은 추적으로 묶음)
+
+def new_trace_id():
+    return uuid.uuid4().hex[:16]
+
+class TraceWriter:
+    """
+    Chrome Trace Event 형식(JSON 배열, 닫는 괄호 생략 허용) 으로 span 기록.
+    Perfetto(ui.perfetto.dev) / chrome://tracing 에 파일을 그대로 열면 됨.
+    계정 = 프로세스, trace id 하나 = 트랙 하나.
+    이벤트 루프에서는 줄을 큐에 넣기만 하고, 파일 쓰기/교체는 전용 스레드가 trace_flush_interval 마다 모아서.
+    """
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.path = os.path.join(directory, "trace.json")
+        self.origin = time.monotonic()
+        self.lock = RLock()        # pids/tracks (파일 쓰기 동안에는 잡지 않음)
+        self.file_lock = RLock()   # 파일 쓰기/교체 (기록 스레드와 atexit)
+        self.queue = queue.Queue()
+        self.pids = {}      # phone → pid
+        self.tracks = {}    # trace id → tid
+        self.new_file = not os.path.exists(self.path)
+        Thread(target=self.writer, daemon=True).start()
+
+    def ts(self, mono):
+        return int((mono - self.origin) * 1e6)
+
+    def track(self, trace):
+        pid = self.pids.get(trace.phone)
+        if pid is None:
+            pid = self.pids[trace.phone] = len(self.pids) + 1
+            self.emit({"ph": "M", "name": "process_name", "pid": pid, "tid": 0,
+                       "args": {"name": f"account {trace.phone}"}})
+        tid = self.tracks.get(trace.trace_id)
+        if tid is None:
+            if len(self.tracks) >= 10000:
+                self.tracks.clear()
+            tid = self.tracks[trace.trace_id] = len(self.tracks) + 1
+            self.emit({"ph": "M", "name": "thread_name", "pid": pid, "tid": tid,
+                       "args": {"name": f"{trace.trace_id} {trace.path}"}})
+        return pid, tid
+
+    def span(self, trace, name, start, end, **args):
+        with self.lock:
+            pid, tid = self.track(trace)
+            self.emit({"ph": "X", "name": name, "cat": trace.path, "ts": self.ts(start),
+                       "dur": max(self.ts(end) - self.ts(start), 0), "pid": pid, "tid": tid,
+                       "args": {"trace_id": trace.trace_id, **args}})
+
+    def emit(self, event):
+        self.queue.put(json.dumps(event, ensure_ascii=False, separators=(",", ":")))
+
+    def writer(self):
+        while True:
+            time.sleep(trace_flush_interval)
+            self.flush()
+
+    def rotate(self):
+        for i in range(trace_file_keep - 1, 0, -1):
+            older = os.path.join(self.directory, f"trace.{i}.json")
+            if os.path.exists(older):
+                os.replace(older, os.path.join(self.directory, f"trace.{i + 1}.json"))
+        os.replace(self.path, os.path.join(self.directory, "trace.1.json"))
+        self.new_file = True
+        # 새 파일에도 계정/트랙 이름이 나오도록 다시 기록
+        with self.lock:
+            self.pids.clear()
+            self.tracks.clear()
+
+    def flush(self):
+        """쌓인 이벤트를 순서대로 파일에 씀 (기록 스레드와 종료 시 atexit 에서 호출)"""
+        with self.file_lock:
+            lines = []
+            while True:
+                try:
+                    lines.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not lines:
+                return
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    if self.new_file:
+                        f.write("[\n")
+                        self.new_file = False
+                    f.write(",\n".join(lines) + ",\n")
+                if os.path.getsize(self.path) > trace_file_max_bytes:
+                    self.rotate()
+            except OSError as e:
+                print(f"추적 파일 쓰기 오류: {e}")
+
+def start_tracing():
+    global tracer, trace_enabled
+    trace_enabled = load_alert_settings().get("trace_enabled", trace_enabled)
+    if trace_enabled and tracer is None:
+        tracer = TraceWriter(config_path("traces"))
+        atexit.register(tracer.flush)
+        print(f"추적 기록 중: {tracer.path}")
+
+class SendTrace:
+    """
+    이벤트 하나의 처리 추적: trace id 를 붙이고
+    수신 → 첫 방 전송 → 마지막 방 전송 지연, 방별 전송/오류/FloodWait 을 지표로,
+    방별 span 을 추적 파일로 기록.
+    path: main / album / expert / copy / alert / edit / delete
+    방별 span 은 직전 방 처리(또는 pace 대기)가 끝난 시점부터 잼.
+    """
+    def __init__(self, path, phone, message=None, received=None, trace_id=None):
+        self.path = path
+        self.phone = phone
+        self.trace_id = trace_id or new_trace_id()
+        self.received = received or time.monotonic()
+        self.first = None
+        self.last = None
+        self.mark = time.monotonic()
+        date = getattr(message, "date", None)
+        if date is not None:
+            metrics.observe("receive_delay_seconds", max(time.time() - date.timestamp(), 0), path=path)
+        if tracer and self.mark - self.received > 0.001:
+            tracer.span(self, "album_wait" if path == "album" else "prepare", self.received, self.mark)
+
+    def link(self, key):
+        """이 key 로 나중에 들어오는 수정/삭제가 같은 trace id 를 쓰도록 기록"""
+        trace_links[key] = self.trace_id
+
+    def sent(self, room, started=None):
+        now = time.monotonic()
+        if self.first is None:
+            self.first = now
+            metrics.observe("first_room_sent_seconds", now - self.received, path=self.path)
+        self.last = now
+        metrics.inc("sends_total", path=self.path, phone=self.phone, room=room)
+        if self.path not in ("edit", "delete"):
+            note_room_sent(self.phone, room)
+        if tracer:
+            tracer.span(self, self.path, started or self.mark, now, room=room, ok=True)
+        if started is None:
+            self.mark = now
+
+    def failed(self, room, error, started=None):
+        now = time.monotonic()
+        metrics.inc("send_errors_total", path=self.path, phone=self.phone, room=room)
+        note_room_error(self.phone, room, error)
+        if isinstance(error, FloodWaitError):
+            metrics.inc("floodwait_total", path=self.path, phone=self.phone)
+            metrics.inc("floodwait_seconds_total", error.seconds, phone=self.phone)
+        if tracer:
+            tracer.span(self, self.path, started or self.mark, now, room=room, ok=False, error=str(error))
+        if started is None:
+            self.mark = now
+
+    async def pace(self, delay):
+        """방 사이 전송 간격 대기 (다음 방 span 에 포함되지 않게)"""
+        await asyncio.sleep(delay)
+        self.mark = time.monotonic()
+
+    async def run(self, room, coro):
+        """동시에 여러 방을 처리할 때: 방별 시작 시각을 따로 잼"""
+        started = time.monotonic()
+        try:
+            result = await coro
+        except Exception as e:
+            self.failed(room, e, started)
+            raise
+        self.sent(room, started)
+        return result
+
+    def done(self):
+        if self.last is not None:
+            metrics.observe("last_room_sent_seconds", self.last - self.received, path=self.path)
+        if tracer:
+            tracer.span(self, f"{self.path} total", self.received, time.monotonic())
+
+def register_runtime_gauges():
+    metrics.gauge("join_backlog",
+                  lambda: {(("phone", p),): n for p, n in join_backlog().items()},
+                  "계정별 진행 중인 입장/나가기 작업에서 남은 수")
+    metrics.gauge("media_groups_pending",
+                  lambda: {(): sum(1 for msgs in list(media_groups.values()) if msgs)},
+                  "전송 대기 중인 앨범 수")
+    metrics.gauge("gui_results_depth", lambda: {(): gui_results.qsize()}, "Tk 스레드 결과 큐 길이")
+    metrics.gauge("gui_log_depth", lambda: {(): len(gui_log_buffer)}, "GUI 로그 대기 줄 수")
+    metrics.gauge("batch_requests_pending",
+                  lambda: {(): sum(len(b.pending) for b in list(request_batchers.values()))},
+                  "묶음 전송 대기 요청 수")
+    metrics.gauge("state_entries", lambda: {(("state", r["name"]),): r["entries"] for r in state_report()},
+                  "상태 구조별 항목 수")
+    metrics.gauge("state_bytes", lambda: {(("state", r["name"]),): r["bytes"] for r in state_report()},
+                  "상태 구조별 추정 바이트")
+    metrics.gauge("outbox_pending", lambda: {(): len(outbox.pending) if outbox else 0}, "outbox 미완료 전송 작업 수")
+    metrics.gauge("rooms_by_state",
+                  lambda: {(("state", s),): sum(1 for e in list(room_health.values()) if e["state"] == s)
+                           for s in ROOM_STATE_LABELS},
+                  "상태별 목적지 방 수")
+    metrics.gauge("clients_connected",
+                  lambda: {(): sum(1 for c in list(clients.values()) if c.is_connected())},
+                  "연결된 계정 수")
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """
+    GET  /metrics             Prometheus 지표
+    POST /profile?seconds=N   핸들러 프로파일 시작 (상태를 바꾸므로 POST 만, 프리페치·크롤러가 건드리지 않도록)
+    GET  /profile/report      마지막 프로파일 결과 (JSON)
+    """
+    def reply(self, body, content_type):
+        body = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = self.path.partition("?")[0]
+        if path == "/metrics":
+            self.reply(metrics.render(), "text/plain; version=0.0.4; charset=utf-8")
+        elif path == "/profile":
+            self.send_response(405)
+            self.send_header("Allow", "POST")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        elif path == "/profile/report":
+            self.reply(json.dumps({"active": handler_profiler.active, "handlers": handler_profiler.last_report,
+                                   "folded": handler_profiler.last_folded}, ensure_ascii=False),
+                       "application/json; charset=utf-8")
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        path, _, query = self.path.partition("?")
+        params = dict(p.partition("=")[::2] for p in query.split("&") if p)
+        if path != "/profile":
+            self.send_error(404)
+            return
+        try:
+            seconds = float(params.get("seconds", profile_default_seconds))
+        except ValueError:
+            self.send_error(400)
+            return
+        started = handler_profiler.start(seconds)
+        self.reply(json.dumps({"started": started, "seconds": seconds}), "application/json")
+
+    def log_message(self, *args):
+        pass
+
+def start_metrics_server():
+    """127.0.0.1:metrics_port/metrics (한 번만 시작)"""
+    global metrics_server, metrics_port
+    if metrics_server is not None:
+        return
+    metrics_port = int(load_alert_settings().get("metrics_port", metrics_port))
+    metrics.loop = asyncio.get_running_loop()
+    register_runtime_gauges()
+    if not metrics_port:
+        return
+    try:
+        metrics_server = ThreadingHTTPServer(("127.0.0.1", metrics_port), MetricsHandler)
+    except OSError as e:
+        print(f"지표 서버 시작 실패 (포트 {metrics_port}): {e}")
+        return
+    metrics_server.daemon_threads = True
+    Thread(target=metrics_server.serve_forever, daemon=True).start()
+    print(f"지표: http://127.0.0.1:{metrics_port}/metrics")
+
+# --------------------- 업데이트 기록 (부하 재현용) ---------------------
+record_updates_path = None   # 기록 파일 (alert_settings.json 의 record_updates, 없으면 기록 안 함)
+record_redact = True         # True 면 본문 없이 길이/형태만 기록 (record_redact)
+record_flush_interval = 2    # 버퍼를 파일에 쓰는 주기(초)
+update_recorder = None
+
+class UpdateRecorder:
+    """
+    계정별로 받은 새 메시지/수정/삭제 이벤트를 JSON Lines 로 덧붙여 기록.
+    한 줄 = {"t": 시작 후 ms, "p": phone, "k": n/e/d, "c": chat, "s": sender, "i": id, ...}
+    파일을 열 때마다 그 시점 계정/방 설정을 헤더("k": "h")로 남겨 재현 시 같은 경로로 흘려보냄.
+    이벤트 루프에서는 줄을 큐에 넣기만 하고, 파일 쓰기는 전용 스레드가 record_flush_interval 마다 모아서.
+    """
+    def __init__(self, path, redact=True):
+        self.path = path
+        self.redact = redact
+        self.started = time.monotonic()
+        self.queue = queue.Queue()
+        self.lock = RLock()
+        self.write_line({"k": "h", "t": 0, "at": time.time(), "redact": redact,
+                         "accounts": [{k: a.get(k) for k in ("phone", "main_chat_id", "subroom_ids",
+                                                             "alert_monitor", "alert_rooms")}
+                                      for a in accounts_snapshot()],
+                         "copy_source_chats": list(copy_source_chats),
+                         "expert_accounts": list(expert_accounts),
+                         "alert_notify_chat": alert_notify_chat})
+        Thread(target=self.writer, daemon=True).start()
+
+    @staticmethod
+    def media_shape(media):
+        if media is None:
+            return None
+        if isinstance(media, MessageMediaPhoto):
+            return {"type": "photo"}
+        if isinstance(media, MessageMediaDocument):
+            doc = media.document
+            return {"type": "doc", "size": getattr(doc, "size", 0), "mime": getattr(doc, "mime_type", "")}
+        if isinstance(media, MessageMediaWebPage):
+            return {"type": "web"}
+        return {"type": type(media).__name__}
+
+    def write_line(self, row):
+        self.queue.put(json.dumps(row, ensure_ascii=False, separators=(",", ":")))
+
+    def writer(self):
+        while True:
+            time.sleep(record_flush_interval)
+            self.flush()
+
+    def record(self, phone, kind, event):
+        row = {"t": int((time.monotonic() - self.started) * 1000), "p": phone, "k": kind, "c": event.chat_id}
+        if kind == "d":
+            row["ids"] = list(event.deleted_ids)
+        else:
+            msg = event.message
+            row.update(s=msg.sender_id, i=msg.id, o=bool(msg.out), n=len(msg.message or ""),
+                       ent=len(msg.entities or []))
+            if msg.grouped_id:
+                row["g"] = msg.grouped_id
+            if msg.media is not None:
+                row["m"] = self.media_shape(msg.media)
+            if not self.redact:
+                row["x"] = msg.message
+        self.write_line(row)
+
+    def flush(self):
+        """쌓인 줄을 순서대로 파일에 씀 (기록 스레드와 종료 시 atexit 에서 호출)"""
+        with self.lock:
+            lines = []
+            while True:
+                try:
+                    lines.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not lines:
+                return
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write("\n".join(lines) + "\n")
+            except OSError as e:
+                print(f"업데이트 기록 쓰기 오류: {e}")
+
+def start_update_recorder():
+    global update_recorder, record_updates_path, record_redact
+    settings = load_alert_settings()
+    record_updates_path = settings.get("record_updates", record_updates_path)
+    record_redact = settings.get("record_redact", record_redact)
+    if not record_updates_path or update_recorder is not None:
+        return
+    path = record_updates_path if os.path.isabs(record_updates_path) else config_path(record_updates_path)
+    update_recorder = UpdateRecorder(path, record_redact)
+    atexit.register(update_recorder.flush)
+    print(f"업데이트 기록 중: {path} (내용 {'제외' if record_redact else '포함'})")
+
+def attach_update_recorder(client, phone):
+    if update_recorder is None:
+        return
+    async def on_new(event):
+        update_recorder.record(phone, "n", event)
+    async def on_edit(event):
+        update_recorder.record(phone, "e", event)
+    async def on_delete(event):
+        update_recorder.record(phone, "d", event)
+    client.add_event_handler(on_new, events.NewMessage())
+    client.add_event_handler(on_edit, events.MessageEdited())
+    client.add_event_handler(on_delete, events.MessageDeleted())
+
+# --------------------- 멈춤 감시 (이벤트 루프 / Tk) ---------------------
+stall_check_interval = 0.1    # 심장박동 주기(초)
+stall_threshold = 0.5         # 이 시간 넘게 박동이 없으면 멈춤으로 보고 스택 기록
+slow_callback_threshold = 0.1 # GUI 결과 콜백 하나가 이보다 오래 걸리면 기록
+stall_history = deque(maxlen=50)   # 최근 멈춤/느린 콜백 (대상, 시간, 위치)
+watchdogs = {}                # 이름 → StallWatchdog
+watchdog_thread = None
+OWN_SOURCE_FILES = {"bot_gui.py", "bot_runner.py"}
+
+def attribute_stall(stack):
+    """
+    멈춘 스레드의 스택에서 책임 위치 찾기.
+    이벤트 루프(Handle._run)/Tk(CallWrapper.__call__) 디스패치 아래 첫 우리 코드 = 핸들러/콜백,
+    가장 안쪽 우리 코드 = 막힌 줄.
+    """
+    start = 0
+    for i, f in enumerate(stack):
+        if (f.name == "_run" and "asyncio" in f.filename) or (f.name == "__call__" and "tkinter" in f.filename):
+            start = i + 1
+    own = [f for f in stack[start:] if os.path.basename(f.filename) in OWN_SOURCE_FILES]
+    if not own:
+        f = stack[-1]
+        return f"{f.name} ({os.path.basename(f.filename)}:{f.lineno})"
+    if own[0] is own[-1]:
+        return f"{own[0].name}:{own[0].lineno}"
+    return f"{own[0].name} → {own[-1].name}:{own[-1].lineno}"
+
+class StallWatchdog:
+    """
+    감시 대상 스레드가 stall_check_interval 마다 beat() 호출 (예정보다 늦은 만큼 = 지연).
+    감시 스레드는 박동이 stall_threshold 넘게 끊기면 그 스레드 스택을 떠서 책임 위치를 기록.
+    """
+    def __init__(self, name, lag_metric):
+        self.name = name
+        self.lag_metric = lag_metric
+        self.thread_id = None
+        self.last_beat = time.monotonic()
+        self.expected = None
+        self.stalled = False
+        self.culprit = None
+
+    def beat(self):
+        now = time.monotonic()
+        self.thread_id = threading.get_ident()
+        if self.expected is not None:
+            metrics.observe(self.lag_metric, max(now - self.expected, 0))
+        if self.stalled:
+            duration = now - self.last_beat
+            metrics.inc("stall_seconds_total", duration, target=self.name)
+            print(f"[멈춤 감시] {self.name} {duration:.2f}초 멈춤 후 복구 ({self.culprit})")
+            self.stalled = False
+        self.last_beat = now
+        self.expected = now + stall_check_interval
+
+    def check(self):
+        if self.thread_id is None or self.stalled:
+            return
+        blocked = time.monotonic() - self.last_beat
+        if blocked < stall_threshold + stall_check_interval:
+            return
+        frame = sys._current_frames().get(self.thread_id)
+        if frame is None:
+            return
+        stack = traceback.extract_stack(frame)
+        self.culprit = attribute_stall(stack)
+        self.stalled = True
+        metrics.inc("stalls_total", target=self.name, where=self.culprit)
+        stall_history.append((self.name, time.time(), self.culprit))
+        print(f"[멈춤 감시] {self.name} {blocked:.2f}초째 응답 없음 → {self.culprit}\n"
+              + "".join(traceback.format_list(stack[-6:])).rstrip())
+
+def watchdog_loop():
+    while True:
+        time.sleep(stall_check_interval)
+        for dog in list(watchdogs.values()):
+            try:
+                dog.check()
+            except Exception as e:
+                print(f"[멈춤 감시] {dog.name} 확인 오류: {e}")
+
+def add_watchdog(name, lag_metric):
+    global watchdog_thread
+    dog = watchdogs[name] = StallWatchdog(name, lag_metric)
+    if watchdog_thread is None:
+        watchdog_thread = Thread(target=watchdog_loop, daemon=True, name="stall-watchdog")
+        watchdog_thread.start()
+    return dog
+
+async def loop_heartbeat(dog):
+    while True:
+        dog.beat()
+        await asyncio.sleep(stall_check_interval)
+
+def watch_event_loop(name="clients"):
+    """현재 실행 중인 이벤트 루프 감시 시작 (루프 안에서 호출)"""
+    asyncio.get_running_loop().create_task(loop_heartbeat(add_watchdog(name, "loop_lag_seconds")))
+
+def watch_tk(widget):
+    dog = add_watchdog("tk", "tk_lag_seconds")
+    def heartbeat():
+        dog.beat()
+        widget.after(int(stall_check_interval * 1000), heartbeat)
+    heartbeat()
+
+def callback_name(callback):
+    return getattr(callback, "__qualname__", None) or repr(callback)
+
+# --------------------- 핸들러 프로파일러 ---------------------
+profile_sample_interval = 0.01   # 스택 샘플 주기(초)
+profile_default_seconds = 60     # GUI/제어 요청 기본 측정 시간
+profile_rewrap_interval = 1      # 측정 중 새로 등록된 핸들러(역할 전환·알림 핸들러 등)를 감싸는 주기(초)
+
+def handler_label(callback):
+    return callback_name(callback).replace(".<locals>", "")
+
+class TimedCoroutine:
+    """코루틴을 한 단계(send)씩 대신 돌리며 단계별 CPU/벽시계 시간 합산"""
+    def __init__(self, coro):
+        self.coro = coro
+        self.cpu = 0.0
+        self.run = 0.0
+
+    def __await__(self):
+        it = self.coro.__await__()
+        value, error = None, None
+        while True:
+            cpu0, wall0 = time.thread_time(), time.perf_counter()
+            try:
+                step = it.throw(error) if error is not None else it.send(value)
+            except StopIteration as e:
+                self.cpu += time.thread_time() - cpu0
+                self.run += time.perf_counter() - wall0
+                return e.value
+            except BaseException:
+                self.cpu += time.thread_time() - cpu0
+                self.run += time.perf_counter() - wall0
+                raise
+            self.cpu += time.thread_time() - cpu0
+            self.run += time.perf_counter() - wall0
+            try:
+                value, error = (yield step), None
+            except BaseException as e:
+                value, error = None, e
+
+class ProfiledHandler:
+    """
+    client._event_builders 안의 핸들러를 잠시 감싸는 래퍼.
+    remove_event_handler 가 원래 함수로 찾을 수 있도록 원래 콜백과 같다고 비교됨.
+    """
+    def __init__(self, callback, phone):
+        self.callback = callback
+        self.phone = phone
+        self.label = handler_label(callback)
+        self.__name__ = getattr(callback, "__name__", self.label)
+
+    def __eq__(self, other):
+        return other is self or other is self.callback or other == self.callback
+
+    def __hash__(self):
+        return hash(self.callback)
+
+    async def __call__(self, event):
+        if not handler_profiler.active:
+            return await self.callback(event)
+        timed = TimedCoroutine(self.callback(event))
+        started = time.perf_counter()
+        try:
+            return await timed
+        finally:
+            handler_profiler.add(self.label, self.phone, timed.cpu, timed.run, time.perf_counter() - started)
+
+class HandlerProfiler:
+    """
+    정해진 시간 동안 모든 계정의 등록된 핸들러를 감싸서 핸들러·계정별 호출 수, CPU 시간,
+    실행(블로킹 포함) 시간, await 대기 시간을 모으고, 루프/Tk 스레드 스택을 샘플링해
+    flamegraph 용 collapsed stack 파일(.folded)로 남김.
+    """
+    def __init__(self):
+        self.active = False
+        self.lock = RLock()
+        self.stats = {}          # (핸들러, phone) → [호출, cpu, 실행, 전체]
+        self.samples = defaultdict(int)
+        self.started = None
+        self.timer = None
+        self.last_report = []
+        self.last_folded = None
+
+    def add(self, label, phone, cpu, run, wall):
+        with self.lock:
+            row = self.stats.setdefault((label, phone), [0, 0.0, 0.0, 0.0])
+            row[0] += 1
+            row[1] += cpu
+            row[2] += run
+            row[3] += wall
+
+    def wrap_handlers(self, wrap):
+        for phone, client in list(clients.items()):
+            builders = getattr(client, "_event_builders", [])
+            for i, (builder, callback) in enumerate(builders):
+                if wrap and not isinstance(callback, ProfiledHandler):
+                    builders[i] = (builder, ProfiledHandler(callback, phone))
+                elif not wrap and isinstance(callback, ProfiledHandler):
+                    builders[i] = (builder, callback.callback)
+
+    def on_client_loop(self, fn):
+        loop = next(iter(client_loops.values()), None)
+        if loop and loop.is_running():
+            loop.call_soon_threadsafe(fn)
+        else:
+            fn()
+
+    def start(self, seconds=None):
+        seconds = seconds or profile_default_seconds
+        # HTTP 요청 스레드와 GUI 가 동시에 시작할 수 있으므로 확인과 설정을 한 번에
+        with self.lock:
+            if self.active:
+                return False
+            self.active = True
+            self.stats.clear()
+            self.samples.clear()
+            self.started = time.perf_counter()
+        self.on_client_loop(lambda: self.wrap_handlers(True))
+        Thread(target=self.sample_loop, daemon=True, name="handler-profiler").start()
+        self.timer = Timer(seconds, self.stop)
+        self.timer.daemon = True
+        self.timer.start()
+        print(f"[프로파일] {seconds}초 동안 핸들러 측정 시작")
+        return True
+
+    def sample_loop(self):
+        last_wrap = time.monotonic()
+        while self.active:
+            if time.monotonic() - last_wrap >= profile_rewrap_interval:
+                # 측정 중에 추가된 핸들러도 감쌈 (루프에서 실행될 때 이미 끝났으면 건너뜀)
+                last_wrap = time.monotonic()
+                self.on_client_loop(lambda: self.active and self.wrap_handlers(True))
+            frames = sys._current_frames()
+            for name, dog in list(watchdogs.items()):
+                frame = frames.get(dog.thread_id)
+                if frame is None:
+                    continue
+                stack = traceback.extract_stack(frame)
+                key = ";".join([name] + [f"{f.name} ({os.path.basename(f.filename)})" for f in stack])
+                with self.lock:
+                    self.samples[key] += 1
+            time.sleep(profile_sample_interval)
+
+    def stop(self):
+        with self.lock:
+            if not self.active:
+                return
+            self.active = False
+        if self.timer:
+            self.timer.cancel()
+        self.on_client_loop(lambda: self.wrap_handlers(False))
+        elapsed = time.perf_counter() - self.started
+        self.last_report = self.report()
+        self.last_folded = self.write_folded()
+        print(f"[프로파일] {elapsed:.0f}초 측정 종료 (핸들러 {len(self.last_report)}개)")
+        for row in self.last_report[:10]:
+            print(f"  {row['handler']} [{row['phone']}] 호출 {row['calls']} / CPU {row['cpu_ms']:.1f}ms "
+                  f"(호출당 {row['cpu_ms_per_call']:.2f}ms) / 대기 {row['await_ms']:.1f}ms")
+        if self.last_folded:
+            print(f"  스택 샘플: {self.last_folded}")
+
+    def report(self):
+        """CPU 시간 많은 순 (ms 단위)"""
+        with self.lock:
+            items = list(self.stats.items())
+        rows = []
+        for (label, phone), (calls, cpu, run, wall) in items:
+            rows.append({"handler": label, "phone": phone, "calls": calls,
+                         "cpu_ms": cpu * 1000, "cpu_ms_per_call": cpu * 1000 / calls,
+                         "blocked_ms": max(run - cpu, 0) * 1000, "await_ms": max(wall - run, 0) * 1000,
+                         "wall_ms": wall * 1000})
+        rows.sort(key=lambda r: r["cpu_ms"], reverse=True)
+        return rows
+
+    def write_folded(self):
+        with self.lock:
+            samples = dict(self.samples)
+        if not samples:
+            return None
+        path = config_path(f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}.folded")
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                for key, count in sorted(samples.items()):
+                    f.write(f"{key} {count}\n")
+        except OSError as e:
+            print(f"[프로파일] 스택 파일 쓰기 오류: {e}")
+            return None
+        return path
+
+handler_profiler = HandlerProfiler()
+
+# --------------------- 요청 묶음 전송 (MTProto 컨테이너) ---------------------
+batch_window = 0.005    # 요청을 모으는 시간 (초)
+batch_max_size = 20     # 한 컨테이너에 담는 최대 요청 수
+request_batchers = weakref.WeakKeyDictionary()   # client → RequestBatcher
+
+class RequestBatcher:
+    """
+    한 계정의 서로 독립적인 요청을 batch_window 동안 모아 client([...]) 한 번으로 전송.
+    결과/오류는 각 호출자에게 따로 돌려줌 (하나가 실패해도 나머지는 정상 결과).
+    """
+    def __init__(self, client):
+        self.client = client
+        self.pending = []
+        self.flush_handle = None
+        self.sending = set()   # 진행 중인 send 작업 (참조가 없으면 도중에 GC 될 수 있음)
+        self.requests_sent = 0
+        self.batches_sent = 0
+
+    async def call(self, request):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((request, future))
+        if len(self.pending) >= batch_max_size:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = loop.call_later(batch_window, self.flush)
+        return await future
+
+    def flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        batch, self.pending = self.pending, []
+        if batch:
+            task = asyncio.ensure_future(self.send(batch))
+            self.sending.add(task)
+            task.add_done_callback(self.sending.discard)
+
+    async def send(self, batch):
+        requests = [r for r, _ in batch]
+        self.requests_sent += len(requests)
+        self.batches_sent += 1
+        try:
+            if len(requests) == 1:
+                results = [await self.client(requests[0])]
+            else:
+                results = await self.client(requests)
+            errors = [None] * len(requests)
+        except MultiError as e:
+            results, errors = e.results, e.exceptions
+        except Exception as e:
+            results, errors = [None] * len(requests), [e] * len(requests)
+        for (_, future), result, error in zip(batch, results, errors):
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+def get_batcher(client):
+    batcher = request_batchers.get(client)
+    if batcher is None:
+        batcher = request_batchers[client] = RequestBatcher(client)
+    return batcher
+
+async def batched_call(client, request):
+    return await get_batcher(client).call(request)
+
+async def delete_messages_batched(client, chat_id, msg_ids):
+    """client.delete_messages 와 같지만 같은 순간의 다른 방 삭제와 한 컨테이너로 묶임"""
+    if not isinstance(msg_ids, list):
+        msg_ids = [msg_ids]
+    peer = await client.get_input_entity(chat_id)
+    if isinstance(peer, InputPeerChannel):
+        return await batched_call(client, DeleteChannelMessagesRequest(peer, msg_ids))
+    return await batched_call(client, DeleteMessagesRequest(msg_ids, revoke=True))
+
+# --------------------- 로그인 처리 ---------------------
+async def authorize_account(idx, acc, sem, input_lock):
+    phone = acc["phone"]
+    async with sem:
+        client = make_client(acc)
+        try:
+            started = time.perf_counter()
+            await client.connect()
+            record_startup_phase(phone, "connect", started)
+            started = time.perf_counter()
+            if await client.is_user_authorized():
+                print(f"[{idx+1}] {phone} 이미 로그인되어 있음 ✅")
+            else:
+                # 인증코드 입력은 콘솔을 공유하므로 한 계정씩 진행
+                async with input_lock:
+                    print(f"[{idx+1}] {phone} 인증코드 입력:")
+                    try:
+                        await client.send_code_request(phone)
+                        # input() 은 막히는 호출 → 다른 스레드에서 (그동안 다른 계정 연결/핸들러는 계속 진행)
+                        code = await asyncio.get_running_loop().run_in_executor(None, input, "→ 인증코드 입력: ")
+                        code = code.strip()
+                        try:
+                            await client.sign_in(phone, code)
+                        except Exception as e:
+                            await client.sign_in(password=acc["password"])
+                        print(f"{phone} 로그인 성공 및 세션 저장 ✅")
+                    except Exception as e:
+                        print(f"{phone} 로그인 실패: {e}")
+            record_startup_phase(phone, "authorize", started)
+            if await client.is_user_authorized():
+                # 연결을 끊지 않고 account_task 에서 그대로 재사용
+                startup_clients[phone] = client
+                return
+        except Exception as e:
+            print(f"{phone} 연결 실패: {e}")
+        try:
+            await client.disconnect()
+        except:
+            pass
+
+async def login_accounts(accounts=None):
+    global startup_started_at
+    if accounts is None:
+        accounts = load_accounts()
+    startup_started_at = time.perf_counter()
+    load_session_backend()
+    startup_timings.clear()
+    startup_expected.clear()
+    startup_expected.update(acc["phone"] for acc in accounts)
+    for acc in accounts:
+        account_profiles[acc["phone"]] = account_role_profile(acc)
+    all_accounts_ready.clear()
+    for phone in startup_expected:
+        account_ready_events.setdefault(phone, Event()).clear()
+    sem = asyncio.Semaphore(startup_connect_limit)
+    input_lock = asyncio.Lock()
+    await asyncio.gather(*(authorize_account(idx, acc, sem, input_lock) for idx, acc in enumerate(accounts)))
+    if not accounts:
+        all_accounts_ready.set()
+
+async def start_background_services():
+    """로그인 뒤 계정 작업을 시작하기 전에 클라이언트 루프에서 한 번 호출 (지표·기록·점검 루프)"""
+    start_session_snapshots()
+    start_metrics_server()
+    start_update_recorder()
+    start_tracing()
+    apply_state_budgets()
+    watch_event_loop()
+    start_room_health()
+    start_reconciler()
+
+def on_accounts_ready():
+    """모든 계정이 준비된 뒤 방배끼기/알림 핸들러 등록"""
+    run_copy_monitor()
+    update_alert_handlers()
+    resume_join_jobs()
+
+def start_login_process():
+    def _do_login():
+        accounts = load_accounts()
+        if not accounts:
+            print("등록된 계정이 없습니다. (accounts.json)")
+            return
+        # 모든 계정이 하나의 이벤트 루프에서 연결을 공유
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(login_accounts(accounts))
+        loop.run_until_complete(start_background_services())
+        for idx, acc in enumerate(accounts):
+            loop.create_task(account_task(acc, idx))
+        Thread(target=_after_ready, daemon=True).start()
+        loop.run_forever()
+    def _after_ready():
+        on_accounts_ready()
+        def after_login_refresh():
+            try:
+                refresh_watch_accounts_list_global()
+            except:
+                pass
+        if root:
+            root.after(0, after_login_refresh)
+    Thread(target=_do_login, daemon=True).start()
+
+# --------------------- 계정 간 미디어 캐시 ---------------------
+media_cache_max_bytes = 2 * 2 ** 30   # 디스크 캐시 최대 크기 (alert_settings.json 의 media_cache_mb 로 덮어씀)
+media_cache = None
+media_handles = StateMap("media_handles")   # (받는 계정, media_key) → 그 계정이 보낸 메시지의 media
+
+def media_key(media):
+    """사진/문서 미디어 → ("photo"|"doc", id), 웹페이지·위치 등 파일이 없는 미디어는 None"""
+    if isinstance(media, MessageMediaDocument) and getattr(media.document, "id", None):
+        return ("doc", media.document.id)
+    if isinstance(media, MessageMediaPhoto) and getattr(media.photo, "id", None):
+        return ("photo", media.photo.id)
+    return None
+
+def media_send_options(media):
+    """캐시에서 올린 파일을 원본과 같은 종류(사진/영상/음성/스티커 …)로 보내기 위한 send_file 인자"""
+    if isinstance(media, MessageMediaPhoto):
+        return {}
+    doc = media.document
+    options = {"attributes": list(doc.attributes), "mime_type": doc.mime_type}
+    # force_document 를 주면 영상·음성·GIF·스티커도 일반 파일이 되므로,
+    # 이름이 .jpg/.png 라서 사진으로 바뀔 문서(파일로 보낸 그림)에만 사용
+    if is_image("file" + get_extension(media)):
+        options["force_document"] = True
+    return options
+
+class MediaCache:
+    """
+    계정 간 복사용 미디어 캐시.
+    방배끼기 새 메시지는 받은 계정이 그대로 보내므로 쓰지 않고,
+    복사본을 보낸 계정이 아닌 계정이 원본 편집을 받았을 때(copy_edit_msg) 사용.
+    원본 계정으로 한 번만 내려받아 directory/<sha256> 에 두고 (id 가 달라도 내용이 같으면 파일 하나),
+    전체 크기가 max_bytes 를 넘으면 가장 오래 안 쓴 파일부터 지움.
+    받는 계정마다 한 번만 올리고, 같은 계정·같은 미디어의 동시 요청은 진행 중인 작업 하나를 같이 기다림.
+    relay_min_bytes 보다 큰 문서는 디스크에 두지 않고 relay_media 로 바로 중계.
+    """
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.files = OrderedDict()   # sha256 → 크기 (오래 안 쓴 순)
+        self.keys = {}               # "doc:id" → sha256 (index.json 에 저장)
+        self.inflight = {}           # 내려받기/올리기 진행 중인 작업
+        self.pins = defaultdict(int) # sha256 → 이 파일을 올리는 중인 작업 수 (evict 에서 제외)
+        self.total = 0
+        os.makedirs(directory, exist_ok=True)
+        self.scan()
+
+    def path(self, sha):
+        return os.path.join(self.directory, sha)
+
+    def scan(self):
+        found = []
+        for name in os.listdir(self.directory):
+            full = self.path(name)
+            if len(name) == 64 and os.path.isfile(full):
+                st = os.stat(full)
+                found.append((st.st_mtime, name, st.st_size))
+            elif name.endswith(".part"):
+                try:
+                    os.remove(full)
+                except OSError:
+                    pass
+        for _, sha, size in sorted(found):
+            self.files[sha] = size
+            self.total += size
+        try:
+            with open(self.path("index.json"), "r", encoding="utf-8") as f:
+                self.keys = {k: v for k, v in json.load(f).items() if v in self.files}
+        except (OSError, ValueError):
+            self.keys = {}
+        self.evict()
+
+    def save_index(self, keys=None):
+        config_store.write_atomic(os.path.join(os.path.basename(self.directory), "index.json"),
+                                  self.keys if keys is None else keys, indent=None)
+
+    @staticmethod
+    def remove_quietly(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def usage(self):
+        return len(self.files), self.total
+
+    async def once(self, key, factory):
+        fut = self.inflight.get(key)
+        if fut is None:
+            fut = self.inflight[key] = asyncio.ensure_future(factory())
+            fut.add_done_callback(lambda _: self.inflight.pop(key, None))
+        return await asyncio.shield(fut)
+
+    async def fetch(self, client, message):
+        """원본 계정(client)으로 받은 캐시 파일 경로, 이미 있으면 내려받지 않음"""
+        key = "%s:%s" % media_key(message.media)
+        sha = self.keys.get(key)
+        if sha in self.files:
+            self.files.move_to_end(sha)
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, os.utime, self.path(sha))
+            except OSError:
+                pass
+            metrics.inc("media_cache_total", result="hit")
+            return self.path(sha)
+        return await self.once(key, lambda: self.download(client, message, key))
+
+    async def download(self, client, message, key):
+        """조각 쓰기·sha256·파일 이동은 실행기 스레드에서 (read_parts 와 같이 이벤트 루프를 막지 않음)"""
+        metrics.inc("media_cache_total", result="miss")
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".part")
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with os.fdopen(fd, "wb") as f:
+                def write(chunk):
+                    f.write(chunk)
+                    digest.update(chunk)
+                if isinstance(message.media, MessageMediaPhoto):
+                    data = await client.download_media(message.media, file=bytes)
+                    await loop.run_in_executor(None, write, data)
+                    size = len(data)
+                else:
+                    async for chunk in client.iter_download(message.media):
+                        await loop.run_in_executor(None, write, chunk)
+                        size += len(chunk)
+            sha = digest.hexdigest()
+            if sha in self.files:
+                await loop.run_in_executor(None, os.remove, tmp)
+                self.files.move_to_end(sha)
+            else:
+                await loop.run_in_executor(None, os.replace, tmp, self.path(sha))
+                self.files[sha] = size
+                self.total += size
+                metrics.inc("media_cache_bytes_total", size, direction="download")
+        except BaseException:
+            loop.run_in_executor(None, self.remove_quietly, tmp)
+            raise
+        metrics.observe("media_download_seconds", time.monotonic() - started)
+        self.keys[key] = sha
+        self.evict(keep=sha)
+        await loop.run_in_executor(None, self.save_index, dict(self.keys))
+        return self.path(sha)
+
+    def evict(self, keep=None):
+        """오래 안 쓴 파일부터 지우되 방금 받은 keep 과 올리는 중인 파일은 남김"""
+        for sha in list(self.files):
+            if self.total <= self.max_bytes:
+                break
+            if sha == keep or sha in self.pins:
+                continue
+            self.unlink(self.path(sha))
+            self.total -= self.files.pop(sha)
+            metrics.inc("media_cache_evictions_total")
+            stale = [k for k, v in self.keys.items() if v == sha]
+            for k in stale:
+                del self.keys[k]
+
+    def unlink(self, path):
+        """이벤트 루프 안이면 실행기 스레드에서 지움 (scan 처럼 루프 밖이면 바로)"""
+        try:
+            asyncio.get_running_loop().run_in_executor(None, self.remove_quietly, path)
+        except RuntimeError:
+            self.remove_quietly(path)
+
+    async def pin(self, client, message):
+        """fetch 한 파일의 sha256 을 고정해서 반환 (unpin 전까지 지워지지 않음)"""
+        while True:
+            path = await self.fetch(client, message)
+            sha = os.path.basename(path)
+            if sha in self.files:   # fetch 완료 후 깨어나기 전에 다른 작업이 지웠으면 다시 받음
+                self.pins[sha] += 1
+                return sha
+
+    def unpin(self, sha):
+        self.pins[sha] -= 1
+        if self.pins[sha] <= 0:
+            del self.pins[sha]
+            self.evict()
+
+    async def upload(self, src_client, tgt_client, tgt_phone, message):
+        """받는 계정(tgt_client)으로 올린 InputFile, 같은 계정·미디어는 한 번만 올림"""
+        key = (tgt_phone,) + media_key(message.media)
+        async def _upload():
+            media = message.media
+            if isinstance(media, MessageMediaDocument) and (media.document.size or 0) >= relay_threshold():
+                metrics.inc("media_cache_total", result="relay")
+                return await relay_media(src_client, tgt_client, media, "file" + get_extension(media))
+            sha = await self.pin(src_client, message)
+            try:
+                started = time.monotonic()
+                handle = await upload_local_file(tgt_client, self.path(sha), "file" + get_extension(message.media))
+            finally:
+                self.unpin(sha)
+            metrics.observe("media_upload_seconds", time.monotonic() - started)
+            metrics.inc("media_cache_bytes_total", self.files.get(sha, 0), direction="upload")
+            return handle
+        return await self.once(key, _upload)
+
+def get_media_cache():
+    global media_cache
+    if media_cache is None:
+        mb = load_alert_settings().get("media_cache_mb")
+        media_cache = MediaCache(config_path("media_cache"), mb * 2 ** 20 if mb else media_cache_max_bytes)
+        register_state("media_cache_files", media_cache.usage)
+    return media_cache
+
+async def account_media(src_client, tgt_client, tgt_phone, message):
+    """
+    tgt_phone 계정이 보낼 수 있는 (file, send_file 추가 인자).
+    파일 참조는 계정 사이에 넘어가지 않으므로 다른 계정이면
+    그 계정이 전에 보낸 같은 미디어 → 캐시에서 한 번 올린 파일 순으로 사용.
+    같은 계정이면 원본 미디어를 그대로 반환 (방배끼기 새 메시지는 항상 이 경우).
+    """
+    media = message.media
+    key = media_key(media)
+    if src_client is tgt_client or key is None:
+        return media, {}
+    handle = media_handles.get((tgt_phone,) + key)
+    if handle is not None:
+        metrics.inc("media_cache_total", result="handle")
+        return handle, {}
+    uploaded = await get_media_cache().upload(src_client, tgt_client, tgt_phone, message)
+    return uploaded, media_send_options(media)
+
+def remember_media(tgt_phone, message, sent):
+    """다른 계정 미디어를 올려 보낸 결과(sent.media)를 기록 → 같은 미디어를 다시 올리지 않음"""
+    key = media_key(message.media)
+    if key is not None and getattr(sent, "media", None) is not None:
+        media_handles[(tgt_phone,) + key] = sent.media
+
+def forget_media(tgt_phone, message):
+    """기록해 둔 미디어의 파일 참조가 만료됐을 때, 다음에는 캐시에서 다시 올림"""
+    key = media_key(message.media)
+    if key is not None:
+        media_handles.pop((tgt_phone,) + key, None)
+
+# --------------------- 조각 동시 업로드 / 큰 미디어 스트리밍 중계 ---------------------
+UPLOAD_PART_SIZE = 512 * 1024      # 최대 조각 크기 (조각은 1KB 배수이며 512KB 를 나눠떨어지게 해야 함)
+BIG_FILE_SIZE = 10 * 2 ** 20       # 이보다 크면 SaveBigFilePart
+UPLOAD_MAX_PARTS = 4000            # 파일 하나의 조각 수 한도 → 512KB 조각으로 약 1.95GB 까지
+upload_parallel_parts = 4          # 로컬 파일 업로드 시 동시에 올리는 조각 수 (alert_settings.json 의 upload_parallel)
+relay_min_bytes = 64 * 2 ** 20     # 이보다 큰 문서는 디스크 캐시 없이 바로 중계 (alert_settings.json 의 relay_min_mb)
+relay_parallel_parts = 4           # 동시에 올리는 조각 수 (relay_parallel)
+relay_buffer_parts = 8             # 내려받아 두는 조각 수 한도 → 메모리 ≈ (8 + 4) × 512KB
+
+def upload_part_size(size):
+    """작은 파일은 조각을 잘게 나눠 동시 업로드 효과를 보고, 클수록 키워서 512KB 까지 (조각 수 한도는 upload_parts 가 확인)"""
+    for kb in (32, 64, 128, 256):
+        if size <= kb * 1024 * 64:
+            return kb * 1024
+    return UPLOAD_PART_SIZE
+
+async def read_parts(path, part_size):
+    loop = asyncio.get_running_loop()
+    with open(path, "rb") as f:
+        while True:
+            chunk = await loop.run_in_executor(None, f.read, part_size)
+            if not chunk:
+                return
+            yield chunk
+
+async def upload_local_file(client, path, file_name):
+    """로컬 파일을 client 계정에 조각 동시 업로드 (client.upload_file 은 조각을 하나씩 순서대로 올림)"""
+    size = os.path.getsize(path)
+    part_size = upload_part_size(size)
+    return await upload_parts(
+        client, read_parts(path, part_size), size, file_name, part_size,
+        parallel=load_alert_settings().get("upload_parallel", upload_parallel_parts),
+    )
+
+async def save_part(client, request):
+    for attempt in range(3):
+        try:
+            return await client(request)
+        except FloodWaitError as e:
+            if attempt == 2:
+                raise
+            await asyncio.sleep(e.seconds + 1)
+
+async def upload_parts(client, chunks, size, file_name, part_size=UPLOAD_PART_SIZE,
+                       parallel=relay_parallel_parts, buffer=relay_buffer_parts):
+    """
+    chunks(part_size 단위로 나오는 async iterator) 를 내려받는 대로 client 계정에 올린 InputFile(Big).
+    조각은 memoryview 로 buffer 개까지만 쌓아두고 parallel 개씩 동시에 올리며,
+    마지막 조각 외에는 크기가 part_size 와 같아야 하고 합계가 size 와 다르면 ValueError.
+    조각 수가 UPLOAD_MAX_PARTS 를 넘으면 아무것도 올리기 전에 ValueError.
+    """
+    total_parts = max(1, -(-size // part_size))
+    if total_parts > UPLOAD_MAX_PARTS:
+        raise ValueError(f"{file_name}: {size / 2 ** 20:.0f}MB 는 {part_size // 1024}KB 조각 {total_parts}개 "
+                         f"→ 조각 수 한도 {UPLOAD_MAX_PARTS}개 ({UPLOAD_MAX_PARTS * part_size / 2 ** 20:.0f}MB) 초과")
+    is_big = size > BIG_FILE_SIZE
+    file_id = random.getrandbits(63)
+    md5 = None if is_big else hashlib.md5()
+    pending = asyncio.Queue(maxsize=buffer)
+
+    async def produce():
+        index = received = 0
+        async for chunk in chunks:
+            view = memoryview(chunk)
+            if not view:
+                continue
+            if index >= total_parts or (index < total_parts - 1 and len(view) != part_size):
+                raise ValueError(f"조각 {index} 크기 {len(view)} (예상 {part_size}, 전체 {total_parts}개)")
+            if md5 is not None:
+                md5.update(view)
+            received += len(view)
+            await pending.put((index, view))
+            index += 1
+        if received != size:
+            raise ValueError(f"받은 크기 {received} ≠ 파일 크기 {size}")
+        for _ in range(parallel):
+            await pending.put(None)
+
+    async def upload():
+        while True:
+            item = await pending.get()
+            if item is None:
+                return
+            index, view = item
+            data = view.obj if len(view) == len(view.obj) else bytes(view)
+            if is_big:
+                await save_part(client, SaveBigFilePartRequest(file_id, index, total_parts, data))
+            else:
+                await save_part(client, SaveFilePartRequest(file_id, index, data))
+            metrics.inc("upload_parts_total", big=str(is_big).lower())
+
+    tasks = [asyncio.ensure_future(produce())] + [asyncio.ensure_future(upload()) for _ in range(parallel)]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for t in tasks:
+            t.cancel()
+        raise
+    if is_big:
+        return InputFileBig(file_id, total_parts, file_name)
+    return InputFile(file_id, total_parts, file_name, md5.hexdigest())
+
+async def relay_media(src_client, tgt_client, media, file_name):
+    """문서를 src_client 로 받으면서 바로 tgt_client 로 올림 (임시 파일·전체 버퍼 없음)"""
     settings = load_alert_settings()
-    settings["admin_accounts_list"] = admin_accounts_list
-    settings["admin_rooms_list"] = admin_rooms_list
-    settings["admin_function_settings"] = admin_function_settings
-    settings["admin_enabled"] = admin_enabled
-    save_alert_settings(settings)
+    started = time.monotonic()
+    part_size = upload_part_size(media.document.size)
+    handle = await upload_parts(
+        tgt_client,
+        src_client.iter_download(media, request_size=part_size),
+        media.document.size, file_name, part_size,
+        parallel=settings.get("relay_parallel", relay_parallel_parts),
+    )
+    metrics.observe("media_relay_seconds", time.monotonic() - started)
+    metrics.inc("media_cache_bytes_total", media.document.size, direction="relay")
+    return handle
 
-# --------------------- 정규화 함수 (chat_id 비교 용) ---------------------
-def normalize_chat_id(chat_id):
-    s = str(chat_id)
-    if s.startswith("-100"):
-        return chat_id
-    if s.startswith("-"):
-        return int("-100" + s[1:])
-    return chat_id
+def relay_threshold():
+    mb = load_alert_settings().get("relay_min_mb")
+    return mb * 2 ** 20 if mb is not None else relay_min_bytes
 
-# --------------------- 로그인 처리 ---------------------
-async def login_accounts():
-    accounts = load_accounts()
-    for idx, acc in enumerate(accounts):
-        phone = acc["phone"]
-        session_name = acc.get("session_name", f"session_{phone}")
-        client = TelegramClient(session_name, acc["api_id"], acc["api_hash"])
+# --------------------- 전송 outbox (중단된 fan-out 이어서 전송) ---------------------
+outbox_linger = 0.01               # 첫 기록 뒤 같은 묶음으로 모으는 시간(초) → 묶음마다 fsync 1번
+outbox_max_age = 6 * 3600          # 재시작 때 이보다 오래된 미완료 작업은 보내지 않고 버림(초)
+outbox_compact_bytes = 8 * 2 ** 20 # 로그가 이보다 커지면 미완료 작업만 남겨 다시 씀
+outbox = None
+
+class Outbox:
+    """
+    config/outbox.jsonl: 방별 전송 작업을 보내기 전에 "op" 로 기록하고 끝나면 "done" 기록 (write-ahead).
+    작업마다 random_id 를 미리 정해 같이 저장하므로, 다시 보내도 텔레그램이 중복으로 거절(RandomIdDuplicate).
+    기록은 전용 스레드가 모아서 한 번에 쓰고 묶음마다 fsync 한 번.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.pending = OrderedDict()   # op id → op (미완료, 기록 순서)
+        self.lock = RLock()
+        self.queue = queue.Queue()
+        self.load()
+        self.file = open(path, "a", encoding="utf-8")
+        Thread(target=self.writer, daemon=True).start()
+
+    def load(self):
         try:
-            await client.connect()
-            if await client.is_user_authorized():
-                print(f"[{idx+1}] {phone} 이미 로그인되어 있음 ✅")
-                continue
-            print(f"[{idx+1}] {phone} 인증코드 입력:")
-            try:
-                await client.send_code_request(phone)
-                code = input(f"→ 인증코드 입력: ").strip()
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue   # 쓰다 만 마지막 줄
+                    if rec.get("k") == "op":
+                        self.pending[rec["id"]] = rec
+                    else:
+                        self.pending.pop(rec.get("id"), None)
+        except OSError:
+            pass
+        cutoff = time.time() - outbox_max_age
+        stale = [i for i, op in self.pending.items() if op["t"] < cutoff]
+        for i in stale:
+            del self.pending[i]
+        if stale:
+            print(f"[outbox] 오래된 미완료 작업 {len(stale)}개 버림")
+        self.compact()
+
+    def compact(self):
+        """미완료 작업만 남겨서 원자적으로 다시 씀"""
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.path), prefix=".tmp_", suffix=".jsonl")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            with self.lock:
+                f.write("".join(json.dumps(op, ensure_ascii=False) + "\n" for op in self.pending.values()))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def writer(self):
+        while True:
+            batch = [self.queue.get()]
+            time.sleep(outbox_linger)
+            while True:
                 try:
-                    await client.sign_in(phone, code)
-                except Exception as e:
-                    await client.sign_in(password=acc["password"])
-                print(f"{phone} 로그인 성공 및 세션 저장 ✅")
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            error = None
+            try:
+                self.file.write("".join(text for text, _ in batch))
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                metrics.inc("outbox_fsyncs_total")
+                if self.file.tell() > outbox_compact_bytes:
+                    self.file.close()
+                    self.compact()
+                    self.file = open(self.path, "a", encoding="utf-8")
             except Exception as e:
-                print(f"{phone} 로그인 실패: {e}")
-        finally:
-            await client.disconnect()
+                error = e
+                print(f"[outbox] 기록 오류: {e}")
+            for _, fut in batch:
+                if error:
+                    fut.set_exception(error)
+                else:
+                    fut.set_result(None)
 
-def start_login_process():
-    def _do_login():
-        accounts = load_accounts()
-        if accounts:
-            asyncio.run(login_accounts())
-            for idx, acc in enumerate(accounts):
-                Thread(target=lambda a=acc, i=idx: asyncio.run(account_task(a, i))).start()
-        else:
-            print("등록된 계정이 없습니다. (accounts.json)")
-        Thread(target=run_copy_monitor, daemon=True).start()
-        update_alert_handlers()
-        def after_login_refresh():
+    def write(self, records):
+        fut = concurrent.futures.Future()
+        self.queue.put(("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records), fut))
+        metrics.inc("outbox_records_total", len(records))
+        return fut
+
+    async def plan(self, phone, chat_id, messages, kind, rooms, caption=True):
+        """
+        방마다 작업 하나씩 기록하고 디스크에 닿은 뒤 반환 (방 순서 유지).
+        기록에 실패하면 전송은 막지 않고 메모리에서만 빼서 그대로 반환 (재시작 때 이어서 보내지 못함).
+        """
+        now = time.time()
+        ops = [{"k": "op", "id": uuid.uuid4().hex, "t": now, "phone": phone, "chat": chat_id,
+                "msgs": [m.id for m in messages], "kind": kind, "room": r, "caption": caption,
+                "rid": [random.getrandbits(63) for _ in messages]} for r in rooms]
+        with self.lock:
+            for op in ops:
+                self.pending[op["id"]] = op
+        if ops:
             try:
-                refresh_watch_accounts_list_global()
-            except:
-                pass
-        if root:
-            root.after(1500, after_login_refresh)
-    Thread(target=_do_login, daemon=True).start()
+                await asyncio.wrap_future(self.write(ops))
+            except Exception as e:
+                print(f"[outbox] 작업 {len(ops)}개 기록 실패 → 기록 없이 전송: {e}")
+                metrics.inc("outbox_write_failures_total")
+                with self.lock:
+                    for op in ops:
+                        self.pending.pop(op["id"], None)
+                        op["unlogged"] = True
+        return ops
+
+    def done(self, op, error=None):
+        """
+        끝난 작업 기록 (디스크에 닿을 때까지 기다리지 않음).
+        기록 전에 멈추면 재시작 때 같은 random_id 로 다시 보내지고 텔레그램이 중복으로 거절.
+        """
+        with self.lock:
+            self.pending.pop(op["id"], None)
+        if op.get("unlogged"):
+            return
+        rec = {"k": "done", "id": op["id"]}
+        if error:
+            rec["error"] = error
+        self.write([rec])
+
+    def pending_for(self, phone):
+        with self.lock:
+            return [op for op in self.pending.values() if op["phone"] == phone]
+
+def get_outbox():
+    global outbox
+    if outbox is None:
+        outbox = Outbox(config_path("outbox.jsonl"))
+    return outbox
+
+def sent_message_ids(result, random_ids):
+    """Send*Request 결과 → random_id 순서대로 보낸 메시지 id"""
+    if isinstance(result, UpdateShortSentMessage):
+        return [result.id]
+    by_random = {u.random_id: u.id for u in getattr(result, "updates", []) if isinstance(u, UpdateMessageID)}
+    return [by_random.get(r) for r in random_ids]
+
+async def send_outbox_op(client, ent, op, messages):
+    """작업 하나를 기록된 random_id 로 전송 → 보낸 메시지 id 목록 (이미 보낸 작업이면 빈 목록)"""
+    rids = op["rid"]
+    first = messages[0]
+    caption = first.raw_text if op["caption"] else ""
+    entities = first.entities if caption else None
+    if op["kind"] == "text":
+        request = SendMessageRequest(ent, first.raw_text, no_webpage=False, random_id=rids[0],
+                                     entities=first.entities)
+    elif op["kind"] == "media":
+        request = SendMediaRequest(ent, get_input_media(first.media), caption, random_id=rids[0], entities=entities)
+    else:
+        request = SendMultiMediaRequest(ent, [
+            InputSingleMedia(get_input_media(m.media), caption if i == 0 else "", random_id=rid,
+                             entities=entities if i == 0 else None)
+            for i, (m, rid) in enumerate(zip(messages, rids))
+        ])
+    try:
+        result = await client(request)
+    except RandomIdDuplicateError:
+        # 이전 실행에서 이미 보냄, 텔레그램은 그때의 메시지 id 를 알려주지 않으므로 delete_map 에 연결을 남기지 못함
+        # → 연결은 reconcile 의 내용 비교(plan_room_sync 의 found)가 이 방 최근 메시지에서 찾아 채움
+        metrics.inc("outbox_duplicates_total")
+        return []
+    return sent_message_ids(result, rids)
+
+async def run_outbox_ops(client, phone, ops, messages, trace):
+    """기록된 작업을 순서대로 전송, 성공/실패 모두 done (실패는 이전처럼 재시도하지 않음)"""
+    box = get_outbox()
+    for op in ops:
+        r = op["room"]
+        try:
+            await wait_room_turn(phone, r)
+            ent = await client.get_input_entity(r)
+            sent_ids = await send_outbox_op(client, ent, op, messages)
+            for m, sid in zip(messages, sent_ids):
+                if sid is not None:
+                    delete_map.setdefault((phone, m.id), []).append((r, sid))
+            box.done(op)
+            trace.sent(r)
+        except Exception as e:
+            box.done(op, str(e))
+            trace.failed(r, e)
+            print(f"{phone} 서브방 전송 오류 ({op['kind']}): {e}")
+        await trace.pace(send_delay)
+
+async def resume_outbox(phone, client):
+    """이전 실행에서 끝나지 않은 작업을 원본 메시지를 다시 읽어 기록 순서대로 이어서 전송"""
+    ops = get_outbox().pending_for(phone)
+    if not ops:
+        return
+    print(f"[{phone}] outbox 미완료 작업 {len(ops)}개 이어서 전송")
+    groups = OrderedDict()
+    for op in ops:
+        groups.setdefault((op["chat"], tuple(op["msgs"])), []).append(op)
+    for (chat_id, msg_ids), group in groups.items():
+        try:
+            messages = await client.get_messages(chat_id, ids=list(msg_ids))
+        except Exception as e:
+            messages = [None]
+            print(f"[{phone}] outbox 원본 조회 오류: {e}")
+        if any(m is None for m in messages):
+            for op in group:
+                get_outbox().done(op, "원본 메시지 없음")
+            continue
+        trace = SendTrace("resume", phone, messages[0])
+        trace.link((phone, messages[0].id))
+        await run_outbox_ops(client, phone, group, messages, trace)
+        trace.done()
 
 # --------------------- 메인방 → 서브방 전송 ---------------------
-def forward_to_subrooms(client, account, message, target_rooms=None):
+def forward_to_subrooms(client, account, message, target_rooms=None, trace=None):
     async def _forward():
         phone = account["phone"]
-        rooms = target_rooms if target_rooms is not None else account.get("subroom_ids", [])
+        rooms = sendable_rooms(phone, target_rooms if target_rooms is not None else account.get("subroom_ids", []))
+        tr = trace or SendTrace("forward", phone)
+        tr.link((phone, message.id))
         if message.text and not message.media:
             for r in rooms:
                 try:
+                    await wait_room_turn(phone, r)
                     ent = await client.get_input_entity(r)
                     msg_sent = await client.send_message(
                         ent, message.raw_text,
@@ -298,12 +2554,15 @@ def forward_to_subrooms(client, account, message, target_rooms=None):
                         link_preview=True
                     )
                     delete_map.setdefault((phone, message.id), []).append((r, msg_sent.id))
+                    tr.sent(r)
                 except Exception as e:
+                    tr.failed(r, e)
                     print(f"{phone} 서브방 텍스트 오류: {e}")
-                await asyncio.sleep(send_delay)
+                await tr.pace(send_delay)
         elif message.media:
             for r in rooms:
                 try:
+                    await wait_room_turn(phone, r)
                     ent = await client.get_input_entity(r)
                     msg_sent = await client.send_file(
                         ent, file=message.media,
@@ -315,30 +2574,40 @@ def forward_to_subrooms(client, account, message, target_rooms=None):
                             delete_map.setdefault((phone, message.id), []).append((r, s_m.id))
                     else:
                         delete_map.setdefault((phone, message.id), []).append((r, msg_sent.id))
+                    tr.sent(r)
                 except Exception as e:
+                    tr.failed(r, e)
                     print(f"{phone} 서브방 미디어 오류: {e}")
-                await asyncio.sleep(send_delay)
+                await tr.pace(send_delay)
+        if trace is None:
+            tr.done()
     return _forward
 
-def forward_to_subrooms_expert(client, account, key, message, target_rooms=None):
+def forward_to_subrooms_expert(client, account, key, message, target_rooms=None, trace=None):
     async def _forward():
         phone = account["phone"]
-        rooms = target_rooms if target_rooms is not None else account.get("subroom_ids", [])
+        rooms = sendable_rooms(phone, target_rooms if target_rooms is not None else account.get("subroom_ids", []))
+        tr = trace or SendTrace("expert", phone)
+        tr.link(key)
         if message.text and not message.media:
             for r in rooms:
                 try:
+                    await wait_room_turn(phone, r)
                     ent = await client.get_input_entity(r)
                     msg_sent = await client.send_message(
                         ent, message.raw_text,
                         formatting_entities=message.entities
                     )
                     delete_map.setdefault(key, []).append((r, msg_sent.id))
+                    tr.sent(r)
                 except Exception as e:
+                    tr.failed(r, e)
                     print(f"{phone} 전문가 서브방 텍스트 오류: {e}")
-                await asyncio.sleep(send_delay)
+                await tr.pace(send_delay)
         elif message.media:
             for r in rooms:
                 try:
+                    await wait_room_turn(phone, r)
                     ent = await client.get_input_entity(r)
                     msg_sent = await client.send_file(
                         ent, file=message.media,
@@ -350,12 +2619,17 @@ def forward_to_subrooms_expert(client, account, key, message, target_rooms=None)
                             delete_map.setdefault(key, []).append((r, s_m.id))
                     else:
                         delete_map.setdefault(key, []).append((r, msg_sent.id))
+                    tr.sent(r)
                 except Exception as e:
+                    tr.failed(r, e)
                     print(f"{phone} 전문가 서브방 미디어 오류: {e}")
-                await asyncio.sleep(send_delay)
+                await tr.pace(send_delay)
+        if trace is None:
+            tr.done()
     return _forward
 
 async def handle_new_message(event, client, subroom_ids, account):
+    received = time.monotonic()
     me = await client.get_me()
     phone = me.phone.lstrip("+")
     if not is_account_active(phone):
@@ -369,62 +2643,40 @@ async def handle_new_message(event, client, subroom_ids, account):
     if grouped_id:
         media_groups[grouped_id].append(event.message)
         await asyncio.sleep(media_group_timeout)
-        if media_groups[grouped_id]:
-            await flush_media_group(client, grouped_id, media_groups[grouped_id], subroom_ids, phone)
+        # 처음 깨어난 핸들러가 앨범을 가져가서 전송 (나머지는 빈 목록)
+        messages = media_groups.pop(grouped_id, None)
+        if messages:
+            await flush_media_group(client, grouped_id, messages, subroom_ids, phone, received)
         return
 
-    if event.text and not event.media:
-        for r in subroom_ids:
-            try:
-                ent = await client.get_input_entity(r)
-                msg_sent = await client.send_message(
-                    ent, event.raw_text,
-                    formatting_entities=event.message.entities,
-                    link_preview=True
-                )
-                delete_map.setdefault((phone, event.id), []).append((r, msg_sent.id))
-            except Exception as e:
-                print(f"{phone} 서브방 텍스트 오류: {e}")
-            await asyncio.sleep(send_delay)
+    trace = SendTrace("main", phone, event.message, received)
+    trace.link((phone, event.id))
+    rooms = sendable_rooms(phone, subroom_ids)
+    # 링크 미리보기(웹페이지)는 파일로 보낼 수 없으므로 텍스트로 (미리보기는 링크에서 다시 생성)
+    if (event.text and not event.media) or isinstance(event.media, MessageMediaWebPage):
+        ops = await get_outbox().plan(phone, event.chat_id, [event.message], "text", rooms)
+        await run_outbox_ops(client, phone, ops, [event.message], trace)
+        trace.done()
         recent_sent_text[phone] = event.raw_text
-    elif event.media and isinstance(event.media, (MessageMediaPhoto, MessageMediaDocument, MessageMediaWebPage)):
-        caption = event.raw_text
-        if caption == recent_sent_text.get(phone):
-            caption = None
-        for r in subroom_ids:
-            try:
-                ent = await client.get_input_entity(r)
-                msg_sent = await client.send_file(
-                    ent, file=event.media,
-                    caption=caption,
-                    formatting_entities=event.message.entities if caption else None
-                )
-                delete_map.setdefault((phone, event.id), []).append((r, msg_sent.id) if not isinstance(msg_sent, list) else [(r, s.id) for s in msg_sent])
-            except Exception as e:
-                print(f"{phone} 서브방 미디어 오류: {e}")
-            await asyncio.sleep(send_delay)
+    elif event.media and isinstance(event.media, (MessageMediaPhoto, MessageMediaDocument)):
+        caption = event.raw_text != recent_sent_text.get(phone)
+        ops = await get_outbox().plan(phone, event.chat_id, [event.message], "media", rooms, caption=caption)
+        await run_outbox_ops(client, phone, ops, [event.message], trace)
+        trace.done()
         recent_sent_text[phone] = ""
 
-async def flush_media_group(client, group_id, messages, subroom_ids, phone):
+async def flush_media_group(client, group_id, messages, subroom_ids, phone, received=None):
     if not messages:
         return
     first_msg = messages[0]
     if not subroom_ids:
         return
-    for r in subroom_ids:
-        try:
-            ent = await client.get_input_entity(r)
-            sent = await client.send_file(
-                ent, files=[m.media for m in messages],
-                caption=first_msg.raw_text,
-                formatting_entities=first_msg.entities if first_msg.raw_text else None
-            )
-            for m, s_m in zip(messages, sent):
-                delete_map.setdefault((phone, m.id), []).append((r, s_m.id))
-        except Exception as e:
-            print(f"{phone} 미디어그룹 전송 오류: {e}")
-        await asyncio.sleep(send_delay)
-    media_groups[group_id].clear()
+    trace = SendTrace("album", phone, first_msg, received)
+    for m in messages:
+        trace.link((phone, m.id))
+    ops = await get_outbox().plan(phone, first_msg.chat_id, messages, "album", sendable_rooms(phone, subroom_ids))
+    await run_outbox_ops(client, phone, ops, messages, trace)
+    trace.done()
 
 async def handle_message_edit(event, client, subroom_ids, account):
     me = await client.get_me()
@@ -441,6 +2693,7 @@ async def handle_message_edit(event, client, subroom_ids, account):
             break
     if 수정_idx == -1:
         return
+    trace = SendTrace("edit", phone, trace_id=trace_links.get((phone, event.id)))
     is_sup_media = isinstance(event.media, (MessageMediaPhoto, MessageMediaDocument))
     is_media_different = is_sup_media and bool(event.media)
     for r in subroom_ids:
@@ -459,92 +2712,329 @@ async def handle_message_edit(event, client, subroom_ids, account):
                     formatting_entities=event.message.entities,
                     file=event.media if is_sup_media else None
                 )
+                trace.sent(r)
             except Exception as e:
+                trace.failed(r, e)
                 print(f"{phone} 서브방 수정 오류: {e}")
+    trace.done()
     await asyncio.sleep(send_delay)
 
 async def handle_deleted_event(event, phone):
     phone = phone.lstrip("+")
     if not is_account_active(phone):
         return
+    client = clients[phone]
+    jobs, traces = [], []
     for del_id in event.deleted_ids:
-        key = (phone, del_id)
-        if key in delete_map:
-            for (sub_cid, sub_mid) in delete_map[key]:
-                try:
-                    await clients[phone].delete_messages(sub_cid, sub_mid)
-                except Exception as e:
-                    print(f"{phone} 서브 메시지 삭제 오류: {e}")
-            delete_map.pop(key, None)
+        targets = delete_map.pop((phone, del_id), [])
+        if not targets:
+            continue
+        trace = SendTrace("delete", phone, trace_id=trace_links.pop((phone, del_id), None))
+        traces.append(trace)
+        jobs += [trace.run(sub_cid, delete_messages_batched(client, sub_cid, sub_mid)) for (sub_cid, sub_mid) in targets]
+    # 서로 다른 서브방 삭제를 한 번에 보내서 컨테이너로 묶이게 함
+    results = await asyncio.gather(*jobs, return_exceptions=True)
+    for trace in traces:
+        trace.done()
+    for e in results:
+        if isinstance(e, Exception):
+            print(f"{phone} 서브 메시지 삭제 오류: {e}")
 
-# --------------------- 채팅방 입장/나가기 처리 ---------------------
-async def join_chat_task(client, link, phone):
-    print(f"[{phone}] 입장 시도...")
-    try:
-        entity = await client.get_input_entity(link)
-        try:
-            await client(GetParticipantRequest(entity, 'me'))
-        except:
-            pass
-    except:
+# --------------------- 일괄 입장/나가기 작업 ---------------------
+join_concurrency = 5        # 동시에 입장/나가기를 진행할 계정 수
+join_wave_size = 20         # 한 웨이브에 투입할 계정 수
+join_wave_delay = 3         # 웨이브 사이 대기(초)
+join_flood_rounds = 3       # FloodWait 으로 남은 계정을 작업 안에서 다시 도는 횟수 (그래도 남으면 재시작 때 이어서)
+join_semaphore = None       # 모든 작업이 함께 쓰는 동시 진행 한도 (join_concurrency, 클라이언트 루프에서 생성)
+join_flood_until = 0.0      # FloodWait 으로 전체 작업이 멈춰 있는 종료 시각 (time.monotonic)
+join_jobs = {}              # job_id → 작업 상태 (join_jobs.json 에 저장, 재시작 후 이어서 진행)
+join_save_delay = 2         # 계정 결과마다 저장하지 않고 이 간격(초)으로 모아서 저장
+join_keep_finished = 20     # 끝난 작업은 최근 몇 개만 남김
+join_save_handle = None
+
+def load_join_jobs():
+    return config_store.get("join_jobs.json", {}) or {}
+
+def save_join_jobs():
+    """클라이언트 루프에서만 호출, 결과가 몰려도 join_save_delay 초에 한 번만 저장"""
+    global join_save_handle
+    if join_save_handle is None:
+        join_save_handle = asyncio.get_running_loop().call_later(join_save_delay, flush_join_jobs)
+
+def flush_join_jobs():
+    global join_save_handle
+    join_save_handle = None
+    config_store.set("join_jobs.json", join_jobs)
+
+def get_join_semaphore():
+    global join_semaphore
+    if join_semaphore is None:
+        join_semaphore = asyncio.Semaphore(join_concurrency)
+    return join_semaphore
+
+def join_backlog():
+    """계정별로 진행 중인 입장/나가기 작업에서 아직 처리하지 않은 수 (계정 목록·지표 탭용)"""
+    counts = defaultdict(int)
+    for job in list(join_jobs.values()):
+        if job.get("state") == "running":
+            for phone, st in list(job["status"].items()):
+                if st == "pending":
+                    counts[phone] += 1
+    return counts
+
+def prune_join_jobs():
+    """끝난 작업(done/failed)은 최근 join_keep_finished 개만 남김"""
+    finished = sorted((job.get("created", 0), job_id) for job_id, job in join_jobs.items()
+                      if job.get("state") != "running")
+    for _, job_id in finished[:max(0, len(finished) - join_keep_finished)]:
+        del join_jobs[job_id]
+
+def parse_invite_link(link):
+    """초대 링크 → ("invite", 해시) 또는 ("public", 유저네임)"""
+    link = link.strip().rstrip("/")
+    tail = link.split("/")[-1]
+    if "joinchat/" in link or tail.startswith("+"):
+        return "invite", tail.lstrip("+")
+    return "public", tail.lstrip("@")
+
+async def resolve_invite(link, phones, need_chat_id=False):
+    """초대 링크를 작업당 한 번만 조회 (CheckChatInviteRequest)"""
+    kind, value = parse_invite_link(link)
+    info = {"kind": kind, "value": value, "chat_id": None, "title": None, "is_channel": True}
+    for phone in [p for p in phones if p in clients][:3]:
         try:
-            hash_part = link.split('/')[-1].replace('+','')
-            await client(ImportChatInviteRequest(hash_part))
+            async with using_client(phone) as client:
+                if kind == "public":
+                    ent = await client.get_entity(value)
+                    info.update(chat_id=get_peer_id(ent), title=getattr(ent, "title", value),
+                                is_channel=isinstance(ent, Channel))
+                    return info
+                res = await client(CheckChatInviteRequest(value))
+                if isinstance(res, (ChatInviteAlready, ChatInvitePeek)):
+                    info.update(chat_id=get_peer_id(res.chat), title=res.chat.title,
+                                is_channel=isinstance(res.chat, Channel))
+                    return info
+                info.update(title=res.title, is_channel=bool(res.channel or res.megagroup))
+                if not need_chat_id:
+                    return info
         except Exception as e:
-            print(f"[{phone}] 입장 오류: {e}")
+            print(f"[{phone}] 초대 링크 조회 오류: {e}")
+    return info if info["title"] else None
 
-async def leave_chat_task(client, link, phone):
-    print(f"[{phone}] 나가기 시도...")
+async def is_chat_member(client, chat_id):
     try:
-        entity = await client.get_input_entity(link)
-        if not hasattr(entity, 'id') or not hasattr(entity, 'access_hash'):
-            print(f"[{phone}] 나가기 오류: 일반그룹(chat)은 나가기 불가")
+        ent = await client.get_input_entity(chat_id)
+    except Exception:
+        return False
+    if isinstance(ent, InputPeerChannel):
+        try:
+            await batched_call(client, GetParticipantRequest(ent, "me"))
+            return True
+        except UserNotParticipantError:
+            return False
+    if isinstance(ent, InputPeerChat):
+        # 일반그룹은 나가거나 추방돼도 peer 가 세션에 남으므로 방 상태로 확인
+        try:
+            chats = (await client(GetChatsRequest([ent.chat_id]))).chats
+        except (ChatIdInvalidError, PeerIdInvalidError):
+            return False
+        chat = chats[0] if chats else None
+        return isinstance(chat, Chat) and not chat.left and not chat.deactivated
+    return False
+
+async def join_one_account(phone, info):
+    async with using_client(phone) as client:
+        if client is None:
+            return "failed: 클라이언트 없음"
+        if info["chat_id"] is not None and await is_chat_member(client, info["chat_id"]):
+            return "already"
+        try:
+            if info["kind"] == "invite":
+                await client(ImportChatInviteRequest(info["value"]))
+            else:
+                await client(JoinChannelRequest(await client.get_input_entity(info["value"])))
+        except UserAlreadyParticipantError:
+            return "already"
+        return "joined"
+
+async def leave_one_account(phone, info):
+    async with using_client(phone) as client:
+        if client is None:
+            return "failed: 클라이언트 없음"
+        target = info["chat_id"]
+        if target is None and info["kind"] == "invite":
+            # 조회한 계정들이 모두 멤버가 아니어서 방 id 를 모름 → 이 계정으로 초대 링크를 확인
+            res = await client(CheckChatInviteRequest(info["value"]))
+            if not isinstance(res, (ChatInviteAlready, ChatInvitePeek)):
+                return "not_member"
+            target = get_peer_id(res.chat)
+        elif target is None:
+            target = info["value"]
+        if not await is_chat_member(client, target):
+            return "not_member"
+        ent = await client.get_input_entity(target)
+        if isinstance(ent, InputPeerChannel):
+            await client(LeaveChannelRequest(ent))
+        else:
+            await client(DeleteChatUserRequest(ent.chat_id, InputUserSelf()))
+        return "left"
+
+async def run_job_account(job, phone):
+    global join_flood_until
+    action = join_one_account if job["type"] == "join" else leave_one_account
+    async with get_join_semaphore():
+        result = "failed"
+        for attempt in range(3):
+            wait = join_flood_until - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                result = await action(phone, job["info"])
+                break
+            except FloodWaitError as e:
+                join_flood_until = max(join_flood_until, time.monotonic() + e.seconds + 1)
+                print(f"[{phone}] FloodWait {e.seconds}초 → 입장/나가기 작업 일시정지")
+                result = "pending"   # 실패로 남기지 않고 다음 회차/재시작 때 다시
+            except Exception as e:
+                result = f"failed: {e}"
+                break
+        job["status"][phone] = result
+        save_join_jobs()
+
+def print_join_job_report(job_id):
+    job = join_jobs.get(job_id)
+    if not job:
+        return
+    counts = defaultdict(int)
+    for st in job["status"].values():
+        counts[st.split(":")[0]] += 1
+    done = sum(v for k, v in counts.items() if k != "pending")
+    elapsed = job.get("elapsed", 0.0)
+    rate = done / elapsed if elapsed else 0.0
+    title = (job.get("info") or {}).get("title") or job["link"]
+    summary = " / ".join(f"{k} {v}" for k, v in sorted(counts.items()))
+    print(f"[{job['type']} 작업 {job_id}] {title}: {summary} ({done}/{len(job['phones'])}, {elapsed:.1f}초, {rate:.2f}계정/초)")
+    for phone, st in job["status"].items():
+        if st.startswith("failed"):
+            print(f"  [{phone}] {st}")
+
+async def run_join_job(job_id):
+    job = join_jobs[job_id]
+    started = time.perf_counter() - job.get("elapsed", 0.0)
+    if not job.get("info"):
+        job["info"] = await resolve_invite(job["link"], job["phones"], need_chat_id=job["type"] == "leave")
+        if not job["info"]:
+            print(f"[{job['type']} 작업 {job_id}] 링크 조회 실패: {job['link']}")
+            job["state"] = "failed"
+            prune_join_jobs()
+            save_join_jobs()
             return
-        await client(LeaveChannelRequest(entity))
-    except Exception as e:
-        print(f"[{phone}] 나가기 오류: {e}")
+        save_join_jobs()
+    for _ in range(join_flood_rounds):
+        pending = [p for p in job["phones"] if job["status"].get(p, "pending") == "pending"]
+        if not pending:
+            break
+        for i in range(0, len(pending), join_wave_size):
+            wave = pending[i:i + join_wave_size]
+            await asyncio.gather(*(run_job_account(job, p) for p in wave))
+            job["elapsed"] = time.perf_counter() - started
+            print_join_job_report(job_id)
+            if i + join_wave_size < len(pending):
+                await asyncio.sleep(join_wave_delay)
+    left = sum(1 for p in job["phones"] if job["status"].get(p, "pending") == "pending")
+    if left:
+        # state 는 running 으로 두어 resume_join_jobs 가 재시작 때 남은 계정만 이어서 진행
+        print(f"[{job['type']} 작업 {job_id}] FloodWait 로 {left}개 계정 남음 → 재시작 때 이어서 진행")
+        save_join_jobs()
+        return
+    job["state"] = "done"
+    job["elapsed"] = time.perf_counter() - started
+    print_join_job_report(job_id)
+    prune_join_jobs()
+    save_join_jobs()
 
-async def handle_commands(phone, client):
-    q = command_queues[phone]
-    while True:
-        cmd = await q.get()
-        if cmd["type"] == "join":
-            await join_chat_task(client, cmd["link"], phone)
-        elif cmd["type"] == "leave":
-            await leave_chat_task(client, cmd["link"], phone)
+async def add_join_job(job_id, job):
+    # join_jobs 는 클라이언트 루프에서만 바꿈 (저장 사본을 뜨는 중에 GUI 스레드가 바꾸지 않도록)
+    join_jobs[job_id] = job
+    save_join_jobs()
+    await run_join_job(job_id)
+
+def start_join_job(job_type, link, phones):
+    """입장/나가기 작업 생성 후 클라이언트 이벤트 루프에서 실행"""
+    link = link.strip()
+    if not link or not phones:
+        return None
+    loop = next(iter(client_loops.values()), None)
+    if not loop:
+        print("연결된 계정이 없어 작업을 시작할 수 없습니다.")
+        return None
+    job_id = uuid.uuid4().hex[:8]
+    job = {
+        "type": job_type,
+        "link": link,
+        "phones": list(phones),
+        "status": {p: "pending" for p in phones},
+        "state": "running",
+        "created": time.time(),
+    }
+    print(f"[{job_type} 작업 {job_id}] 시작: 계정 {len(phones)}개")
+    asyncio.run_coroutine_threadsafe(add_join_job(job_id, job), loop)
+    return job_id
+
+def resume_join_jobs():
+    """재시작 전에 끝나지 않은 입장/나가기 작업 이어서 진행"""
+    join_jobs.update(load_join_jobs())
+    loop = next(iter(client_loops.values()), None)
+    for job_id, job in join_jobs.items():
+        if job.get("state") != "running" or not loop:
+            continue
+        print(f"[{job['type']} 작업 {job_id}] 이어서 진행")
+        asyncio.run_coroutine_threadsafe(run_join_job(job_id), loop)
 
 # --------------------- 계정 작업 ---------------------
 async def account_task(account, idx=0):
     phone = account["phone"]
-    session_name = account.get("session_name", f"session_{phone}")
-    client = TelegramClient(session_name, account["api_id"], account["api_hash"])
+    client = startup_clients.pop(phone, None)
+    if client is None:
+        client = make_client(account)
+    profile = account_profiles.get(phone)
+    if profile and not profile["needs_updates"]:
+        await lazy_account_task(account, client)
+        return
+    handlers_registered = False
+    first_start = True
     while True:
         try:
-            await client.connect()
+            started = time.perf_counter()
+            if not client.is_connected():
+                await client.connect()
             if not await client.is_user_authorized():
                 print(f"{phone} 로그인 안됨 → 메시지감지X")
+                mark_account_ready(phone)
                 return
             me = await client.get_me()
+            if first_start:
+                record_startup_phase(phone, "get_me", started)
             bot_account_ids.add(me.id)
-            if "main_chat_id" in account:
+            if "main_chat_id" in account and not handlers_registered:
                 @client.on(events.NewMessage(chats=[account["main_chat_id"]]))
                 async def new_msg_handler(ev):
-                    await handle_new_message(ev, client, account.get("subroom_ids", []), account)
+                    acc = get_account_by_phone(phone) or account
+                    await handle_new_message(ev, client, acc.get("subroom_ids", []), acc)
                 @client.on(events.MessageEdited(chats=[account["main_chat_id"]]))
                 async def edit_msg_handler(ev):
-                    await handle_message_edit(ev, client, account.get("subroom_ids", []), account)
+                    acc = get_account_by_phone(phone) or account
+                    await handle_message_edit(ev, client, acc.get("subroom_ids", []), acc)
                 @client.on(events.MessageDeleted(chats=[account["main_chat_id"]]))
                 async def delete_msg_handler(ev):
                     await handle_deleted_event(ev, phone)
-            clients[phone] = client
-            client_loops[phone] = asyncio.get_running_loop()
-            command_queues[phone] = asyncio.Queue()
-            await asyncio.gather(
-                handle_commands(phone, client),
-                client.run_until_disconnected()
-            )
+                handlers_registered = True
+            register_account_runtime(phone, client, first_start)
+            first_start = False
+            await client.run_until_disconnected()
         except Exception as e:
             print(f"[{phone}] 연결 오류: {e}. 재연결 시도 중...")
+            mark_account_ready(phone)
             await asyncio.sleep(5)
         finally:
             try:
@@ -552,67 +3042,754 @@ async def account_task(account, idx=0):
             except:
                 pass
 
-def start_account_task(acc, idx):
-    asyncio.run(account_task(acc, idx))
+def register_account_runtime(phone, client, first_start=True):
+    replaced = clients.get(phone) not in (None, client)
+    clients[phone] = client
+    client_loops[phone] = asyncio.get_running_loop()
+    client_last_used[phone] = time.monotonic()
+    if first_start or replaced:
+        # 기록 핸들러는 클라이언트마다 붙으므로 교체된 클라이언트에도 다시
+        attach_update_recorder(client, phone)
+    if first_start:
+        asyncio.get_running_loop().create_task(resume_outbox(phone, client))
+        # ready 는 시작 시점부터 이 계정이 준비될 때까지의 경과 시간
+        startup_timings.setdefault(phone, {})["ready"] = time.perf_counter() - startup_started_at
+    if replaced:
+        # promote_lazy_account 로 클라이언트가 바뀜 → 알림/전문가 핸들러를 새 클라이언트에 다시 등록
+        alert_handlers.pop(phone, None)
+        expert_handler_registered.discard(phone)
+        expert_event_handlers.pop(phone, None)
+        update_alert_handlers()
+        update_expert_handlers()
+    mark_account_ready(phone)
+
+async def lazy_account_task(account, client):
+    """
+    업데이트가 필요 없는 계정(역할 없음/관리자 전용): 업데이트 수신 없이 연결.
+    역할이 없으면 입장 작업·GUI 요청 등이 있을 때만 연결하고 유휴 시 해제 (acquire_client / idle_disconnect_loop).
+    """
+    phone = account["phone"]
+    while True:
+        try:
+            if not client.is_connected():
+                await client.connect()
+            if not await client.is_user_authorized():
+                print(f"{phone} 로그인 안됨 → 요청 처리X")
+                mark_account_ready(phone)
+                await client.disconnect()
+                return
+            me = await client.get_me()
+            bot_account_ids.add(me.id)
+            break
+        except Exception as e:
+            print(f"[{phone}] 지연 연결 계정 초기화 오류: {e}. 재연결 시도 중...")
+            mark_account_ready(phone)
+            await asyncio.sleep(5)
+    lazy_tasks[phone] = asyncio.current_task()
+    register_account_runtime(phone, client)
+    if is_lazy_account(phone):
+        print(f"[{phone}] 지연 연결 모드 (유휴 {idle_disconnect_timeout}초 후 연결 해제)")
+    await idle_disconnect_loop(phone, client)
+
+# ------------------ 알림 봇(멀티 계정) 핸들러 관리 ---------------------
+def update_alert_handlers():
+    global alert_handlers
+    current_acc_list = accounts_snapshot()
+    for phone in list(alert_handlers.keys()):
+        acc = next((a for a in current_acc_list if a["phone"] == phone), None)
+        if not acc or not acc.get("alert_monitor", False) or phone not in clients:
+            remove_alert_handler_multi(phone)
+            alert_handlers.pop(phone, None)
+    for acc in current_acc_list:
+        phone = acc["phone"]
+        if acc.get("alert_monitor", False) and phone in clients and phone not in alert_handlers:
+            if phone in promoting_accounts:
+                print(f"[알림 봇] {phone} 지연 연결 계정 → 다시 연결한 뒤 핸들러 등록")
+                continue
+            h = make_alert_handler(phone)
+            clients[phone].add_event_handler(h, events.NewMessage)
+            alert_handlers[phone] = h
+            print(f"[알림 봇] {phone} 이벤트 핸들러 등록 완료")
+
+def remove_alert_handler_multi(phone):
+    if phone in alert_handlers:
+        client = clients.get(phone)
+        if client:
+            client.remove_event_handler(alert_handlers[phone], events.NewMessage)
+        print(f"[알림 봇] {phone} 계정 이벤트 핸들러 제거")
+
+alert_room_names = StateMap("alert_room_names")   # (phone, chat_id) → 방 이름
+
+async def alert_room_name(client, phone, chat_id):
+    """방 이름: 메모리 → 저장된 대화방 목록 → get_entity 순서로 찾음 (매번 대화방 전체 조회하지 않음)"""
+    key = (phone, chat_id)
+    name = alert_room_names.get(key)
+    count_cache("alert_room_name", name is not None)
+    if name is not None:
+        return name
+    table = load_dialog_table(phone)
+    row = next((r for r in table or [] if r["id"] == chat_id), None)
+    name = row["name"] if row else await fetch_chat_name(client, chat_id)
+    if name:
+        alert_room_names[key] = name
+    return name
+
+def make_alert_handler(phone):
+    async def handler(event):
+        try:
+            acc = get_account_by_phone(phone)
+            if not acc:
+                return
+            if not acc.get("alert_monitor", False):
+                return
+            rooms = acc.get("alert_rooms", [])
+            if rooms and event.chat_id not in rooms:
+                return
+            client = clients.get(phone)
+            if not client:
+                return
+            if event.sender_id in bot_account_ids:
+                return
+            me = await client.get_me()
+            if event.sender_id == me.id:
+                return
+            trace = SendTrace("alert", phone, event.message)
+            room_name = await alert_room_name(client, phone, event.chat_id) or "Unknown"
+            sender = await event.get_sender()
+            sender_name = ((sender.first_name or "") + " " + (sender.last_name or "")).strip() or sender.username or "Unknown"
+            print(f"{room_name} : 설정 완료")
+            if alert_notify_chat and room_sendable(phone, alert_notify_chat):
+                try:
+                    await wait_room_turn(phone, alert_notify_chat)
+                    await client.send_message(alert_notify_chat, 
+                        f"방이름: {room_name} / 방아이디: {event.chat_id} / 보낸이: {sender_name} / 내용: {event.raw_text}")
+                    trace.sent(alert_notify_chat)
+                except Exception as e:
+                    trace.failed(alert_notify_chat, e)
+                    raise
+                trace.done()
+        except Exception as e:
+            print(f"[ERROR] make_alert_handler 예외 발생: {e}")
+    return handler
+
+# --------------------- 관리자 권한 일괄 적용 ---------------------
+admin_rollout_concurrency = 5   # 계정별 동시에 권한을 적용할 방 수
+admin_rollout_retries = 3       # FloodWait 시 방별 재시도 횟수
+admin_read_chunk = 100          # 현재 권한 조회 시 한 번에 묻는 방 수
+admin_flood_until = {}          # phone → FloodWait 으로 권한 적용이 멈춰 있는 종료 시각 (time.monotonic)
+admin_rollout_report_cb = None  # 적용 결과를 받을 GUI 콜백 (Tk 스레드에서 호출)
+
+# ChatBannedRights 필드 → 관리자 기능 설정 키
+ADMIN_RIGHTS_FIELDS = {
+    "send_plain":       "send_message",               # 텍스트 메시지
+    "send_photos":      "send_media_photo",           # 사진
+    "send_videos":      "send_media_video_file",      # 영상 파일
+    "send_roundvideos": "send_media_video_message",   # 영상 메시지(비디오 노트)
+    "send_audios":      "send_media_music",           # 음악 파일
+    "send_voices":      "send_media_voice",           # 음성 메시지
+    "send_docs":        "send_media_file",            # 일반 파일
+    "send_gifs":        "send_media_sticker_gif",     # 스티커/GIF
+    "embed_links":      "send_media_link",            # 링크
+    "send_polls":       "send_media_poll",            # 설문
+    "invite_users":     "add_participant",            # 참가자 추가
+    "pin_messages":     "pin_message",                # 메시지 고정
+    "change_info":      "change_group_info",          # 그룹 정보 변경
+}
+
+def build_default_banned_rights():
+    """관리자 기능 설정 → 방 기본 권한 (True = 금지)"""
+    return ChatBannedRights(until_date=None, **{
+        field: not admin_function_settings.get(key, True) for field, key in ADMIN_RIGHTS_FIELDS.items()
+    })
+
+def rights_match(current, target):
+    """현재 기본 권한이 설정과 같으면 True (권한 없음 = 모두 허용)"""
+    return all(bool(getattr(current, f, False)) == bool(getattr(target, f)) for f in ADMIN_RIGHTS_FIELDS)
+
+def can_edit_rights(chat):
+    if getattr(chat, "left", False) or getattr(chat, "deactivated", False):
+        return False
+    if getattr(chat, "creator", False):
+        return True
+    rights = getattr(chat, "admin_rights", None)
+    return bool(rights and rights.ban_users)
+
+async def read_room_rights(client, room_ids, denied=None):
+    """
+    방들의 현재 상태를 묶어서 조회 → {room_id: Chat/Channel}.
+    슈퍼그룹은 GetChannelsRequest, 일반그룹은 GetChatsRequest 로 admin_read_chunk 개씩.
+    세션에 peer 가 없는 방(이 계정이 모르는 방)은 결과에서 빠짐.
+    denied 에 set 을 주면 ChannelPrivate (추방/비공개) 로 거절된 방 id 를 넣음.
+    """
+    channels, chats = [], []
+    rid_of = {}
+    for rid in room_ids:
+        try:
+            peer = await client.get_input_entity(rid)
+        except Exception:
+            continue
+        if isinstance(peer, InputPeerChannel):
+            channels.append(InputChannel(peer.channel_id, peer.access_hash))
+            rid_of[("channel", peer.channel_id)] = rid
+        elif isinstance(peer, InputPeerChat):
+            chats.append(peer.chat_id)
+            rid_of[("chat", peer.chat_id)] = rid
+    found = {}
+    async def read(make, ids):
+        try:
+            result = await client(make(ids))
+        except (ChannelPrivateError, ChannelInvalidError, ChatIdInvalidError, PeerIdInvalidError) as e:
+            # 묶음 안에 못 읽는 방이 하나라도 있으면 전체가 실패 → 하나씩 다시 (못 읽는 방은 결과에서 빠짐)
+            if len(ids) == 1:
+                if denied is not None and isinstance(e, ChannelPrivateError):
+                    one = ids[0]
+                    key = ("channel", one.channel_id) if isinstance(one, InputChannel) else ("chat", one)
+                    denied.add(rid_of[key])
+                return
+            for one in ids:
+                await read(make, [one])
+            return
+        for chat in result.chats:
+            found[get_peer_id(chat)] = chat
+    for i in range(0, len(channels), admin_read_chunk):
+        await read(GetChannelsRequest, channels[i:i + admin_read_chunk])
+    for i in range(0, len(chats), admin_read_chunk):
+        await read(GetChatsRequest, chats[i:i + admin_read_chunk])
+    return found
+
+async def apply_rights_to_room(client, phone, rid, rights, sem):
+    async with sem:
+        started = time.perf_counter()
+        entry = {"room": rid, "phone": phone, "status": "failed", "detail": ""}
+        for attempt in range(admin_rollout_retries):
+            wait = admin_flood_until.get(phone, 0) - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                peer = await client.get_input_entity(rid)
+                # 기본 권한은 일반그룹(InputPeerChat)/슈퍼그룹(InputPeerChannel) 모두 이 요청 하나로 변경
+                await batched_call(client, EditChatDefaultBannedRightsRequest(peer=peer, banned_rights=rights))
+                entry.update(status="ok", detail="")
+                break
+            except ChatNotModifiedError:
+                entry.update(status="unchanged", detail="")
+                break
+            except FloodWaitError as e:
+                admin_flood_until[phone] = max(admin_flood_until.get(phone, 0), time.monotonic() + e.seconds + 1)
+                metrics.inc("floodwait_total", path="admin", phone=phone)
+                metrics.inc("floodwait_seconds_total", e.seconds, phone=phone)
+                entry["detail"] = f"FloodWait {e.seconds}초"
+                print(f"[{phone}] {rid} → FloodWait {e.seconds}초, 이 계정 권한 적용 일시정지")
+            except Exception as e:
+                entry["detail"] = str(e)
+                break
+        entry["seconds"] = round(time.perf_counter() - started, 2)
+        metrics.inc("admin_rights_total", phone=phone, status=entry["status"])
+        metrics.observe("admin_rights_seconds", entry["seconds"], phone=phone)
+        return entry
+
+def plan_admin_rollout(phones, room_ids, views, rights):
+    """
+    views: phone → read_room_rights 결과.
+    이미 설정과 같은 방은 바로 '변경없음', 나머지는 권한 있는 계정 중 배정이 가장 적은 계정에 배정.
+    반환: (계정별 방 목록, 미리 확정된 결과 {room_id: entry})
+    """
+    assigned = {p: [] for p in phones}
+    settled = {}
+    for rid in room_ids:
+        able = [p for p in phones if rid in views.get(p, {}) and can_edit_rights(views[p][rid])]
+        if not able:
+            seen = any(rid in views.get(p, {}) for p in phones)
+            settled[rid] = {"room": rid, "phone": None, "status": "failed", "seconds": 0,
+                            "detail": "관리 권한 있는 관리자 계정 없음" if seen else "관리자 계정이 방을 찾지 못함"}
+            continue
+        if rights_match(views[able[0]][rid].default_banned_rights, rights):
+            settled[rid] = {"room": rid, "phone": able[0], "status": "unchanged", "detail": "", "seconds": 0}
+            continue
+        assigned[min(able, key=lambda p: len(assigned[p]))].append(rid)
+    return assigned, settled
+
+async def rollout_admin_rights(phones, room_ids, rights):
+    """
+    연결된 관리자 계정 전체에 방을 나눠 권한 적용.
+    현재 권한을 먼저 묶어서 읽고 다른 방에만 쓰기 요청. 방 순서대로 결과 목록 반환.
+    """
+    async with AsyncExitStack() as stack:
+        held = {}
+        for phone in phones:
+            client = await stack.enter_async_context(using_client(phone))
+            if client is not None:
+                held[phone] = client
+        phones = list(held)
+
+        async def read_view(phone):
+            try:
+                return await read_room_rights(held[phone], room_ids)
+            except Exception as e:
+                print(f"[{phone}] 방 권한 조회 오류: {e}")
+                return {}
+        views = dict(zip(phones, await asyncio.gather(*(read_view(p) for p in phones))))
+
+        assigned, settled = plan_admin_rollout(phones, room_ids, views, rights)
+        for phone, rooms in assigned.items():
+            if rooms:
+                print(f"[{phone}] 권한 적용 대상 {len(rooms)}개 방")
+        jobs = []
+        for phone, rooms in assigned.items():
+            sem = asyncio.Semaphore(admin_rollout_concurrency)
+            jobs += [apply_rights_to_room(held[phone], phone, rid, rights, sem) for rid in rooms]
+        for entry in await asyncio.gather(*jobs):
+            settled[entry["room"]] = entry
+    return [settled[rid] for rid in room_ids]
+
+def print_admin_rollout_report(report):
+    counts = defaultdict(int)
+    for entry in report:
+        counts[entry["status"]] += 1
+    print(f"[관리자 기능] 적용 완료: 성공 {counts['ok']} / 변경없음 {counts['unchanged']} / 실패 {counts['failed']}")
+    for entry in report:
+        if entry["status"] == "failed":
+            print(f"  {entry['room']} ({entry['phone'] or '-'}) → 실패: {entry['detail']}")
+
+# --------------------- 목적지 방 상태 감시 ---------------------
+ROOM_WRITABLE, ROOM_SLOW, ROOM_READ_ONLY, ROOM_GONE = "writable", "slow_mode", "read_only", "gone"
+ROOM_STATE_LABELS = {ROOM_WRITABLE: "정상", ROOM_SLOW: "슬로우모드", ROOM_READ_ONLY: "쓰기 불가", ROOM_GONE: "없음/차단"}
+room_check_interval = 900   # 방 상태 점검 주기(초), 빠진 방도 이때 다시 확인 (alert_settings.json 의 room_check_interval)
+room_check_delay = 60       # 시작 후 첫 점검까지 대기(초)
+room_health = {}            # (phone, chat_id) → {"state", "slow", "detail", "checked", "next_send", "source"}
+room_health_task = None
+
+# 전송 오류 → 방 상태 (계정 전체 스팸 제한인 UserBannedInChannel 등은 방 문제가 아니므로 제외)
+ROOM_ERROR_STATES = (
+    ((ChannelPrivateError, ChannelInvalidError), ROOM_GONE),
+    ((ChatWriteForbiddenError, ChatRestrictedError, ChatGuestSendForbiddenError, ChatAdminRequiredError), ROOM_READ_ONLY),
+)
+# 세션에 peer 가 없거나 access_hash 가 틀린 경우에도 나는 오류라 방이 없어졌다는 근거가 아님 → 상태는 그대로, 설명만 남김
+# (여기서 GONE 으로 바꾸면 probe_rooms 도 못 찾은 방은 이전 상태를 유지하므로 다시 돌아오지 못함)
+ROOM_TRANSIENT_ERRORS = (ChatIdInvalidError, PeerIdInvalidError)
+
+def set_room_state(phone, chat_id, state, detail="", slow=None, source="probe"):
+    key = (phone, chat_id)
+    entry = room_health.get(key)
+    if entry is None:
+        entry = room_health[key] = {"state": None, "slow": 0, "next_send": 0}
+    if entry["state"] != state:
+        if entry["state"] is not None or state != ROOM_WRITABLE:
+            print(f"[{phone}] 방 {chat_id} 상태: {ROOM_STATE_LABELS.get(entry['state'], '-')} → {ROOM_STATE_LABELS[state]}"
+                  + (f" ({detail})" if detail else ""))
+        metrics.inc("room_state_changes_total", state=state)
+    entry.update(state=state, detail=detail, checked=time.time(), source=source)
+    if slow is not None:
+        entry["slow"] = slow
+    return entry
+
+def room_sendable(phone, chat_id):
+    """fan-out 에 넣을 방인지: 쓰기 불가/없는 방만 False (슬로우모드 방은 wait_room_turn 으로 미뤄서 보냄)"""
+    entry = room_health.get((phone, chat_id))
+    return entry is None or entry["state"] in (ROOM_WRITABLE, ROOM_SLOW)
+
+def room_send_wait(phone, chat_id):
+    """슬로우모드 방의 다음 전송 가능 시각까지 남은 초 (바로 보낼 수 있으면 0)"""
+    entry = room_health.get((phone, chat_id))
+    if entry is None or entry["state"] != ROOM_SLOW:
+        return 0
+    return max(0.0, entry["next_send"] - time.monotonic())
+
+def sendable_rooms(phone, rooms):
+    """보낼 방 목록, 아직 기다려야 하는 슬로우모드 방은 다른 방을 막지 않도록 뒤로 (기다릴 시간 순)"""
+    ready, deferred = [], []
+    for r in rooms:
+        if not room_sendable(phone, r):
+            metrics.inc("room_skipped_total", state=room_health[(phone, r)]["state"])
+        elif room_send_wait(phone, r):
+            deferred.append(r)
+        else:
+            ready.append(r)
+    if deferred:
+        metrics.inc("room_deferred_total", value=len(deferred))
+    return ready + sorted(deferred, key=lambda r: room_send_wait(phone, r))
+
+async def wait_room_turn(phone, chat_id):
+    """슬로우모드 방이면 다음 전송 가능 시각까지 기다린 뒤 그 자리를 예약 (같은 방을 기다리던 다른 전송은 그다음 차례로)"""
+    delay = room_send_wait(phone, chat_id)
+    while delay > 0:
+        await asyncio.sleep(delay)
+        delay = room_send_wait(phone, chat_id)
+    entry = room_health.get((phone, chat_id))
+    if entry is not None and entry["state"] == ROOM_SLOW and entry["slow"]:
+        entry["next_send"] = time.monotonic() + entry["slow"]
+
+def note_room_sent(phone, chat_id):
+    entry = room_health.get((phone, chat_id))
+    if entry is None:
+        return
+    if entry["state"] in (ROOM_READ_ONLY, ROOM_GONE):
+        set_room_state(phone, chat_id, ROOM_WRITABLE, source="send")
+    elif entry["state"] == ROOM_SLOW and entry["slow"]:
+        entry["next_send"] = time.monotonic() + entry["slow"]
+
+def note_room_error(phone, chat_id, error):
+    if isinstance(error, SlowModeWaitError):
+        entry = set_room_state(phone, chat_id, ROOM_SLOW, f"{error.seconds}초 대기", source="send")
+        entry["slow"] = max(entry["slow"], error.seconds)
+        entry["next_send"] = time.monotonic() + error.seconds
+        return
+    if isinstance(error, ROOM_TRANSIENT_ERRORS):
+        entry = room_health.get((phone, chat_id))
+        if entry is not None:
+            entry["detail"] = type(error).__name__
+        return
+    for errors, state in ROOM_ERROR_STATES:
+        if isinstance(error, errors):
+            set_room_state(phone, chat_id, state, type(error).__name__, source="send")
+            return
+
+def classify_room(chat):
+    """read_room_rights 결과 한 방 → (상태, 설명)"""
+    if isinstance(chat, (ChannelForbidden, ChatForbidden)):
+        return ROOM_GONE, "차단됨/비공개"
+    if getattr(chat, "left", False) or getattr(chat, "deactivated", False) or getattr(chat, "migrated_to", None):
+        return ROOM_GONE, "나간 방/비활성 방"
+    if isinstance(chat, Channel) and chat.broadcast:
+        if chat.creator or (chat.admin_rights and chat.admin_rights.post_messages):
+            return ROOM_WRITABLE, ""
+        return ROOM_READ_ONLY, "채널 게시 권한 없음"
+    if getattr(chat, "creator", False) or getattr(chat, "admin_rights", None):
+        return ROOM_WRITABLE, ""
+    for rights in (getattr(chat, "banned_rights", None), getattr(chat, "default_banned_rights", None)):
+        if rights and (rights.view_messages or rights.send_messages):
+            return ROOM_READ_ONLY, "메시지 보내기 금지"
+    if getattr(chat, "slowmode_enabled", False):
+        return ROOM_SLOW, ""
+    return ROOM_WRITABLE, ""
+
+async def probe_rooms(phone, client, room_ids):
+    """방 상태를 묶어서 조회 (GetChannels/GetChats), 슬로우모드 간격을 모르는 방만 GetFullChannel"""
+    denied = set()
+    views = await read_room_rights(client, room_ids, denied)
+    for rid in room_ids:
+        chat = views.get(rid)
+        if chat is None:
+            # 세션에서 peer 를 못 찾았거나 일시 오류면 판단할 근거가 없으므로 이전 상태 유지
+            if rid in denied:
+                set_room_state(phone, rid, ROOM_GONE, "추방됨/비공개")
+            continue
+        state, detail = classify_room(chat)
+        entry = set_room_state(phone, rid, state, detail)
+        if state == ROOM_SLOW and not entry["slow"]:
+            try:
+                full = await client(GetFullChannelRequest(InputChannel(chat.id, chat.access_hash)))
+                entry["slow"] = full.full_chat.slowmode_seconds or 0
+            except Exception as e:
+                print(f"[{phone}] 방 {rid} 슬로우모드 조회 오류: {e}")
+        if entry["slow"]:
+            entry["detail"] = f"{entry['slow']}초 간격"
+
+def room_destinations():
+    """계정별 점검할 방 → {phone: {chat_id: 역할}}"""
+    targets = defaultdict(dict)
+    for acc in accounts_snapshot():
+        phone = acc["phone"]
+        for r in acc.get("subroom_ids", []):
+            targets[phone][r] = "서브방"
+        if acc.get("alert_monitor") and alert_notify_chat:
+            targets[phone].setdefault(alert_notify_chat, "알림방")
+    for phone in admin_accounts_list:
+        for r in admin_rooms_list:
+            try:
+                targets[phone].setdefault(int(r), "관리방")
+            except (TypeError, ValueError):
+                pass
+    return targets
+
+async def check_all_rooms():
+    """연결된 계정만 점검 (점검 때문에 지연 연결 계정을 깨우지 않음), 계정 사이 순차"""
+    checked = 0
+    for phone, rooms in room_destinations().items():
+        client = clients.get(phone)
+        if not client or not client.is_connected():
+            continue
+        try:
+            await probe_rooms(phone, client, list(rooms))
+            checked += len(rooms)
+        except Exception as e:
+            print(f"[{phone}] 방 상태 점검 오류: {e}")
+    metrics.inc("room_checks_total")
+    return checked
+
+async def room_health_loop():
+    await asyncio.sleep(room_check_delay)
+    while True:
+        await check_all_rooms()
+        await asyncio.sleep(load_alert_settings().get("room_check_interval", room_check_interval))
+
+def start_room_health():
+    """현재 이벤트 루프에서 방 상태 점검 시작 (한 번만)"""
+    global room_health_task
+    if room_health_task is None:
+        room_health_task = asyncio.get_running_loop().create_task(room_health_loop())
+
+# --------------------- 메인방 ↔ 서브방 동기화 점검 ---------------------
+reconcile_interval = 1800    # 점검 주기(초) (alert_settings.json 의 reconcile_interval, 0 이면 끔)
+reconcile_window = 50        # 메인방 최근 메시지 몇 개를 비교할지 (reconcile_window)
+reconcile_settle = 120       # 이보다 최근 메시지는 아직 전송 중일 수 있어 제외(초)
+reconcile_rpc_budget = 300   # 한 번 실행에서 쓸 RPC 수 (읽기 포함, reconcile_rpc_budget)
+reconcile_task = None
+reconcile_lock = None         # 주기 점검과 수동 버튼이 겹치면 같은 메시지를 두 번 보냄 (클라이언트 루프에서 생성)
+reconcile_rooms = StateMap("reconcile_rooms")   # "phone|방" → 마지막으로 맞춘 시각 (reconcile_state.json 의 rooms)
+
+def get_reconcile_lock():
+    global reconcile_lock
+    if reconcile_lock is None:
+        reconcile_lock = asyncio.Lock()
+    return reconcile_lock
 
-# ------------------ 알림 봇(멀티 계정) 핸들러 관리 ---------------------
-def update_alert_handlers():
-    global alert_handlers
-    current_acc_list = load_accounts()
-    for phone in list(alert_handlers.keys()):
-        acc = next((a for a in current_acc_list if a["phone"] == phone), None)
-        if not acc or not acc.get("alert_monitor", False) or phone not in clients:
-            remove_alert_handler_multi(phone)
-            alert_handlers.pop(phone, None)
-    for acc in current_acc_list:
-        phone = acc["phone"]
-        if acc.get("alert_monitor", False) and phone in clients and phone not in alert_handlers:
-            h = make_alert_handler(phone)
-            clients[phone].add_event_handler(h, events.NewMessage)
-            alert_handlers[phone] = h
-            print(f"[알림 봇] {phone} 이벤트 핸들러 등록 완료")
+class RpcBudget:
+    def __init__(self, limit):
+        self.left = limit
+        self.used = 0
 
-def remove_alert_handler_multi(phone):
-    if phone in alert_handlers:
-        client = clients.get(phone)
-        if client:
-            client.remove_event_handler(alert_handlers[phone], events.NewMessage)
-        print(f"[알림 봇] {phone} 계정 이벤트 핸들러 제거")
+    def take(self, n=1):
+        if self.left < n:
+            return False
+        self.left -= n
+        self.used += n
+        return True
 
-def make_alert_handler(phone):
-    async def handler(event):
+def content_hash(msg, caption=True):
+    """텍스트 + 서식 위치 + 사진/문서 id (서브방 사본도 같은 미디어 id 를 가짐)"""
+    key = media_key(msg.media)
+    text = (msg.raw_text or "") if caption else ""
+    ents = [(type(e).__name__, e.offset, e.length) for e in (msg.entities or [])] if text else []
+    return hashlib.sha1(json.dumps([text, ents, list(key) if key else None]).encode("utf-8")).hexdigest()
+
+def same_content(main, sub):
+    # 미디어는 바로 앞 텍스트와 캡션이 같으면 캡션 없이 보냄 (handle_new_message)
+    h = content_hash(sub)
+    return h == content_hash(main) or (main.media is not None and h == content_hash(main, caption=False))
+
+def outbox_kind(msg):
+    if isinstance(msg.media, (MessageMediaPhoto, MessageMediaDocument)):
+        return "media"
+    if msg.raw_text:
+        return "text"
+    return None
+
+def lineage_index(phone, main_ids):
+    """
+    delete_map 을 한 번 훑어 창 범위(가장 오래된~최신 메인 id) 안의 사본 → {메인 id: {방: [서브 id]}}.
+    delete_map 은 저장하지 않으므로 재시작 전에 보낸 메시지는 여기 없음 (plan_room_sync 가 다시 보내지 않음).
+    """
+    index = {}
+    if not main_ids:
+        return index
+    low, high = min(main_ids), max(main_ids)
+    for key, targets in list(OrderedDict.items(delete_map)):
+        if len(key) == 2 and key[0] == phone and low <= key[1] <= high:
+            rooms = index.setdefault(key[1], {})
+            for room, sid in targets:
+                rooms.setdefault(room, []).append(sid)
+    return index
+
+def room_lineage(index, room):
+    """lineage_index 결과에서 방 하나 → {메인 id: [서브 id]}"""
+    return {mid: rooms[room] for mid, rooms in index.items() if room in rooms}
+
+def plan_room_sync(main_msgs, main_ids, lineage, linked, history, known):
+    """
+    main_msgs: 맞출 메인방 메시지 (오래된 순), main_ids: 창 안의 메인방 메시지 id 전체,
+    lineage: 메인 id → 서브 id, linked: 서브 id → 서브 메시지 (삭제됐으면 None),
+    history: 서브방에서 이 계정이 보낸 최근 메시지 (연결이 없는 메시지를 내용으로 찾을 때만),
+    known: 어느 방에든 연결이 남아 있는 메인 id (이번 실행에서 fan-out 한 메시지).
+    연결이 하나도 없는 메시지는 재시작 전에 보냈을 수 있고, 수정됐거나 캡션을 뺀 사본은 내용으로 못 찾으므로 보내지 않음.
+    반환: (보낼 메인 메시지, [(서브 메시지, 메인 메시지)] 수정, [서브 id] 삭제, {메인 id: 서브 id} 새로 찾은 연결)
+    """
+    send, edit, delete, found = [], [], [], {}
+    claimed = {sid for sids in lineage.values() for sid in sids}
+    unlinked = [s for s in history if s.id not in claimed]
+    for m in main_msgs:
+        subs = [linked.get(sid) for sid in lineage.get(m.id, [])]
+        alive = [s for s in subs if s is not None]
+        if alive:
+            edit += [(s, m) for s in alive if not same_content(m, s)]
+            continue
+        match = next((s for s in unlinked if same_content(m, s)), None)
+        if match is not None and not subs:
+            unlinked.remove(match)
+            found[m.id] = match.id
+        elif m.id in known:
+            send.append(m)
+    for mid, sids in lineage.items():
+        if mid not in main_ids:   # 메인방에서 지워진 메시지
+            delete += [sid for sid in sids if linked.get(sid) is not None]
+    return send, edit, delete, found
+
+async def sync_room(client, phone, main_id, room, main_msgs, main_ids, lineage, known, budget, trace):
+    """방 하나를 맞춤 (lineage: 이 방의 {메인 id: [서브 id]}), 예산이 모자라면 False (다음 실행에서 이 방부터)"""
+    sids = [sid for ids in lineage.values() for sid in ids]
+    linked = {}
+    for i in range(0, len(sids), 100):
+        if not budget.take():
+            return False
+        chunk = sids[i:i + 100]
+        linked.update(zip(chunk, await client.get_messages(room, ids=chunk)))
+    history = []
+    if any(m.id not in lineage for m in main_msgs):
+        if not budget.take():
+            return False
+        history = [s async for s in client.iter_messages(room, from_user="me", limit=reconcile_window * 2)]
+    send, edit, delete, found = plan_room_sync(main_msgs, main_ids, lineage, linked, history, known)
+    for mid, sid in found.items():
+        delete_map.setdefault((phone, mid), []).append((room, sid))
+    # 앨범 전체가 빠졌으면 앨범으로, 일부만 빠졌으면 한 장씩
+    groups = OrderedDict()
+    for m in send:
+        groups.setdefault(m.grouped_id or ("single", m.id), []).append(m)
+    for gid, msgs in groups.items():
+        whole = not isinstance(gid, tuple) and len(msgs) == sum(1 for m in main_msgs if m.grouped_id == gid) > 1
+        batches = [(msgs, "album")] if whole else [([m], outbox_kind(m)) for m in msgs]
+        for batch, kind in batches:
+            if kind is None:
+                continue
+            if not budget.take():
+                return False
+            ops = await get_outbox().plan(phone, main_id, batch, kind, [room])
+            await run_outbox_ops(client, phone, ops, batch, trace)
+            metrics.inc("reconcile_actions_total", action="send")
+    for sub, m in edit:
+        if not budget.take():
+            return False
+        media_changed = media_key(m.media) and media_key(m.media) != media_key(sub.media)
         try:
-            acc = get_account_by_phone(phone)
-            if not acc:
-                return
-            if not acc.get("alert_monitor", False):
-                return
-            rooms = acc.get("alert_rooms", [])
-            if rooms and event.chat_id not in rooms:
-                return
-            client = clients.get(phone)
-            if not client:
-                return
-            if event.sender_id in bot_account_ids:
-                return
-            me = await client.get_me()
-            if event.sender_id == me.id:
-                return
-            async def find_room_name():
-                async for d in client.iter_dialogs():
-                    if d.id == event.chat_id:
-                        return d.name
-                return None
-            room_name = await find_room_name() or "Unknown"
-            sender = await event.get_sender()
-            sender_name = ((sender.first_name or "") + " " + (sender.last_name or "")).strip() or sender.username or "Unknown"
-            print(f"{room_name} : 설정 완료")
-            if alert_notify_chat:
-                await client.send_message(alert_notify_chat, 
-                    f"방이름: {room_name} / 방아이디: {event.chat_id} / 보낸이: {sender_name} / 내용: {event.raw_text}")
+            await client.edit_message(room, sub.id, m.raw_text, formatting_entities=m.entities,
+                                      file=m.media if media_changed else None)
+            trace.sent(room)
+        except MessageNotModifiedError:
+            pass
         except Exception as e:
-            print(f"[ERROR] make_alert_handler 예외 발생: {e}")
-    return handler
+            trace.failed(room, e)
+            print(f"[{phone}] 동기화 수정 오류 {room}/{sub.id}: {e}")
+        metrics.inc("reconcile_actions_total", action="edit")
+    if delete:
+        if not budget.take():
+            return False
+        try:
+            await delete_messages_batched(client, room, delete)
+            trace.sent(room)
+        except Exception as e:
+            trace.failed(room, e)
+            print(f"[{phone}] 동기화 삭제 오류 {room}: {e}")
+        metrics.inc("reconcile_actions_total", len(delete), action="delete")
+    if send or edit or delete:
+        print(f"[{phone}] 서브방 {room} 동기화: 전송 {len(send)} / 수정 {len(edit)} / 삭제 {len(delete)}")
+    return True
+
+def reconcile_main_messages(window, me_id):
+    """handle_new_message 가 서브방으로 보내는 메시지만 (내가 보냈거나 링크 포함, 최근 것 제외)"""
+    cutoff = time.time() - reconcile_settle
+    picked = []
+    for m in reversed(window):
+        if getattr(m, "action", None) or m.date is None or m.date.timestamp() > cutoff:
+            continue
+        text = m.raw_text or ""
+        if m.sender_id == me_id or "http://" in text or "https://" in text:
+            picked.append(m)
+    return picked
+
+async def reconcile_account(acc, budget, state):
+    """계정 하나의 서브방을 저장된 커서부터 차례로, 예산이 떨어지면 False"""
+    phone = acc["phone"]
+    client = clients.get(phone)
+    main_id = acc.get("main_chat_id")
+    rooms = acc.get("subroom_ids", [])
+    if not client or not client.is_connected() or not main_id or not rooms or not is_account_active(phone):
+        return True
+    if get_outbox().pending_for(phone):
+        return True   # 전송 중인 fan-out 이 끝난 뒤에
+    if not budget.take(2):
+        return False
+    me = await client.get_me()
+    window = [m async for m in client.iter_messages(main_id, limit=reconcile_window)]
+    main_ids = {m.id for m in window}
+    main_msgs = reconcile_main_messages(window, me.id)
+    index = lineage_index(phone, main_ids)
+    cursor = state["cursor"].get(phone, 0) % len(rooms)
+    trace = SendTrace("reconcile", phone)
+    try:
+        for i in range(cursor, len(rooms)):
+            room = rooms[i]
+            if not room_sendable(phone, room) or room_send_wait(phone, room):
+                continue   # 슬로우모드 대기 중인 방은 다음 점검에서
+            try:
+                finished = await sync_room(client, phone, main_id, room, main_msgs, main_ids,
+                                           room_lineage(index, room), index.keys(), budget, trace)
+            except Exception as e:
+                print(f"[{phone}] 서브방 {room} 동기화 오류: {e}")
+                finished = True
+            if not finished:
+                state["cursor"][phone] = i
+                return False
+            reconcile_rooms[f"{phone}|{room}"] = time.time()
+        state["cursor"][phone] = 0
+        return True
+    finally:
+        trace.done()
+
+async def reconcile_once(limit=None):
+    """
+    예산 안에서 계정/방 커서부터 이어서 점검, 커서는 reconcile_state.json 에 저장.
+    이미 다른 점검이 돌고 있으면 기다리지 않고 {"busy": True} 반환.
+    """
+    lock = get_reconcile_lock()
+    if lock.locked():
+        return {"completed": False, "rpc": 0, "busy": True}
+    async with lock:
+        return await reconcile_locked(limit)
+
+async def reconcile_locked(limit):
+    settings = load_alert_settings()
+    budget = RpcBudget(limit or settings.get("reconcile_rpc_budget", reconcile_rpc_budget))
+    state = config_store.get("reconcile_state.json", {}) or {}
+    state.setdefault("cursor", {})
+    if not reconcile_rooms:
+        for key, checked in sorted(state.get("rooms", {}).items(), key=lambda kv: kv[1]):
+            reconcile_rooms[key] = checked
+    accounts = sorted(accounts_snapshot(), key=lambda a: a["phone"])
+    start = next((i for i, a in enumerate(accounts) if a["phone"] == state.get("account")), 0)
+    completed = True
+    for acc in accounts[start:] + accounts[:start]:
+        if not await reconcile_account(acc, budget, state):
+            state["account"] = acc["phone"]
+            completed = False
+            break
+    else:
+        state.pop("account", None)
+    state["rooms"] = dict(OrderedDict.items(reconcile_rooms))
+    config_store.set("reconcile_state.json", state)
+    metrics.inc("reconcile_runs_total", completed=str(completed).lower())
+    metrics.inc("reconcile_rpc_total", budget.used)
+    return {"completed": completed, "rpc": budget.used, "busy": False}
+
+async def reconcile_loop():
+    await asyncio.sleep(room_check_delay * 2)
+    while True:
+        interval = load_alert_settings().get("reconcile_interval", reconcile_interval)
+        if interval and is_forwarding_enabled:
+            try:
+                result = await reconcile_once()
+                if result["busy"]:
+                    print("[동기화] 수동 동기화가 진행 중이라 이번 주기는 건너뜀")
+                elif not result["completed"]:
+                    print(f"[동기화] RPC 예산 {result['rpc']}회 소진 → 다음 실행에서 이어서")
+            except Exception as e:
+                print(f"[동기화] 오류: {e}")
+        await asyncio.sleep(interval or reconcile_interval)
+
+def start_reconciler():
+    global reconcile_task
+    get_reconcile_lock()
+    if reconcile_task is None:
+        reconcile_task = asyncio.get_running_loop().create_task(reconcile_loop())
 
 # --------------------- 관리자 기능 적용 (관리자 관리 탭 '적용' 버튼) ---------------------
 def apply_admin_functions():
@@ -633,102 +3810,28 @@ def apply_admin_functions():
         return
 
     # 3) 권한 객체 준비
-    def is_banned(f):
-        return not admin_function_settings.get(f, True)
-
-    # ChatBannedRights 의 세부 플래그들 (send_* = 금지하려면 True)
-    new_rights_chat = ChatBannedRights(
-        until_date=None,
-        send_plain       = is_banned("send_message"),               # 텍스트 메시지
-        send_photos      = is_banned("send_media_photo"),           # 사진
-        send_videos      = is_banned("send_media_video_file"),      # 영상 파일
-        send_roundvideos = is_banned("send_media_video_message"),   # 영상 메시지(비디오 노트)
-        send_audios      = is_banned("send_media_music"),           # 음악 파일
-        send_voices      = is_banned("send_media_voice"),           # 음성 메시지
-        send_docs        = is_banned("send_media_file"),            # 일반 파일
-        send_gifs        = is_banned("send_media_sticker_gif"),     # 스티커/GIF
-        embed_links      = is_banned("send_media_link"),            # 링크
-        send_polls       = is_banned("send_media_poll"),            # 설문
-        invite_users     = is_banned("add_participant"),            # 참가자 추가
-        pin_messages     = is_banned("pin_message"),                # 메시지 고정
-        change_info      = is_banned("change_group_info")           # 그룹 정보 변경
-    )
-
-    # ChannelBannedRights 에도 동일하게 맵핑 (슈퍼그룹/채널용)
-    new_rights_channel = ChannelBannedRights(
-        until_date=None,
-        send_messages    = is_banned("send_message"),
-        send_photos      = is_banned("send_media_photo"),
-        send_videos      = is_banned("send_media_video_file"),
-        send_roundvideos = is_banned("send_media_video_message"),
-        send_audios      = is_banned("send_media_music"),
-        send_voices      = is_banned("send_media_voice"),
-        send_docs        = is_banned("send_media_file"),
-        send_gifs        = is_banned("send_media_sticker_gif"),
-        embed_links      = is_banned("send_media_link"),
-        send_polls       = is_banned("send_media_poll"),
-        invite_users     = is_banned("add_participant"),
-        pin_messages     = is_banned("pin_message"),
-        change_info      = is_banned("change_group_info")
-    )
+    rights = build_default_banned_rights()
 
     # 4) 사용할 관리자 계정 선택
     if not admin_accounts_list:
         print("관리자 계정이 없습니다. 권한 적용 불가")
         return
 
-    chosen = next((p for p in admin_accounts_list if p in clients), None)
-    if not chosen:
+    phones = [p for p in admin_accounts_list if p in clients]
+    if not phones:
         print("연결된 관리자 계정이 없어 권한 적용 불가")
         return
 
-    client = clients[chosen]
-    loop   = client_loops.get(chosen)
-    if not loop:
+    # 5) 클라이언트 루프에서 적용하고 결과는 GUI 로 전달 (Tk 스레드는 기다리지 않음)
+    def on_report(report):
+        print_admin_rollout_report(report)
+        if admin_rollout_report_cb:
+            admin_rollout_report_cb(report)
+    def on_error(e):
+        print(f"[관리자 기능] 권한 적용 오류: {e}")
+    if not submit_client_job(phones[0], lambda c: rollout_admin_rights(phones, room_ids, rights),
+                             on_result=on_report, on_error=on_error):
         print("이 관리자 계정에 대한 event loop가 없습니다.")
-        return
-
-    # 5) 캐시에 있는 peer 엔티티들 미리 불러오기
-    peer_map = {}
-    async def cache_peers():
-        async for d in client.iter_dialogs():
-            if d.id in room_ids:
-                peer_map[d.id] = d.entity
-
-    # 블로킹 없이 동기적으로 대기
-    asyncio.run_coroutine_threadsafe(cache_peers(), loop).result(timeout=10)
-
-    # 6) 실제 권한 적용
-    async def apply_room(rid):
-        peer = peer_map.get(rid)
-        if not peer:
-            print(f"{rid} 엔티티가 캐시에 없습니다. 스킵합니다.")
-            return
-
-        # 일반그룹 권한
-        try:
-            await client(EditChatDefaultBannedRightsRequest(
-                peer=peer,
-                banned_rights=new_rights_chat
-            ))
-            print(f"{rid} → 일반그룹 권한 적용 완료")
-        except Exception:
-            pass
-
-        # 슈퍼그룹/채널 권한
-        try:
-            await client(EditBannedRequest(
-                channel=peer,
-                participant="me",
-                banned_rights=new_rights_channel
-            ))
-            print(f"{rid} → 채널 권한 적용 완료")
-        except Exception as e:
-            print(f"{rid} → 채널 권한 적용 실패: {e}")
-
-    # 7) 각 방에 코루틴 스케줄
-    for rid in room_ids:
-        asyncio.run_coroutine_threadsafe(apply_room(rid), loop)
 
 # --------------------- 관리자 관리 탭 ---------------------
 def build_admin_tab(tab):
@@ -761,7 +3864,7 @@ def build_admin_tab(tab):
     def refresh_all_accounts_admin_list():
         all_accounts_lb.delete(0, tk.END)
         search_term = account_search_var_admin.get().strip()
-        for acc in load_accounts():
+        for acc in accounts_snapshot():
             phone = acc["phone"]
             if search_term in phone:
                 all_accounts_lb.insert(tk.END, phone)
@@ -797,113 +3900,53 @@ def build_admin_tab(tab):
     frame_admin_chats = ttk.Frame(container)
     frame_admin_chats.pack(fill="both", expand=True, pady=5)
     ttk.Label(frame_admin_chats, text="관리자 계정의 대화방 목록").pack(anchor="w")
-    admin_chats_lb = tk.Listbox(frame_admin_chats, height=6)
-    admin_chats_lb.pack(fill="both", expand=True)
-    def refresh_admin_chats():
-        admin_chats_lb.delete(0, tk.END)
+    chat_browser = DialogBrowser(frame_admin_chats, height=6)
+    def on_admin_account_select(event):
         try:
-            idx = admin_accounts_lb.curselection()[0]
-            selected_phone = admin_accounts_lb.get(idx)
+            selected_phone = admin_accounts_lb.get(admin_accounts_lb.curselection()[0])
         except:
-            admin_chats_lb.insert(tk.END, "관리자 계정을 먼저 선택하세요.")
-            return
-        if selected_phone not in clients:
-            admin_chats_lb.insert(tk.END, "이 계정의 클라이언트가 준비되지 않음(로그인 필요)")
-            return
-        c = clients[selected_phone]
-        loop = client_loops.get(selected_phone)
-        if not loop:
-            admin_chats_lb.insert(tk.END, "이 계정의 event loop가 없음")
-            return
-        async def fetch_dialogs():
-            results = []
-            async for d in c.iter_dialogs():
-                results.append((d.name, d.id))
-            return results
-        future = asyncio.run_coroutine_threadsafe(fetch_dialogs(), loop)
-        try:
-            dialogs = future.result(timeout=10)
-            if dialogs:
-                for nm, cid in dialogs:
-                    admin_chats_lb.insert(tk.END, f"{nm} (ID={cid})")
-            else:
-                admin_chats_lb.insert(tk.END, "대화방 없음")
-        except Exception as e:
-            admin_chats_lb.insert(tk.END, f"불러오기 실패: {e}")
-    ttk.Button(frame_admin_chats, text="새로고침", command=refresh_admin_chats).pack(pady=2)
-    async def get_chat_name_by_id_for_admin(chat_id):
-        for admin_phone in admin_accounts_list:
-            if admin_phone in clients:
-                c = clients[admin_phone]
-                try:
-                    ent = await c.get_entity(chat_id)
-                    return ent.title if hasattr(ent, 'title') else (ent.first_name or "Unknown")
-                except:
-                    pass
-        return "Unknown"
+            return
+        if selected_phone != chat_browser.phone:
+            chat_browser.load(selected_phone)
+    admin_accounts_lb.bind("<<ListboxSelect>>", on_admin_account_select)
     def refresh_admin_rooms_listbox():
         admin_rooms_lb.delete(0, tk.END)
-        loop = None
-        for admin_phone in admin_accounts_list:
-            if admin_phone in client_loops:
-                loop = client_loops[admin_phone]
-                break
-        if not loop:
-            for rid in admin_rooms_list:
-                admin_rooms_lb.insert(tk.END, rid)
-            return
-        for rid in admin_rooms_list:
-            def fetch_name(id_):
-                return asyncio.run_coroutine_threadsafe(get_chat_name_by_id_for_admin(id_), loop).result(5)
+        request = new_gui_request("admin_rooms")
+        admin_phone = next((p for p in admin_accounts_list if p in clients), None)
+        for idx, rid in enumerate(admin_rooms_list):
+            admin_rooms_lb.insert(tk.END, rid)
+            if not admin_phone:
+                continue
             try:
-                chat_name = fetch_name(rid)
-                admin_rooms_lb.insert(tk.END, f"{chat_name} (방아이디: {rid})")
-            except:
-                admin_rooms_lb.insert(tk.END, rid)
+                cid = int(rid)
+            except ValueError:
+                cid = rid
+            fill_chat_name_row(admin_rooms_lb, idx, admin_phone, cid, request, fmt="{name} (방아이디: {cid})")
     frame_admin_rooms = ttk.Frame(container)
     frame_admin_rooms.pack(fill="both", expand=True, pady=5)
     ttk.Label(frame_admin_rooms, text="관리자 방 목록").pack(anchor="w")
     admin_rooms_lb = tk.Listbox(frame_admin_rooms, height=6)
     admin_rooms_lb.pack(fill="both", expand=True)
     def add_admin_room_from_selected_chat():
-        try:
-            sel = admin_chats_lb.get(admin_chats_lb.curselection())
-        except:
+        cid = chat_browser.selected_chat_id()
+        if cid is None:
             messagebox.showinfo("알림", "대화방 목록에서 선택하세요.")
             return
-        import re
-        match = re.search(r'ID=([\-0-9]+)', sel)
-        if match:
-            chat_id = match.group(1)
-            if chat_id not in admin_rooms_list:
-                admin_rooms_list.append(chat_id)
-                refresh_admin_rooms_listbox()
-                save_admin_data()
-                print("방이름 : 설정 완료")
-        else:
-            messagebox.showerror("오류", "ID 파싱 실패")
-    ttk.Button(frame_admin_rooms, text="대화방 → 추가", command=add_admin_room_from_selected_chat).pack(pady=3)
-    frame_room_entry = ttk.Frame(frame_admin_rooms)
-    frame_room_entry.pack(fill="x")
-    room_entry_var = tk.StringVar()
-    room_entry = ttk.Entry(frame_room_entry, textvariable=room_entry_var)
-    room_entry.pack(side="left", fill="x", expand=True, padx=5)
-    def add_admin_room_by_input():
-        val = room_entry_var.get().strip()
-        if val and val not in admin_rooms_list:
-            admin_rooms_list.append(val)
+        chat_id = str(cid)   # admin_data.json 에는 문자열로 저장
+        if chat_id not in admin_rooms_list:
+            admin_rooms_list.append(chat_id)
             refresh_admin_rooms_listbox()
-            room_entry_var.set("")
             save_admin_data()
-    ttk.Button(frame_room_entry, text="➕ 추가(직접입력)", command=add_admin_room_by_input).pack(side="left", padx=2)
+            print("방이름 : 설정 완료")
+    ttk.Button(frame_admin_rooms, text="대화방 → 추가", command=add_admin_room_from_selected_chat).pack(pady=3)
     def remove_admin_room():
         try:
             idx = admin_rooms_lb.curselection()[0]
-            selection = admin_rooms_lb.get(idx)
         except:
             return
-        if selection in admin_rooms_list:
-            admin_rooms_list.remove(selection)
+        # 이름이 채워진 줄도 있으므로 표시 문자열 대신 순서로 찾음
+        if idx < len(admin_rooms_list):
+            admin_rooms_list.pop(idx)
             admin_rooms_lb.delete(idx)
             save_admin_data()
     ttk.Button(frame_admin_rooms, text="🗑 삭제", command=remove_admin_room).pack(pady=2)
@@ -939,6 +3982,21 @@ def build_admin_tab(tab):
         chk = ttk.Checkbutton(target_frame, text=admin_funcs[key], variable=var)
         chk.pack(anchor="w", padx=5, pady=2)
     ttk.Button(frame_admin_funcs, text="적용", command=apply_admin_functions).pack(pady=5)
+    frame_admin_report = ttk.Frame(container)
+    frame_admin_report.pack(fill="both", expand=True, pady=5)
+    ttk.Label(frame_admin_report, text="권한 적용 결과").pack(anchor="w")
+    admin_report_lb = tk.Listbox(frame_admin_report, height=6)
+    admin_report_lb.pack(fill="both", expand=True)
+    def show_admin_rollout_report(report):
+        admin_report_lb.delete(0, tk.END)
+        labels = {"ok": "성공", "unchanged": "변경없음", "failed": "실패"}
+        for entry in report:
+            detail = f" - {entry['detail']}" if entry["detail"] else ""
+            admin_report_lb.insert(tk.END, f"{entry['room']} [{entry['phone'] or '-'}]: {labels[entry['status']]} ({entry['seconds']}초){detail}")
+            if entry["status"] == "failed":
+                admin_report_lb.itemconfig(tk.END, fg="red")
+    global admin_rollout_report_cb
+    admin_rollout_report_cb = show_admin_rollout_report
     for phone in admin_accounts_list:
         if phone not in admin_accounts_lb.get(0, tk.END):
             admin_accounts_lb.insert(tk.END, phone)
@@ -970,20 +4028,577 @@ def start_gui():
     tab_account = ttk.Frame(notebook)
     tab_alert = ttk.Frame(notebook)
     tab_admin = ttk.Frame(notebook)  # 관리자 관리 탭
+    tab_metrics = ttk.Frame(notebook)
+    tab_rooms = ttk.Frame(notebook)
     notebook.add(tab_main, text="메인")
     notebook.add(tab_copy, text="방배끼기")
     notebook.add(tab_expert, text="전문가 셋팅")
     notebook.add(tab_account, text="계정관리")
     notebook.add(tab_alert, text="방 알림 봇")
     notebook.add(tab_admin, text="관리자 관리")
+    notebook.add(tab_metrics, text="지표")
+    notebook.add(tab_rooms, text="방 상태")
     build_main_tab(tab_main)
     build_copy_tab(tab_copy)
     build_expert_tab(tab_expert)
     build_account_management_tab(tab_account)
     build_alert_bot_tab_multi(tab_alert)
     build_admin_tab(tab_admin)
+    build_metrics_tab(tab_metrics)
+    build_room_health_tab(tab_rooms)
+    root.after(gui_result_interval, drain_gui_results)
+    watch_tk(root)
     root.mainloop()
 
+# --------------------- GUI ↔ 클라이언트 비동기 브리지 ---------------------
+gui_results = queue.Queue()         # (request, callback, args) → Tk 스레드에서 실행
+gui_request_seq = defaultdict(int)  # 채널 → 최신 요청 번호 (이전 선택의 응답은 버림)
+gui_result_interval = 50            # 결과 큐 확인 주기(ms)
+gui_result_batch = 200              # 한 번에 처리할 최대 결과 수
+
+def new_gui_request(channel):
+    gui_request_seq[channel] += 1
+    return (channel, gui_request_seq[channel])
+
+def is_current_request(request):
+    return request is None or gui_request_seq[request[0]] == request[1]
+
+def gui_post(request, callback, *args):
+    gui_results.put((request, callback, args))
+
+def drain_gui_results():
+    for _ in range(gui_result_batch):
+        try:
+            request, callback, args = gui_results.get_nowait()
+        except queue.Empty:
+            break
+        if not is_current_request(request):
+            continue
+        started = time.perf_counter()
+        try:
+            callback(*args)
+        except Exception as e:
+            print(f"[GUI] 결과 처리 오류: {e}")
+        took = time.perf_counter() - started
+        if took >= slow_callback_threshold:
+            name = callback_name(callback)
+            metrics.inc("slow_callbacks_total", target="tk", where=name)
+            stall_history.append(("tk", time.time(), name))
+            print(f"[멈춤 감시] GUI 콜백 {name} {took:.2f}초")
+    if root:
+        root.after(gui_result_interval, drain_gui_results)
+
+def submit_client_job(phone, job, on_result=None, on_error=None, on_batch=None, request=None, batch_size=50):
+    """
+    Tk 콜백에서 계정 클라이언트 작업을 넘기고 바로 반환.
+    job(client) 는 코루틴, on_batch 를 주면 비동기 제너레이터로 보고 조금씩 전달.
+    결과/오류 콜백은 drain_gui_results 가 Tk 스레드에서 호출.
+    """
+    loop = client_loops.get(phone)
+    if phone not in clients or not loop:
+        return False
+    async def runner():
+        try:
+            result = None
+            async with using_client(phone) as client:
+                if on_batch is not None:
+                    batch = []
+                    async for item in job(client):
+                        if not is_current_request(request):
+                            return
+                        batch.append(item)
+                        if len(batch) >= batch_size:
+                            gui_post(request, on_batch, batch)
+                            batch = []
+                    if batch:
+                        gui_post(request, on_batch, batch)
+                else:
+                    result = await job(client)
+            if on_result:
+                gui_post(request, on_result, result)
+        except Exception as e:
+            if on_error:
+                gui_post(request, on_error, e)
+            else:
+                print(f"[{phone}] GUI 작업 오류: {e}")
+    asyncio.run_coroutine_threadsafe(runner(), loop)
+    return True
+
+async def fetch_chat_name(client, chat_id):
+    try:
+        ent = await client.get_entity(chat_id)
+    except Exception:
+        return None
+    return getattr(ent, "title", None) or getattr(ent, "first_name", None)
+
+def fill_chat_name_row(listbox, idx, phone, cid, request, fmt="{name} (ID={cid})"):
+    """Listbox 의 idx 번째 줄을 방 이름이 도착하면 교체"""
+    def on_name(name):
+        if idx < listbox.size():
+            listbox.delete(idx)
+            listbox.insert(idx, fmt.format(name=name or "Unknown", cid=cid))
+    submit_client_job(phone, lambda c: fetch_chat_name(c, cid), on_result=on_name, request=request)
+
+# --------------------- 대화방 목록 인덱스 ---------------------
+dialog_tables = {}          # phone → 대화방 행 목록 (config_dir/dialogs/<phone>.json 에 저장)
+dialog_page_size = 100      # 대화방 목록 한 페이지 행 수
+DIALOG_TYPE_LABELS = {"group": "그룹", "supergroup": "슈퍼그룹", "channel": "채널", "user": "개인"}
+DIALOG_MARK_LABELS = {"main": "메인", "sub": "서브", "alert": "알림"}
+
+def dialog_table_name(phone):
+    return os.path.join("dialogs", f"{phone}.json")
+
+def dialog_type_of(entity):
+    if isinstance(entity, Chat):
+        return "group"
+    if isinstance(entity, Channel):
+        return "supergroup" if entity.megagroup else "channel"
+    return "user"
+
+def index_dialog_rows(rows):
+    for r in rows:
+        r["key"] = r["name"].lower()
+    return rows
+
+def load_dialog_table(phone):
+    count_cache("dialog_table", phone in dialog_tables)
+    if phone not in dialog_tables:
+        try:
+            with open(config_path(dialog_table_name(phone)), "r", encoding="utf-8") as f:
+                dialog_tables[phone] = index_dialog_rows(json.load(f))
+        except:
+            return None
+    return dialog_tables[phone]
+
+def set_dialog_table(phone, rows):
+    dialog_tables[phone] = index_dialog_rows(rows)
+    # 저장은 다른 설정처럼 ConfigStore 가 모아서 (Tk 스레드에서 바로 fsync 하지 않음)
+    config_store.set(dialog_table_name(phone), [{k: r[k] for k in ("id", "name", "type")} for r in rows],
+                     indent=None)
+
+async def fetch_dialog_table(client):
+    rows = []
+    async for d in client.iter_dialogs():
+        rows.append({"id": d.id, "name": d.name or "", "type": dialog_type_of(d.entity)})
+    return rows
+
+def account_room_marks(phone):
+    """chat_id → {"main", "sub", "alert"} (이미 등록된 방 표시용)"""
+    marks = defaultdict(set)
+    acc = get_account_by_phone(phone) or {}
+    if acc.get("main_chat_id") is not None:
+        marks[acc["main_chat_id"]].add("main")
+    for cid in acc.get("subroom_ids", []):
+        marks[cid].add("sub")
+    for cid in acc.get("alert_rooms", []):
+        marks[cid].add("alert")
+    return marks
+
+def search_dialog_table(rows, query="", type_filter=None, mark_filter=None, marks=None):
+    """접두어 일치를 먼저, 그 다음 부분 일치 순서로 반환"""
+    query = query.strip().lower()
+    marks = marks or {}
+    prefix, contains = [], []
+    for r in rows:
+        if type_filter and r["type"] != type_filter:
+            continue
+        if mark_filter:
+            m = marks.get(r["id"])
+            if mark_filter == "none" and m:
+                continue
+            if mark_filter != "none" and (not m or mark_filter not in m):
+                continue
+        if not query:
+            prefix.append(r)
+        elif r["key"].startswith(query):
+            prefix.append(r)
+        elif query in r["key"] or query in str(r["id"]):
+            contains.append(r)
+    return prefix + contains
+
+class DialogBrowser:
+    """계정별 대화방 인덱스를 검색/필터/페이지 단위로 보여주는 선택 위젯 (행 iid = chat id)"""
+    TYPE_CHOICES = [("전체", None)] + [(v, k) for k, v in DIALOG_TYPE_LABELS.items()]
+    MARK_CHOICES = [("전체", None), ("미등록", "none")] + [(v, k) for k, v in DIALOG_MARK_LABELS.items()]
+
+    def __init__(self, parent, height=10):
+        self.phone = None
+        self.page = 0
+        self.results = []
+        self.marks = {}
+        self.channel = f"dialogs_{id(self)}"
+        self.frame = ttk.Frame(parent)
+        self.frame.pack(fill="both", padx=5, pady=2)
+        bar = ttk.Frame(self.frame)
+        bar.pack(fill="x")
+        self.query_var = tk.StringVar()
+        ttk.Entry(bar, textvariable=self.query_var, width=20).pack(side="left")
+        self.type_var = tk.StringVar(value="전체")
+        ttk.Combobox(bar, textvariable=self.type_var, width=8, state="readonly",
+                     values=[c[0] for c in self.TYPE_CHOICES]).pack(side="left", padx=3)
+        self.mark_var = tk.StringVar(value="전체")
+        ttk.Combobox(bar, textvariable=self.mark_var, width=6, state="readonly",
+                     values=[c[0] for c in self.MARK_CHOICES]).pack(side="left", padx=3)
+        ttk.Button(bar, text="동기화", command=self.sync).pack(side="left", padx=3)
+        tree_frame = ttk.Frame(self.frame)
+        tree_frame.pack(fill="both", expand=True)
+        self.tree = ttk.Treeview(tree_frame, columns=("name", "type", "id", "mark"), show="headings",
+                                 height=height, selectmode="browse")
+        for col, text, width in (("name", "이름", 200), ("type", "종류", 70), ("id", "ID", 120), ("mark", "등록", 70)):
+            self.tree.heading(col, text=text)
+            self.tree.column(col, width=width, anchor="w" if col == "name" else "center")
+        self.tree.pack(side="left", fill="both", expand=True)
+        scroll = ttk.Scrollbar(tree_frame, orient="vertical", command=self.tree.yview)
+        scroll.pack(side="right", fill="y")
+        self.tree.configure(yscrollcommand=scroll.set)
+        nav = ttk.Frame(self.frame)
+        nav.pack(fill="x")
+        ttk.Button(nav, text="◀", width=3, command=lambda: self.go_page(-1)).pack(side="left")
+        self.page_label = ttk.Label(nav, text="")
+        self.page_label.pack(side="left", padx=5)
+        ttk.Button(nav, text="▶", width=3, command=lambda: self.go_page(1)).pack(side="left")
+        self.query_var.trace_add("write", lambda *a: self.refresh())
+        self.type_var.trace_add("write", lambda *a: self.refresh())
+        self.mark_var.trace_add("write", lambda *a: self.refresh())
+
+    def load(self, phone):
+        self.phone = phone
+        new_gui_request(self.channel)
+        if load_dialog_table(phone) is None:
+            self.sync()
+        self.refresh()
+
+    def sync(self):
+        phone = self.phone
+        if not phone:
+            return
+        def on_rows(rows):
+            set_dialog_table(phone, rows)
+            self.refresh(keep_page=True)
+        def on_error(e):
+            self.page_label.config(text=f"불러오기 실패: {e}")
+        if submit_client_job(phone, fetch_dialog_table, on_result=on_rows, on_error=on_error,
+                             request=new_gui_request(self.channel)):
+            self.page_label.config(text="동기화 중...")
+        elif load_dialog_table(phone) is None:
+            self.page_label.config(text="이 계정의 클라이언트가 준비되지 않음")
+
+    def refresh(self, keep_page=False):
+        rows = load_dialog_table(self.phone) if self.phone else None
+        self.marks = account_room_marks(self.phone) if self.phone else {}
+        self.results = search_dialog_table(
+            rows or [], self.query_var.get(),
+            dict(self.TYPE_CHOICES).get(self.type_var.get()),
+            dict(self.MARK_CHOICES).get(self.mark_var.get()),
+            self.marks,
+        )
+        if not keep_page:
+            self.page = 0
+        self.render()
+
+    def go_page(self, delta):
+        last = max((len(self.results) - 1) // dialog_page_size, 0)
+        self.page = min(max(self.page + delta, 0), last)
+        self.render()
+
+    def render(self):
+        self.tree.delete(*self.tree.get_children())
+        start = self.page * dialog_page_size
+        for r in self.results[start:start + dialog_page_size]:
+            mark = ",".join(DIALOG_MARK_LABELS[m] for m in sorted(self.marks.get(r["id"], ())))
+            self.tree.insert("", "end", iid=str(r["id"]),
+                             values=(r["name"], DIALOG_TYPE_LABELS.get(r["type"], r["type"]), r["id"], mark))
+        pages = max((len(self.results) + dialog_page_size - 1) // dialog_page_size, 1)
+        self.page_label.config(text=f"{self.page + 1}/{pages} 페이지 ({len(self.results)}개)")
+
+    def clear(self):
+        self.phone = None
+        new_gui_request(self.channel)
+        self.results = []
+        self.render()
+
+    def selected_chat_id(self):
+        sel = self.tree.selection()
+        return int(sel[0]) if sel else None
+
+# --------------------- 실시간 로그 (GUI) ---------------------
+gui_log_buffer = deque(maxlen=5000)  # 각 스레드가 append, Tk 스레드가 비움 (deque append/popleft 는 원자적)
+gui_log_max_lines = 2000             # 로그창에 유지할 최대 줄 수
+gui_log_batch = 500                  # 한 번에 그릴 최대 줄 수
+gui_log_drain_interval = 100         # 로그창 갱신 주기(ms)
+gui_log_accounts = set()             # 로그에 등장한 계정 (필터 목록)
+LOG_PHONE_RE = re.compile(r"^\[(\+?\d{8,15})\]")            # "[전화번호] ..." 로 시작하는 줄
+LOG_NUMBER_RE = re.compile(r"(?<![\d-])\+?\d{8,15}(?!\d)")   # 그 밖의 숫자는 등록된 계정 번호일 때만 (방 id·시각 제외)
+
+def classify_log_line(text, level=None):
+    if level is None:
+        if "오류" in text or "실패" in text or "ERROR" in text:
+            level = "error"
+        elif "FloodWait" in text or "경고" in text:
+            level = "warn"
+        else:
+            level = "info"
+    m = LOG_PHONE_RE.match(text)
+    if m:
+        return level, m.group(1)
+    return level, next((n for n in LOG_NUMBER_RE.findall(text) if get_account_by_phone(n)), None)
+
+class DualWriter:
+    def __init__(self, level=None):
+        self.level = level
+        self.console = sys.__stdout__
+    def write(self, text):
+        if text.strip():
+            self.console.write(text + "\n")
+            gui_log_buffer.append((text, self.level))
+    def flush(self):
+        self.console.flush()
+
+def drain_gui_log(log_box, apply_filter=None):
+    lines = []
+    while gui_log_buffer and len(lines) < gui_log_batch:
+        lines.append(gui_log_buffer.popleft())
+    if lines:
+        new_account = False
+        log_box.configure(state="normal")
+        for text, level in lines:
+            level, phone = classify_log_line(text, level)
+            if phone and phone not in gui_log_accounts:
+                gui_log_accounts.add(phone)
+                new_account = True
+            log_box.insert(tk.END, text + "\n", (f"lvl_{level}", f"acc_{phone or 'none'}"))
+        excess = int(log_box.index("end-1c").split(".")[0]) - gui_log_max_lines
+        if excess > 0:
+            log_box.delete("1.0", f"{excess + 1}.0")
+        log_box.see(tk.END)
+        log_box.configure(state="disabled")
+        if new_account and apply_filter:
+            apply_filter()
+    delay = 10 if gui_log_buffer else gui_log_drain_interval
+    log_box.after(delay, lambda: drain_gui_log(log_box, apply_filter))
+
+# --------------------- 지표 탭 ---------------------
+metrics_refresh_interval = 2000   # 지표 탭 갱신 주기(ms)
+METRICS_LATENCY_ROWS = (
+    ("receive_delay_seconds", "수신 지연 (서버 → 봇)"),
+    ("first_room_sent_seconds", "수신 → 첫 방 전송"),
+    ("last_room_sent_seconds", "수신 → 마지막 방 전송"),
+    ("admin_rights_seconds", "관리자 권한 적용"),
+    ("loop_lag_seconds", "이벤트 루프 지연"),
+    ("tk_lag_seconds", "GUI(Tk) 지연"),
+)
+
+def build_metrics_tab(tab):
+    port = int(load_alert_settings().get("metrics_port", metrics_port))
+    endpoint = f"http://127.0.0.1:{port}/metrics" if port else "꺼짐"
+    endpoint_label = ttk.Label(tab, text=f"Prometheus: {endpoint}")
+    endpoint_label.pack(anchor="w", padx=5, pady=5)
+
+    ttk.Label(tab, text="지연 (초)").pack(anchor="w", padx=5)
+    latency_tree = ttk.Treeview(tab, columns=("count", "p50", "p99", "max"), height=len(METRICS_LATENCY_ROWS))
+    latency_tree.heading("#0", text="구간")
+    latency_tree.column("#0", width=220)
+    for col, label in (("count", "건수"), ("p50", "p50"), ("p99", "p99"), ("max", "최대")):
+        latency_tree.heading(col, text=label)
+        latency_tree.column(col, width=90, anchor="e")
+    for name, label in METRICS_LATENCY_ROWS:
+        latency_tree.insert("", "end", iid=name, text=label, values=(0, "-", "-", "-"))
+    latency_tree.pack(fill="x", padx=5)
+
+    ttk.Label(tab, text="계정별 전송").pack(anchor="w", padx=5, pady=(10, 0))
+    account_cols = (("phone", "계정", 140), ("sends", "전송", 80), ("errors", "오류", 80),
+                    ("flood", "FloodWait", 80), ("queue", "대기", 60))
+    account_tree = ttk.Treeview(tab, columns=[c for c, _, _ in account_cols], show="headings", height=10)
+    for col, label, width in account_cols:
+        account_tree.heading(col, text=label)
+        account_tree.column(col, width=width, anchor="w" if col == "phone" else "e")
+    account_tree.pack(fill="both", expand=True, padx=5)
+
+    status_label = ttk.Label(tab, text="", justify="left")
+    status_label.pack(anchor="w", padx=5, pady=5)
+
+    ttk.Label(tab, text="상태 메모리 (추정)").pack(anchor="w", padx=5)
+    state_cols = (("name", "구조", 160), ("entries", "항목", 80), ("size", "KB", 80),
+                  ("budget", "예산", 160), ("evicted", "제거", 70))
+    state_tree = ttk.Treeview(tab, columns=[c for c, _, _ in state_cols], show="headings", height=7)
+    for col, label, width in state_cols:
+        state_tree.heading(col, text=label)
+        state_tree.column(col, width=width, anchor="w" if col in ("name", "budget") else "e")
+    state_tree.pack(fill="x", padx=5)
+
+    profile_bar = ttk.Frame(tab)
+    profile_bar.pack(fill="x", padx=5, pady=(10, 0))
+    ttk.Label(profile_bar, text="핸들러 프로파일 (초)").pack(side="left")
+    profile_seconds = tk.StringVar(value=str(profile_default_seconds))
+    ttk.Entry(profile_bar, textvariable=profile_seconds, width=6).pack(side="left", padx=5)
+    profile_state = ttk.Label(profile_bar, text="")
+    def start_profile():
+        try:
+            seconds = float(profile_seconds.get())
+        except ValueError:
+            messagebox.showerror("오류", "측정 시간은 숫자로 입력하세요.")
+            return
+        if not handler_profiler.start(seconds):
+            messagebox.showinfo("알림", "이미 측정 중입니다.")
+    ttk.Button(profile_bar, text="측정 시작", command=start_profile).pack(side="left")
+    ttk.Button(profile_bar, text="중지", command=handler_profiler.stop).pack(side="left", padx=5)
+    profile_state.pack(side="left", padx=10)
+    profile_cols = (("handler", "핸들러", 220), ("phone", "계정", 110), ("calls", "호출", 60),
+                    ("cpu", "CPU ms", 80), ("per_call", "호출당", 70), ("blocked", "블로킹 ms", 80),
+                    ("await", "대기 ms", 80))
+    profile_tree = ttk.Treeview(tab, columns=[c for c, _, _ in profile_cols], show="headings", height=8)
+    for col, label, width in profile_cols:
+        profile_tree.heading(col, text=label)
+        profile_tree.column(col, width=width, anchor="w" if col in ("handler", "phone") else "e")
+    profile_tree.pack(fill="both", expand=True, padx=5, pady=(0, 5))
+    shown_report = [None]
+
+    def per_label(name, label):
+        totals = defaultdict(float)
+        with metrics.lock:
+            for (n, labels), v in metrics.counters.items():
+                if n == name:
+                    totals[dict(labels).get(label)] += v
+        return totals
+
+    def refresh():
+        if not tab.winfo_exists():
+            return
+        for name, _ in METRICS_LATENCY_ROWS:
+            count, p50, p99, peak = metrics.histogram_summary(name)
+            values = (count, f"{p50:.3f}", f"{p99:.3f}", f"{peak:.3f}") if count else (0, "-", "-", "-")
+            latency_tree.item(name, values=values)
+        sends, errors, floods = per_label("sends_total", "phone"), per_label("send_errors_total", "phone"), per_label("floodwait_total", "phone")
+        backlog = join_backlog()
+        phones = sorted(set(sends) | set(errors) | set(floods) | set(clients))
+        for phone in phones:
+            values = (phone, int(sends[phone]), int(errors[phone]), int(floods[phone]), backlog.get(phone, 0))
+            if account_tree.exists(phone):
+                account_tree.item(phone, values=values)
+            else:
+                account_tree.insert("", "end", iid=phone, values=values)
+        caches = []
+        for cache in sorted(set(per_label("cache_requests_total", "cache")) - {None}):
+            hit = metrics.counter_total("cache_requests_total", cache=cache, result="hit")
+            total = metrics.counter_total("cache_requests_total", cache=cache)
+            caches.append(f"{cache} {hit / total:.0%} ({int(total)}회)")
+        gauges = metrics.read_gauges(timeout=0.2)
+        def gauge_total(name):
+            return int(sum(gauges.get(name, {}).values()))
+        status_label.config(text=(
+            f"캐시 적중률: {', '.join(caches) or '-'}\n"
+            f"앨범 대기 {gauge_total('media_groups_pending')} / 묶음 전송 대기 {gauge_total('batch_requests_pending')}"
+            f" / GUI 결과 큐 {gauge_total('gui_results_depth')} / 로그 대기 {gauge_total('gui_log_depth')}"
+            f" / 연결 계정 {gauge_total('clients_connected')}\n"
+            f"멈춤 {int(metrics.counter_total('stalls_total'))}회"
+            + (f" (최근: {stall_history[-1][0]} {stall_history[-1][2]})" if stall_history else "")
+        ))
+        for row in state_report():
+            values = (row["name"], row["entries"], f"{row['bytes'] / 1024:.0f}", row["budget"], row["evicted"])
+            if state_tree.exists(row["name"]):
+                state_tree.item(row["name"], values=values)
+            else:
+                state_tree.insert("", "end", iid=row["name"], values=values)
+        if handler_profiler.active:
+            profile_state.config(text=f"측정 중 ({time.perf_counter() - handler_profiler.started:.0f}초)")
+        else:
+            profile_state.config(text=f"스택: {handler_profiler.last_folded}" if handler_profiler.last_folded else "")
+        if shown_report[0] is not handler_profiler.last_report:
+            shown_report[0] = handler_profiler.last_report
+            profile_tree.delete(*profile_tree.get_children())
+            for row in handler_profiler.last_report:
+                profile_tree.insert("", "end", values=(row["handler"], row["phone"], row["calls"],
+                                                       f"{row['cpu_ms']:.1f}", f"{row['cpu_ms_per_call']:.2f}",
+                                                       f"{row['blocked_ms']:.1f}", f"{row['await_ms']:.1f}"))
+        tab.after(metrics_refresh_interval, refresh)
+    tab.after(metrics_refresh_interval, refresh)
+
+# --------------------- 방 상태 탭 ---------------------
+def build_room_health_tab(tab):
+    bar = ttk.Frame(tab)
+    bar.pack(fill="x", padx=5, pady=5)
+    show_all = tk.BooleanVar(value=False)
+    summary = ttk.Label(bar, text="")
+
+    def check_now():
+        phone = next((p for p in room_destinations() if p in clients and client_loops.get(p)), None)
+        if phone is None:
+            messagebox.showinfo("알림", "점검할 연결된 계정이 없습니다.")
+            return
+        submit_client_job(phone, lambda c: check_all_rooms(),
+                          on_result=lambda n: print(f"[방 상태] {n}개 방 점검 완료"),
+                          on_error=lambda e: print(f"[방 상태] 점검 오류: {e}"))
+
+    def reconcile_now():
+        phone = next((p for p in room_destinations() if p in clients and client_loops.get(p)), None)
+        if phone is None:
+            messagebox.showinfo("알림", "동기화할 연결된 계정이 없습니다.")
+            return
+        def on_result(result):
+            if result["busy"]:
+                messagebox.showinfo("알림", "이미 동기화가 진행 중입니다.")
+                return
+            state = "완료" if result["completed"] else "예산 소진, 다음 실행에서 이어서"
+            print(f"[동기화] {state} (RPC {result['rpc']}회)")
+        submit_client_job(phone, lambda c: reconcile_once(), on_result=on_result,
+                          on_error=lambda e: print(f"[동기화] 오류: {e}"))
+
+    def include_selected():
+        """선택한 방을 다음 점검 전까지 다시 전송 대상에 넣음"""
+        for iid in tree.selection():
+            phone, rid = iid.split("|")
+            set_room_state(phone, int(rid), ROOM_WRITABLE, "수동으로 다시 포함", source="manual")
+        refresh(reschedule=False)
+
+    ttk.Button(bar, text="지금 점검", command=check_now).pack(side="left")
+    ttk.Button(bar, text="선택 방 다시 포함", command=include_selected).pack(side="left", padx=5)
+    ttk.Button(bar, text="메인↔서브 동기화", command=reconcile_now).pack(side="left")
+    ttk.Checkbutton(bar, text="정상 방도 보기", variable=show_all,
+                    command=lambda: refresh(reschedule=False)).pack(side="left", padx=5)
+    summary.pack(side="left", padx=10)
+
+    cols = (("phone", "계정", 120), ("room", "방", 200), ("role", "용도", 60), ("state", "상태", 80),
+            ("detail", "설명", 180), ("checked", "확인 시각", 80), ("source", "근거", 50))
+    tree = ttk.Treeview(tab, columns=[c for c, _, _ in cols], show="headings")
+    for col, label, width in cols:
+        tree.heading(col, text=label)
+        tree.column(col, width=width, anchor="w")
+    tree.pack(fill="both", expand=True, padx=5, pady=(0, 5))
+
+    def room_label(names, phone, rid):
+        if phone not in names:
+            names[phone] = {r["id"]: r["name"] for r in load_dialog_table(phone) or []}
+        name = names[phone].get(rid)
+        return f"{name} ({rid})" if name else str(rid)
+
+    def refresh(reschedule=True):
+        if not tab.winfo_exists():
+            return
+        roles = {(p, r): role for p, rooms in room_destinations().items() for r, role in rooms.items()}
+        counts = defaultdict(int)
+        rows, names = {}, {}
+        for (phone, rid), entry in list(room_health.items()):
+            counts[entry["state"]] += 1
+            if (phone, rid) not in roles or (entry["state"] == ROOM_WRITABLE and not show_all.get()):
+                continue
+            checked = datetime.fromtimestamp(entry["checked"]).strftime("%H:%M:%S")
+            rows[f"{phone}|{rid}"] = (phone, room_label(names, phone, rid), roles[(phone, rid)],
+                                      ROOM_STATE_LABELS[entry["state"]], entry["detail"], checked,
+                                      {"probe": "점검", "send": "전송", "manual": "수동"}[entry["source"]])
+        for iid in tree.get_children():
+            if iid not in rows:
+                tree.delete(iid)
+        for iid, values in rows.items():
+            if tree.exists(iid):
+                tree.item(iid, values=values)
+            else:
+                tree.insert("", "end", iid=iid, values=values)
+        summary.config(text=" / ".join(f"{label} {counts[state]}" for state, label in ROOM_STATE_LABELS.items())
+                       + f" / 건너뜀 {int(metrics.counter_total('room_skipped_total'))}회")
+        if reschedule:
+            tab.after(metrics_refresh_interval, refresh)
+    tab.after(metrics_refresh_interval, refresh)
+
 def build_main_tab(parent):
     container = ttk.Frame(parent)
     container.pack(fill="both", expand=True)
@@ -1036,16 +4651,23 @@ def build_main_tab(parent):
     ttk.Checkbutton(scroll_frame, text="입장 제외자 사용 (ON/OFF)", variable=use_exclude).pack(pady=3, anchor="w")
     def join_chat_all_accounts(link):
         ex = set(load_exclude_list())
-        for phone in command_queues:
+        phones = []
+        for phone in clients:
             if use_exclude.get() and phone in ex:
                 print(f"[{phone}] 입장 제외 → 건너뜀")
                 continue
-            command_queues[phone].put_nowait({"type": "join", "link": link})
+            phones.append(phone)
+        start_join_job("join", link, phones)
     def leave_chat_all_accounts(link):
-        for phone in command_queues:
-            command_queues[phone].put_nowait({"type": "leave", "link": link})
+        start_join_job("leave", link, list(clients))
+    def show_join_jobs():
+        if not join_jobs:
+            print("입장/나가기 작업 없음")
+        for job_id in list(join_jobs)[-5:]:
+            print_join_job_report(job_id)
     ttk.Button(action_frame, text="전체 계정 입장", command=lambda: join_chat_all_accounts(link_var.get())).pack(side="left", padx=5)
     ttk.Button(action_frame, text="전체 계정 나가기", command=lambda: leave_chat_all_accounts(link_var.get())).pack(side="left", padx=5)
+    ttk.Button(action_frame, text="작업 현황", command=show_join_jobs).pack(side="left", padx=5)
     ttk.Label(scroll_frame, text="제외할 전화번호 추가/삭제").pack(pady=(15,0))
     global exclude_input
     exclude_input = ttk.Entry(scroll_frame, width=40)
@@ -1092,31 +4714,44 @@ def build_main_tab(parent):
     account_listbox.bind("<<ListboxSelect>>", on_account_select)
     def update_account_list():
         account_listbox.delete(0, tk.END)
-        for acc in load_accounts():
+        for acc in accounts_snapshot():
             account_listbox.insert(tk.END, acc["phone"])
         print("계정 목록 갱신 완료 (accounts.json)")
     update_account_list()
     ttk.Label(scroll_frame, text="실시간 로그").pack(pady=(15,0))
+    filter_frame = ttk.Frame(scroll_frame)
+    filter_frame.pack(fill="x", padx=5)
+    ttk.Label(filter_frame, text="계정: ").pack(side="left")
+    log_account_var = tk.StringVar(value="전체")
+    log_account_combo = ttk.Combobox(filter_frame, textvariable=log_account_var, width=18, state="readonly",
+                                     values=["전체"], postcommand=lambda: log_account_combo.configure(
+                                         values=["전체"] + sorted(gui_log_accounts)))
+    log_account_combo.pack(side="left", padx=5)
+    level_vars = {}
+    for lvl, label in (("info", "일반"), ("warn", "경고"), ("error", "오류")):
+        level_vars[lvl] = tk.BooleanVar(value=True)
+        ttk.Checkbutton(filter_frame, text=label, variable=level_vars[lvl],
+                        command=lambda: apply_log_filter()).pack(side="left", padx=2)
     log_box = tk.Text(scroll_frame, height=15, state="disabled", bg="black", fg="white")
     log_box.pack(fill="x", padx=5, pady=5)
-    class DualWriter:
-        def __init__(self, gui_log_func):
-            self.gui_log_func = gui_log_func
-            self.console = sys.__stdout__
-        def write(self, text):
-            if text.strip():
-                self.console.write(text + "\n")
-                self.console.flush()
-                self.gui_log_func(text)
-        def flush(self):
-            self.console.flush()
-    def write_log(text):
-        log_box.configure(state="normal")
-        log_box.insert(tk.END, text + "\n")
-        log_box.see(tk.END)
-        log_box.configure(state="disabled")
-    sys.stdout = DualWriter(write_log)
-    sys.stderr = DualWriter(write_log)
+    log_box.tag_configure("lvl_info")
+    log_box.tag_configure("lvl_warn", foreground="yellow")
+    log_box.tag_configure("lvl_error", foreground="tomato")
+    def apply_log_filter():
+        # 태그의 elide 속성만 바꿔서 다시 그리지 않고 필터링
+        sel = log_account_var.get()
+        for tag in log_box.tag_names():
+            if tag.startswith("acc_"):
+                hide = sel != "전체" and tag != f"acc_{sel}"
+            elif tag.startswith("lvl_"):
+                hide = not level_vars[tag[4:]].get()
+            else:
+                continue
+            log_box.tag_configure(tag, elide=True if hide else "")
+    log_account_combo.bind("<<ComboboxSelected>>", lambda e: apply_log_filter())
+    sys.stdout = DualWriter()
+    sys.stderr = DualWriter(level="error")
+    root.after(gui_log_drain_interval, lambda: drain_gui_log(log_box, apply_log_filter))
 
 def build_copy_tab(tab):
     tk.Label(tab, text="복사 소스 채팅 ID 목록").pack(pady=(5, 0))
@@ -1298,31 +4933,33 @@ def build_account_management_tab(tab):
     account_search_var_management = tk.StringVar()
     search_entry_mgmt = ttk.Entry(search_frame, textvariable=account_search_var_management, width=30)
     search_entry_mgmt.pack(side="left", padx=5)
-    ttk.Button(search_frame, text="찾기", command=lambda: refresh_account_list_mgmt()).pack(side="left", padx=5)
+    ttk.Button(search_frame, text="새로고침", command=lambda: refresh_account_list_mgmt()).pack(side="left", padx=5)
     main_frame = ttk.Frame(container)
     main_frame.pack(fill="both", expand=True)
     left_frame = ttk.Frame(main_frame)
     left_frame.pack(side="left", fill="both", expand=False)
-    canvas = tk.Canvas(left_frame, width=400, height=400)
-    canvas.pack(side="left", fill="y", expand=False)
-    scrollbar = ttk.Scrollbar(left_frame, orient="vertical", command=canvas.yview)
-    scrollbar.pack(side="right", fill="y")
-    canvas.configure(yscrollcommand=scrollbar.set)
-    inner_frame = ttk.Frame(canvas)
-    canvas.create_window((0, 0), window=inner_frame, anchor="nw")
-    def on_inner_configure(event):
-        canvas.configure(scrollregion=canvas.bbox("all"))
-    inner_frame.bind("<Configure>", on_inner_configure)
+    # 행마다 위젯을 만들지 않고 Treeview 항목만 사용 (보이는 줄만 그려짐)
+    account_columns = (("no", "번호", 50), ("phone", "전화번호", 130), ("connected", "연결", 50),
+                       ("active", "활성화", 60), ("backlog", "대기", 50))
+    tree_frame = ttk.Frame(left_frame)
+    tree_frame.pack(fill="both", expand=True)
+    account_tree = ttk.Treeview(tree_frame, columns=[c[0] for c in account_columns],
+                                show="headings", height=18, selectmode="browse")
+    for col, text, width in account_columns:
+        account_tree.heading(col, text=text, command=lambda c=col: sort_account_tree(c))
+        account_tree.column(col, width=width, anchor="center")
+    account_tree.pack(side="left", fill="both", expand=True)
+    tree_scroll = ttk.Scrollbar(tree_frame, orient="vertical", command=account_tree.yview)
+    tree_scroll.pack(side="right", fill="y")
+    account_tree.configure(yscrollcommand=tree_scroll.set)
+    tree_btn_frame = ttk.Frame(left_frame)
+    tree_btn_frame.pack(fill="x", pady=3)
+    ttk.Button(tree_btn_frame, text="활성화 전환", command=lambda: toggle_selected_account_active()).pack(side="left", padx=5)
+    ttk.Button(tree_btn_frame, text="삭제", command=lambda: delete_selected_account()).pack(side="left", padx=5)
     right_frame = ttk.Frame(main_frame, relief="groove", borderwidth=1)
     right_frame.pack(side="left", fill="both", expand=True, padx=5)
     tk.Label(right_frame, text="해당 계정의 대화방 목록").pack(pady=5)
-    chat_frame = ttk.Frame(right_frame)
-    chat_frame.pack(fill="both", padx=5, pady=2)
-    chat_scrollbar = ttk.Scrollbar(chat_frame, orient="vertical")
-    chat_listbox = tk.Listbox(chat_frame, height=10, width=50, yscrollcommand=chat_scrollbar.set, exportselection=False)
-    chat_scrollbar.config(command=chat_listbox.yview)
-    chat_listbox.pack(side="left", fill="both", expand=True)
-    chat_scrollbar.pack(side="right", fill="y")
+    chat_browser = DialogBrowser(right_frame)
     main_chat_frame = ttk.LabelFrame(right_frame, text="메인방 관리")
     main_chat_frame.pack(fill="x", padx=5, pady=5)
     main_chat_var = tk.BooleanVar(value=False)
@@ -1347,34 +4984,7 @@ def build_account_management_tab(tab):
     current_selected_phone = [None]
     def load_account_chats_mgmt(phone):
         current_selected_phone[0] = phone
-        chat_listbox.delete(0, tk.END)
-        if phone not in clients:
-            chat_listbox.insert(tk.END, "이 계정의 클라이언트가 준비되지 않음")
-            refresh_main_chat_listbox_mgmt(phone)
-            refresh_sub_chat_listbox_mgmt(phone)
-            return
-        c = clients[phone]
-        loop = client_loops.get(phone)
-        if not loop:
-            chat_listbox.insert(tk.END, "이 계정의 event loop가 없음")
-            refresh_main_chat_listbox_mgmt(phone)
-            refresh_sub_chat_listbox_mgmt(phone)
-            return
-        async def fetch_dialogs():
-            results = []
-            async for d in c.iter_dialogs():
-                results.append((d.name, d.id))
-            return results
-        future = asyncio.run_coroutine_threadsafe(fetch_dialogs(), loop)
-        try:
-            dialogs = future.result(timeout=10)
-            if not dialogs:
-                chat_listbox.insert(tk.END, "참여 중인 대화방이 없습니다.")
-            else:
-                for nm, cid in dialogs:
-                    chat_listbox.insert(tk.END, f"{nm} (ID={cid})")
-        except Exception as e:
-            chat_listbox.insert(tk.END, f"불러오기 실패: {e}")
+        chat_browser.load(phone)
         refresh_main_chat_listbox_mgmt(phone)
         refresh_sub_chat_listbox_mgmt(phone)
     def parse_chat_id_from_string(s):
@@ -1386,70 +4996,39 @@ def build_account_management_tab(tab):
             except:
                 return None
         return None
-    def get_chat_name_from_id(phone, cid):
-        if phone not in clients:
-            return "Unknown"
-        c = clients[phone]
-        loop = client_loops.get(phone)
-        if not loop:
-            return "Unknown"
-        async def find_name():
-            async for d in c.iter_dialogs():
-                if d.id == cid:
-                    return d.name
-            return None
-        future = asyncio.run_coroutine_threadsafe(find_name(), loop)
-        try:
-            name = future.result(timeout=5)
-            return name if name else "Unknown"
-        except:
-            return "Unknown"
     def refresh_main_chat_listbox_mgmt(phone):
         main_chat_listbox.delete(0, tk.END)
-        allacc = load_accounts()
-        found = None
-        for a in allacc:
-            if a["phone"] == phone:
-                found = a
-                break
+        found = get_account_by_phone(phone)
         if not found:
             return
         main_id = found.get("main_chat_id")
+        request = new_gui_request("mgmt_main")
         if main_id:
-            nm = get_chat_name_from_id(phone, main_id)
-            main_chat_listbox.insert(tk.END, f"{nm} (ID={main_id})")
+            main_chat_listbox.insert(tk.END, f"Unknown (ID={main_id})")
+            fill_chat_name_row(main_chat_listbox, 0, phone, main_id, request)
         else:
             main_chat_listbox.insert(tk.END, "등록된 메인방 없음")
     def refresh_sub_chat_listbox_mgmt(phone):
         sub_chat_listbox.delete(0, tk.END)
-        allacc = load_accounts()
-        found = None
-        for a in allacc:
-            if a["phone"] == phone:
-                found = a
-                break
+        found = get_account_by_phone(phone)
         if not found:
             return
         sub_ids = found.get("subroom_ids", [])
         if not sub_ids:
             sub_chat_listbox.insert(tk.END, "등록된 서브방 없음")
         else:
-            for sid in sub_ids:
-                nm = get_chat_name_from_id(phone, sid)
-                sub_chat_listbox.insert(tk.END, f"{nm} (ID={sid})")
+            request = new_gui_request("mgmt_sub")
+            for idx, sid in enumerate(sub_ids):
+                sub_chat_listbox.insert(tk.END, f"Unknown (ID={sid})")
+                fill_chat_name_row(sub_chat_listbox, idx, phone, sid, request)
     def register_main_chat_mgmt():
         if not current_selected_phone[0]:
             messagebox.showinfo("알림", "먼저 왼쪽 계정을 선택하세요.")
             return
         phone = current_selected_phone[0]
-        try:
-            sel = chat_listbox.get(chat_listbox.curselection())
-        except:
-            messagebox.showinfo("알림", "대화방 목록에서 선택하세요.")
-            return
-        cid = parse_chat_id_from_string(sel)
+        cid = chat_browser.selected_chat_id()
         if cid is None:
-            messagebox.showerror("오류", "메인방 ID 파싱 실패")
+            messagebox.showinfo("알림", "대화방 목록에서 선택하세요.")
             return
         allacc = load_accounts()
         for a in allacc:
@@ -1458,6 +5037,7 @@ def build_account_management_tab(tab):
                 break
         save_accounts(allacc)
         refresh_main_chat_listbox_mgmt(phone)
+        chat_browser.refresh(keep_page=True)
         messagebox.showinfo("알림", f"{phone} 계정 메인방({cid}) 등록 완료.")
     def remove_main_chat_mgmt():
         if not current_selected_phone[0]:
@@ -1472,19 +5052,15 @@ def build_account_management_tab(tab):
                 break
         save_accounts(allacc)
         refresh_main_chat_listbox_mgmt(phone)
+        chat_browser.refresh(keep_page=True)
         messagebox.showinfo("알림", "메인방을 삭제했습니다.")
     def register_sub_chat_mgmt():
         if not current_selected_phone[0]:
             return
         phone = current_selected_phone[0]
-        try:
-            sel = chat_listbox.get(chat_listbox.curselection())
-        except:
-            messagebox.showinfo("알림", "대화방 목록에서 선택하세요.")
-            return
-        cid = parse_chat_id_from_string(sel)
+        cid = chat_browser.selected_chat_id()
         if cid is None:
-            messagebox.showerror("오류", "서브방 ID 파싱 실패")
+            messagebox.showinfo("알림", "대화방 목록에서 선택하세요.")
             return
         allacc = load_accounts()
         for a in allacc:
@@ -1496,6 +5072,7 @@ def build_account_management_tab(tab):
                 break
         save_accounts(allacc)
         refresh_sub_chat_listbox_mgmt(phone)
+        chat_browser.refresh(keep_page=True)
         messagebox.showinfo("알림", f"{phone} 계정 서브방({cid}) 등록 완료.")
     def remove_sub_chat_mgmt():
         if not current_selected_phone[0]:
@@ -1519,57 +5096,123 @@ def build_account_management_tab(tab):
                 break
         save_accounts(allacc)
         refresh_sub_chat_listbox_mgmt(phone)
+        chat_browser.refresh(keep_page=True)
         messagebox.showinfo("알림", f"서브방({cid}) 삭제 완료.")
+    account_index = {}          # phone → 번호 (accounts.json 순서)
+    visible_phones = []         # 현재 검색어에 맞는 계정
+    last_filter = [None]        # 직전 검색어 (좁혀가는 검색이면 이전 결과에서만 찾음)
+    sort_state = ["no", False]  # (정렬 컬럼, 역순 여부)
+    row_cache = {}              # phone → 마지막으로 표시한 값
+    def account_row_values(phone):
+        client = clients.get(phone)
+        connected = bool(client) and client.is_connected()
+        return (account_index[phone], phone, "●" if connected else "○",
+                "✔" if is_account_active(phone) else "✘", backlog.get(phone, 0))
+    backlog = {}                # phone → 진행 중인 입장/나가기 작업에서 남은 수 (갱신마다 한 번 계산)
     def refresh_account_list_mgmt():
-        for widget in inner_frame.winfo_children():
-            widget.destroy()
-        allacc = load_accounts()
-        filter_str = account_search_var_management.get().strip()
-        for idx, acc in enumerate(allacc, start=1):
+        account_tree.delete(*account_tree.get_children())
+        account_index.clear()
+        row_cache.clear()
+        backlog.clear()
+        backlog.update(join_backlog())
+        for idx, acc in enumerate(accounts_snapshot(), start=1):
             phone = acc["phone"]
-            if filter_str and filter_str not in phone:
-                continue
-            row = ttk.Frame(inner_frame)
-            row.pack(fill="x", pady=2, padx=2)
-            def on_number_click(ph=phone):
-                load_account_chats_mgmt(ph)
-            num_btn = ttk.Button(row, text=f"{idx}번", width=6,
-                                 command=lambda ph=phone: on_number_click(ph))
-            num_btn.pack(side="left")
-            ttk.Label(row, text=phone, width=18, anchor="center").pack(side="left", padx=5)
-            var = tk.BooleanVar(value=True)
-            account_active_map[phone] = True
-            def on_check_changed(ph=phone, v=var):
-                account_active_map[ph] = v.get()
-            chk = ttk.Checkbutton(row, text="활성화", variable=var,
-                                  command=lambda ph=phone, v=var: on_check_changed(ph, v))
-            chk.pack(side="left", padx=5)
-            def on_delete_account(ph=phone):
-                confirm = messagebox.askyesno("계정 삭제", f"정말로 {ph} 계정을 삭제하시겠습니까?")
-                if confirm:
-                    old_list = load_accounts()
-                    session_name = None
-                    for a in old_list:
-                        if a["phone"] == ph:
-                            session_name = a.get("session_name", f"session_{ph}")
-                            break
-                    new_list = [x for x in old_list if x["phone"] != ph]
-                    save_accounts(new_list)
-                    messagebox.showinfo("알림", f"{ph} 계정이 삭제되었습니다.")
-                    refresh_account_list_mgmt()
-                    if session_name:
-                        session_file = session_name + ".session"
-                        if os.path.exists(session_file):
-                            try:
-                                os.remove(session_file)
-                                print(f"[{ph}] 세션 파일({session_file}) 삭제 완료.")
-                            except Exception as err:
-                                print(f"[{ph}] 세션 파일({session_file}) 삭제 실패: {err}")
-            del_btn = ttk.Button(row, text="삭제", command=lambda ph=phone: on_delete_account(ph))
-            del_btn.pack(side="left", padx=5)
-        canvas.update_idletasks()
-        canvas.configure(scrollregion=canvas.bbox("all"))
+            account_index[phone] = idx
+            row_cache[phone] = account_row_values(phone)
+            account_tree.insert("", "end", iid=phone, values=row_cache[phone])
+        last_filter[0] = None
+        apply_account_filter()
+    def apply_account_filter(*_):
+        filter_str = account_search_var_management.get().strip()
+        prev = last_filter[0]
+        if prev is not None and filter_str.startswith(prev):
+            candidates = visible_phones
+        else:
+            candidates = list(account_index)
+        visible_phones[:] = [p for p in candidates if filter_str in p]
+        last_filter[0] = filter_str
+        place_account_rows()
+    def account_sort_key(phone):
+        col = sort_state[0]
+        values = row_cache.get(phone) or account_row_values(phone)
+        return values[[c[0] for c in account_columns].index(col)]
+    def place_account_rows():
+        order = sorted(visible_phones, key=account_sort_key, reverse=sort_state[1])
+        shown = set(order)
+        hidden = [p for p in account_tree.get_children() if p not in shown]
+        if hidden:
+            account_tree.detach(*hidden)
+        for i, p in enumerate(order):
+            account_tree.move(p, "", i)
+    def sort_account_tree(col):
+        if sort_state[0] == col:
+            sort_state[1] = not sort_state[1]
+        else:
+            sort_state[0], sort_state[1] = col, col != "no"
+        place_account_rows()
+    def update_account_status():
+        # 바뀐 값만 갱신, 상태 컬럼으로 정렬 중이면 순서도 다시
+        backlog.clear()
+        backlog.update(join_backlog())
+        changed = False
+        for phone in account_index:
+            values = account_row_values(phone)
+            if row_cache.get(phone) != values:
+                row_cache[phone] = values
+                account_tree.item(phone, values=values)
+                changed = True
+        if changed and sort_state[0] not in ("no", "phone"):
+            place_account_rows()
+        account_tree.after(2000, update_account_status)
+    def selected_account():
+        sel = account_tree.selection()
+        return sel[0] if sel else None
+    def on_account_tree_select(event):
+        phone = selected_account()
+        if phone and phone != current_selected_phone[0]:
+            load_account_chats_mgmt(phone)
+    def toggle_selected_account_active():
+        phone = selected_account()
+        if not phone:
+            return
+        account_active_map[phone] = not is_account_active(phone)
+        row_cache[phone] = account_row_values(phone)
+        account_tree.item(phone, values=row_cache[phone])
+        if sort_state[0] not in ("no", "phone"):
+            place_account_rows()
+    def on_account_tree_double_click(event):
+        if account_tree.identify_column(event.x) == "#4":
+            toggle_selected_account_active()
+    def delete_selected_account():
+        ph = selected_account()
+        if not ph:
+            return
+        confirm = messagebox.askyesno("계정 삭제", f"정말로 {ph} 계정을 삭제하시겠습니까?")
+        if confirm:
+            old_list = load_accounts()
+            session_name = None
+            for a in old_list:
+                if a["phone"] == ph:
+                    session_name = a.get("session_name", f"session_{ph}")
+                    break
+            new_list = [x for x in old_list if x["phone"] != ph]
+            save_accounts(new_list)
+            messagebox.showinfo("알림", f"{ph} 계정이 삭제되었습니다.")
+            refresh_account_list_mgmt()
+            if session_name:
+                forget_session_snapshot(session_name)
+                session_file = session_name + ".session"
+                if os.path.exists(session_file):
+                    try:
+                        os.remove(session_file)
+                        print(f"[{ph}] 세션 파일({session_file}) 삭제 완료.")
+                    except Exception as err:
+                        print(f"[{ph}] 세션 파일({session_file}) 삭제 실패: {err}")
+    account_tree.bind("<<TreeviewSelect>>", on_account_tree_select)
+    account_tree.bind("<Double-1>", on_account_tree_double_click)
+    account_search_var_management.trace_add("write", apply_account_filter)
     refresh_account_list_mgmt()
+    account_tree.after(2000, update_account_status)
 
 def build_alert_bot_tab_multi(tab):
     global alert_bot_enabled, alert_notify_chat
@@ -1678,13 +5321,7 @@ def build_alert_bot_tab_multi(tab):
     right_frame = ttk.Frame(main_frame, relief="groove", borderwidth=1)
     right_frame.pack(side="left", fill="both", expand=True, padx=5)
     ttk.Label(right_frame, text="감시 계정의 대화방 목록").pack(pady=3)
-    chat_frame = ttk.Frame(right_frame)
-    chat_frame.pack(fill="both", padx=5, pady=2)
-    chat_scroll = ttk.Scrollbar(chat_frame, orient="vertical")
-    chat_listbox = tk.Listbox(chat_frame, height=10, yscrollcommand=chat_scroll.set, exportselection=False)
-    chat_scroll.config(command=chat_listbox.yview)
-    chat_listbox.pack(side="left", fill="both", expand=True)
-    chat_scroll.pack(side="right", fill="y")
+    chat_browser = DialogBrowser(right_frame)
     ttk.Label(right_frame, text="감시할 방 목록").pack(pady=3)
     watch_room_frame = ttk.Frame(right_frame)
     watch_room_frame.pack(fill="both", padx=5, pady=2)
@@ -1705,13 +5342,12 @@ def build_alert_bot_tab_multi(tab):
     def add_watch_room():
         try:
             selacc = watch_accounts_listbox.get(watch_accounts_listbox.curselection())
-            selchat = chat_listbox.get(chat_listbox.curselection())
         except:
             return
         phone = selacc.strip()
-        cid = parse_chat_id_from_string(selchat)
+        cid = chat_browser.selected_chat_id()
         if cid is None:
-            messagebox.showerror("오류", "방 ID 파싱 실패")
+            messagebox.showinfo("알림", "대화방 목록에서 선택하세요.")
             return
         acc_list = load_accounts()
         for a in acc_list:
@@ -1723,6 +5359,7 @@ def build_alert_bot_tab_multi(tab):
                 break
         save_accounts(acc_list)
         refresh_watch_rooms()
+        chat_browser.refresh(keep_page=True)
     def remove_watch_room():
         try:
             selacc = watch_accounts_listbox.get(watch_accounts_listbox.curselection())
@@ -1744,46 +5381,24 @@ def build_alert_bot_tab_multi(tab):
                 break
         save_accounts(acc_list)
         refresh_watch_rooms()
+        chat_browser.refresh(keep_page=True)
     room_btn_frame = ttk.Frame(right_frame)
     room_btn_frame.pack(pady=5)
     ttk.Button(room_btn_frame, text="➕ 추가", command=add_watch_room).pack(side="left", padx=5)
     ttk.Button(room_btn_frame, text="🗑 삭제", command=remove_watch_room).pack(side="left", padx=5)
     def refresh_chat_listbox_for_account(phone):
-        chat_listbox.delete(0, tk.END)
-        if phone not in clients:
-            chat_listbox.insert(tk.END, "해당 계정 클라이언트가 준비되지 않음")
-            return
-        c = clients[phone]
-        loop = client_loops.get(phone)
-        if not loop:
-            chat_listbox.insert(tk.END, "해당 계정의 event loop 없음")
-            return
-        async def fetch_dialogs():
-            results = []
-            async for d in c.iter_dialogs():
-                results.append((d.name, d.id))
-            return results
-        future = asyncio.run_coroutine_threadsafe(fetch_dialogs(), loop)
-        try:
-            dialogs = future.result(timeout=10)
-            if not dialogs:
-                chat_listbox.insert(tk.END, "대화방 없음")
-            else:
-                for nm, cid in dialogs:
-                    chat_listbox.insert(tk.END, f"{nm} (ID={cid})")
-        except Exception as e:
-            chat_listbox.insert(tk.END, f"불러오기 실패: {e}")
+        chat_browser.load(phone)
     def refresh_all_accounts_list():
         all_accounts_listbox.delete(0, tk.END)
         filter_str = alert_search_var.get().strip()
-        for acc in load_accounts():
+        for acc in accounts_snapshot():
             ph = acc["phone"]
             if filter_str and filter_str not in ph:
                 continue
             all_accounts_listbox.insert(tk.END, ph)
     def refresh_watch_accounts_list():
         watch_accounts_listbox.delete(0, tk.END)
-        for acc in load_accounts():
+        for acc in accounts_snapshot():
             if acc.get("alert_monitor", False):
                 watch_accounts_listbox.insert(tk.END, acc["phone"])
         if watch_accounts_listbox.size() > 0:
@@ -1791,7 +5406,7 @@ def build_alert_bot_tab_multi(tab):
                 watch_accounts_listbox.select_set(0)
                 watch_accounts_listbox.event_generate("<<ListboxSelect>>")
     def refresh_chat_listbox():
-        chat_listbox.delete(0, tk.END)
+        chat_browser.clear()
         try:
             selacc = watch_accounts_listbox.get(watch_accounts_listbox.curselection())
         except:
@@ -1809,30 +5424,13 @@ def build_alert_bot_tab_multi(tab):
         if not acc:
             return
         rlist = acc.get("alert_rooms", [])
+        request = new_gui_request("alert_rooms")
         if not rlist:
             watch_room_listbox.insert(tk.END, "감시할 방 없음")
-        else:
-            if phone not in clients:
-                for cid in rlist:
-                    watch_room_listbox.insert(tk.END, f"ID={cid}")
-                return
-            c = clients[phone]
-            loop = client_loops.get(phone)
-            async def find_name(cid):
-                async for d in c.iter_dialogs():
-                    if d.id == cid:
-                        return d.name
-                return None
-            for cid in rlist:
-                future = asyncio.run_coroutine_threadsafe(find_name(cid), loop)
-                nm = "Unknown"
-                try:
-                    res = future.result(timeout=5)
-                    if res:
-                        nm = res
-                except:
-                    pass
-                watch_room_listbox.insert(tk.END, f"{nm} (ID={cid})")
+            return
+        for idx, cid in enumerate(rlist):
+            watch_room_listbox.insert(tk.END, f"ID={cid}")
+            fill_chat_name_row(watch_room_listbox, idx, phone, cid, request)
     def on_watch_account_select(e):
         refresh_chat_listbox()
         refresh_watch_rooms()
@@ -1848,6 +5446,7 @@ def build_alert_bot_tab_multi(tab):
 
 def update_expert_handlers():
     global expert_mode_enabled, expert_accounts, expert_event_handlers, expert_handler_registered
+    refresh_account_profiles()
     for phone, hs in list(expert_event_handlers.items()):
         new_h, edit_h, del_h = hs
         client = clients.get(phone)
@@ -1862,6 +5461,9 @@ def update_expert_handlers():
             client = clients.get(phone)
             if not client or phone in expert_handler_registered:
                 continue
+            if phone in promoting_accounts:
+                print(f"[전문가] {phone} 지연 연결 계정 → 다시 연결한 뒤 핸들러 등록")
+                continue
             new_h = make_expert_handler(phone)
             client.add_event_handler(new_h, events.NewMessage)
             edit_h = make_expert_edit_handler(phone)
@@ -1881,6 +5483,7 @@ def make_expert_edit_handler(phone):
         key = (phone, event.chat_id, event.id)
         if key not in delete_map:
             return
+        trace = SendTrace("edit", phone, trace_id=trace_links.get(key))
         for (cid, fwd_id) in delete_map[key]:
             try:
                 await clients[phone].edit_message(
@@ -1888,8 +5491,11 @@ def make_expert_edit_handler(phone):
                     formatting_entities=event.message.entities,
                     file=event.media if event.media else None
                 )
+                trace.sent(cid)
             except Exception as e:
+                trace.failed(cid, e)
                 print(f"[전문가 편집 오류] {e}")
+        trace.done()
     return handler
 
 def make_expert_delete_handler(phone):
@@ -1897,12 +5503,14 @@ def make_expert_delete_handler(phone):
         key = (phone, event.chat_id, event.id)
         if key not in delete_map:
             return
-        for (cid, fwd_id) in delete_map[key]:
-            try:
-                await clients[phone].delete_messages(cid, fwd_id)
-            except Exception as e:
+        targets = delete_map.pop(key)
+        trace = SendTrace("delete", phone, trace_id=trace_links.pop(key, None))
+        results = await asyncio.gather(*(trace.run(cid, delete_messages_batched(clients[phone], cid, fwd_id))
+                                         for (cid, fwd_id) in targets), return_exceptions=True)
+        trace.done()
+        for e in results:
+            if isinstance(e, Exception):
                 print(f"[전문가 삭제 오류] {e}")
-        delete_map.pop(key, None)
     return handler
 
 async def expert_new_message_handler(event, phone):
@@ -1923,6 +5531,7 @@ async def expert_new_message_handler(event, phone):
     display_name = (last_n + " " + first_n).strip() or sender.username or ""
     if display_name not in expert_names:
         return
+    trace = SendTrace("expert", phone, event.message)
     try:
         ent_main = await client.get_input_entity(acc["main_chat_id"])
         if event.text and not event.media:
@@ -1938,11 +5547,14 @@ async def expert_new_message_handler(event, phone):
             )
         key = (phone, event.chat_id, event.id)
         delete_map.setdefault(key, []).append((acc["main_chat_id"], sent_main.id))
+        trace.sent(acc["main_chat_id"])
         subrooms = acc.get("subroom_ids", [])
         if subrooms:
-            await forward_to_subrooms_expert(client, acc, key, sent_main, target_rooms=subrooms)()
+            await forward_to_subrooms_expert(client, acc, key, sent_main, target_rooms=subrooms, trace=trace)()
     except Exception as e:
+        trace.failed(acc["main_chat_id"], e)
         print(f"[전문가 복사 오류] {e}")
+    trace.done()
 
 def add_copy_handler(client, phone):
     global copy_handler_registered, expert_accounts
@@ -1954,6 +5566,7 @@ def add_copy_handler(client, phone):
     async def copy_new_msg(e):
         if not copy_enabled:
             return
+        received = time.monotonic()
         sender = await e.get_sender()
         sender_id = sender.id
         first_n = sender.first_name or ""
@@ -1962,7 +5575,7 @@ def add_copy_handler(client, phone):
         if sender_fullname in copy_exclude_senders:
             copy_sender_mapping.pop(sender_id, None)
             return
-        allacc = load_accounts()
+        allacc = accounts_snapshot()
         valid_acc = [a for a in allacc if a["phone"] not in copy_exclude_senders]
         if not valid_acc:
             return
@@ -1989,6 +5602,9 @@ def add_copy_handler(client, phone):
         if not tgt_client or not tgt_loop:
             return
         async def forward_msg():
+            trace = SendTrace("copy", chosen_phone, e.message, received)
+            trace.link((sender_id, e.id))
+            main_id = None
             try:
                 acc_details = get_account_by_phone(chosen_phone)
                 main_id = acc_details.get("main_chat_id")
@@ -1996,6 +5612,7 @@ def add_copy_handler(client, phone):
                     return
                 ent_main = await tgt_client.get_input_entity(main_id)
                 if e.media:
+                    # 위에서 phone == chosen_phone 만 남기므로 받은 계정이 보냄 → 원본 미디어 그대로
                     sent = await tgt_client.send_file(
                         ent_main, file=e.media,
                         caption=e.raw_text,
@@ -2007,11 +5624,14 @@ def add_copy_handler(client, phone):
                         formatting_entities=e.message.entities
                     )
                 copy_msg_mapping[(sender_id, e.id)] = (chosen_phone, sent.id)
+                trace.sent(main_id)
                 subrooms = acc_details.get("subroom_ids", [])
                 if subrooms:
-                    await forward_to_subrooms(tgt_client, acc_details, sent, target_rooms=subrooms)()
+                    await forward_to_subrooms(tgt_client, acc_details, sent, target_rooms=subrooms, trace=trace)()
             except Exception as ex:
+                trace.failed(main_id, ex)
                 print(f"[방배끼기 전송 오류] {ex}")
+            trace.done()
         asyncio.run_coroutine_threadsafe(forward_msg(), tgt_loop)
     @client.on(events.MessageEdited(func=lambda e: e.chat_id in copy_source_chats))
     async def copy_edit_msg(e):
@@ -2030,14 +5650,29 @@ def add_copy_handler(client, phone):
         main_id = acc_details.get("main_chat_id")
         if not main_id:
             return
+        trace = SendTrace("edit", tgt_phone, trace_id=trace_links.get(key))
+        file, options = None, {}
+        if e.media:
+            try:
+                file, options = await account_media(client, tgt_client, tgt_phone, e.message)
+                options.pop("mime_type", None)
+            except Exception as ex:
+                print(f"[방배끼기 편집 미디어 오류] {ex}")
+                file = e.media
         try:
-            await tgt_client.edit_message(
+            edited = await tgt_client.edit_message(
                 main_id, fwd_id,
                 e.raw_text,
                 formatting_entities=e.message.entities,
-                file=e.media if e.media else None
+                file=file, **options
             )
+            if e.media and client is not tgt_client:
+                remember_media(tgt_phone, e.message, edited)
+            trace.sent(main_id)
         except Exception as ex:
+            if isinstance(ex, (FileReferenceExpiredError, MediaEmptyError)):
+                forget_media(tgt_phone, e.message)
+            trace.failed(main_id, ex)
             print(f"[방배끼기 편집 오류] {ex}")
         key2 = (tgt_phone, fwd_id)
         if key2 in delete_map:
@@ -2047,10 +5682,13 @@ def add_copy_handler(client, phone):
                         sid, smid,
                         e.raw_text,
                         formatting_entities=e.message.entities,
-                        file=e.media if e.media else None
+                        file=file, **options
                     )
+                    trace.sent(sid)
                 except Exception as ex2:
+                    trace.failed(sid, ex2)
                     print(f"[방배끼기 서브 편집 오류] {ex2}")
+        trace.done()
     @client.on(events.MessageDeleted(func=lambda e: e.chat_id in copy_source_chats))
     async def copy_del_msg(e):
         sender = None
@@ -2071,22 +5709,28 @@ def add_copy_handler(client, phone):
             main_id = acc_details.get("main_chat_id")
             if not main_id:
                 continue
+            trace = SendTrace("delete", tgt_phone, trace_id=trace_links.pop(key, None))
             try:
                 await tgt_client.delete_messages(main_id, fwd_id)
+                trace.sent(main_id)
             except Exception as ex:
+                trace.failed(main_id, ex)
                 print(f"[방배끼기 메인 삭제 오류] {ex}")
             key2 = (tgt_phone, fwd_id)
+            trace_links.pop(key2, None)
             if key2 in delete_map:
-                for (sid, smid) in delete_map[key2]:
-                    try:
-                        await tgt_client.delete_messages(sid, smid)
-                    except Exception as ex2:
+                results = await asyncio.gather(*(trace.run(sid, delete_messages_batched(tgt_client, sid, smid))
+                                                 for (sid, smid) in delete_map.pop(key2)),
+                                               return_exceptions=True)
+                for ex2 in results:
+                    if isinstance(ex2, Exception):
                         print(f"[방배끼기 서브 삭제 오류] {ex2}")
-                delete_map.pop(key2, None)
+            trace.done()
     copy_handler_registered.add(phone)
 
 def run_copy_monitor():
-    time.sleep(5)
+    if not all_accounts_ready.wait(timeout=startup_ready_timeout):
+        print("방배끼기: 일부 계정이 아직 준비되지 않았습니다. 준비된 계정만 등록합니다.")
     if not clients:
         print("방배끼기: 등록된 클라이언트가 없습니다.")
         return
@@ -2122,7 +5766,7 @@ def open_add_account_window():
         if not session_val:
             messagebox.showwarning("경고", "Session Name을 입력하세요.")
             return
-        accounts = load_accounts()
+        accounts = accounts_snapshot()
         is_dup = any(acc.get("session_name", f"session_{acc['phone']}") == session_val for acc in accounts)
         if is_dup:
             messagebox.showerror("중복", "이미 사용 중인 세션 이름입니다.")
@@ -2164,7 +5808,7 @@ def open_add_account_window():
             t = Thread(target=start_loop, args=(loop,), daemon=True)
             t.start()
         async def send_code():
-            c = TelegramClient(session_val, int(api_id_val), api_hash_val)
+            c = TelegramClient(open_session(session_val), int(api_id_val), api_hash_val)
             await c.connect()
             await c.send_code_request(phone_val)
             auth_client[0] = c
@@ -2182,6 +5826,7 @@ def open_add_account_window():
         api_hash_val = api_hash_entry.get().strip()
         pwd_val = password_entry.get().strip()
         code_val = code_entry.get().strip()
+        session_val = session_entry.get().strip()
         if not (phone_val and api_id_val and api_hash_val and code_val):
             messagebox.showwarning("경고", "모든 필드를 입력하세요.")
             return
@@ -2201,6 +5846,7 @@ def open_add_account_window():
             except Exception as e:
                 await c.sign_in(password=pwd_val)
             await c.disconnect()
+            save_session_snapshots({session_val})
         future = asyncio.run_coroutine_threadsafe(do_signin(), auth_loop[0])
         try:
             future.result()
@@ -2256,18 +5902,26 @@ def start_gui():
     tab_account = ttk.Frame(notebook)
     tab_alert = ttk.Frame(notebook)
     tab_admin = ttk.Frame(notebook)  # 관리자 관리 탭
+    tab_metrics = ttk.Frame(notebook)
+    tab_rooms = ttk.Frame(notebook)
     notebook.add(tab_main, text="메인")
     notebook.add(tab_copy, text="방배끼기")
     notebook.add(tab_expert, text="전문가 셋팅")
     notebook.add(tab_account, text="계정관리")
     notebook.add(tab_alert, text="방 알림 봇")
     notebook.add(tab_admin, text="관리자 관리")
+    notebook.add(tab_metrics, text="지표")
+    notebook.add(tab_rooms, text="방 상태")
     build_main_tab(tab_main)
     build_copy_tab(tab_copy)
     build_expert_tab(tab_expert)
     build_account_management_tab(tab_account)
     build_alert_bot_tab_multi(tab_alert)
     build_admin_tab(tab_admin)
+    build_metrics_tab(tab_metrics)
+    build_room_health_tab(tab_rooms)
+    root.after(gui_result_interval, drain_gui_results)
+    watch_tk(root)
     root.mainloop()
 
 if __name__ == "__main__":
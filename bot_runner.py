@@ -1,11 +1,12 @@
 import asyncio
+from threading import Thread
 from bot_gui import (
     ensure_config_files,
     load_accounts,
     login_accounts,
+    start_background_services,
     account_task,
-    run_copy_monitor,
-    update_alert_handlers,
+    on_accounts_ready,
 )
 
 if __name__ == "__main__":
@@ -16,19 +17,18 @@ if __name__ == "__main__":
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
 
-    # 3) 계정 로그인 (세션 생성 및 이벤트 핸들러 등록)
-    loop.run_until_complete(login_accounts())
+    # 3) 계정 로그인 (동시 연결/인증, 연결은 유지)
+    accounts = load_accounts()
+    loop.run_until_complete(login_accounts(accounts))
+    loop.run_until_complete(start_background_services())
 
-    # 4) 각 계정별 백그라운드 태스크 시작
-    for acc in load_accounts():
-        loop.create_task(account_task(acc))
+    # 4) 각 계정별 백그라운드 태스크 시작 (로그인 때 연결한 클라이언트 재사용)
+    for idx, acc in enumerate(accounts):
+        loop.create_task(account_task(acc, idx))
 
-    # 5) 방배끼기 모니터 켜기
-    run_copy_monitor()
+    # 5) 모든 계정 준비 후 방배끼기 모니터 켜기 + 알림 핸들러 등록
+    Thread(target=on_accounts_ready, daemon=True).start()
 
-    # 6) 알림 핸들러 등록 상태 갱신
-    update_alert_handlers()
-
-    # 7) 무한 대기 → Ctrl+C로 종료
+    # 6) 무한 대기 → Ctrl+C로 종료
     print("▶ Bot runner started. Press Ctrl+C to stop.")
     loop.run_forever()